@@ -0,0 +1,203 @@
+from owlready2 import *
+from scripts.ontology_parser import OntologyParser
+from scripts.savepoint import WorldSavepoint
+from collections import defaultdict
+import argparse
+import json
+import logging
+import platform
+import resource
+import time
+
+logging.getLogger("owlready2").setLevel(logging.ERROR)
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Number of rows of every run, "full" is the whole dataset.
+DATASET_SIZES = ["5", "100", "1000", "full"]
+
+# Methods of the RuleCreator timed as stages of the pipeline.
+# Stages calling each other (e.g. observations_to_classes calling create_instances) include the time of the inner stage.
+RULE_CREATOR_STAGES = ["create_instances", "observations_to_classes", "assign_values", "set_up_rules", "create_label", "remove_prev_values"]
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of the process (Linux only), returns whether it could be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the process in MB, since the last reset_peak_rss.
+    Falls back to the peak of the whole process when /proc is not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimer:
+    """
+    StageTimer collects the wall time and peak RSS of every call of the instrumented stages.
+    """
+
+    def __init__(self):
+        self.stages = defaultdict(lambda: {"calls": 0, "total_s": 0.0, "max_s": 0.0, "peak_rss_mb": 0.0})
+        self.depth = 0
+        self.syncs_in_row = 0
+
+
+    def measure(self, stage, function, *args, **kwargs):
+        """
+        Calls the function and records its wall time and peak RSS under the stage name.
+        The peak RSS is only reset by the outermost stage, so that nested stages do not hide the peak of their caller.
+        """
+        if self.depth == 0:
+            reset_peak_rss()
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.depth -= 1
+            record = self.stages[stage]
+            record["calls"] += 1
+            record["total_s"] += elapsed
+            record["max_s"] = max(record["max_s"], elapsed)
+            record["peak_rss_mb"] = max(record["peak_rss_mb"], peak_rss_mb())
+
+
+    def wrap(self, stage, function):
+        """
+        Returns the function timed under the stage name.
+        """
+        def timed(*args, **kwargs):
+            return self.measure(stage, function, *args, **kwargs)
+        return timed
+
+
+    def wrap_synchronize(self, function):
+        """
+        Returns synchronize_ontology timed separately for every call of a row
+        (synchronize_ontology_1 after the observations, synchronize_ontology_2 after the rules).
+        """
+        def timed(*args, **kwargs):
+            self.syncs_in_row += 1
+            return self.measure(f"synchronize_ontology_{self.syncs_in_row}", function, *args, **kwargs)
+        return timed
+
+
+    def end_row(self, function):
+        """
+        Returns the function closing a row, resetting the count of synchronizations.
+        """
+        def closing(*args, **kwargs):
+            self.syncs_in_row = 0
+            return function(*args, **kwargs)
+        return closing
+
+
+    def report(self):
+        """
+        Returns the recorded stages, with the mean time of every call.
+        """
+        report = {}
+        for stage, record in self.stages.items():
+            report[stage] = dict(record, mean_s=record["total_s"] / record["calls"])
+        return report
+
+
+def instrument(parser, timer):
+    """
+    Replaces the stages of the parser with timed versions.
+    """
+    rule_parser = parser.rule_parser
+    for stage in RULE_CREATOR_STAGES:
+        setattr(rule_parser, stage, timer.wrap(stage, getattr(rule_parser, stage)))
+    rule_parser.synchronize_ontology = timer.wrap_synchronize(rule_parser.synchronize_ontology)
+    rule_parser.create_label = timer.end_row(rule_parser.create_label)
+    parser.ontology.save = timer.wrap("ontology.save", parser.ontology.save)
+
+
+def run_benchmark(ontology_file, dataset_file, rows, reasoner, snapshot_path=None):
+    """
+    Runs the serial pipeline on the first rows of the dataset in a new World and returns the timings.
+    Args:
+      - ontology_file: The path to in_cabin_domain.rdf.
+      - dataset_file: The path to test_set_ontology.csv.
+      - rows: The number of rows, None for the whole dataset.
+      - reasoner: The reasoner of the OntologyParser.
+      - snapshot_path: An optional snapshot opened instead of the ontology file.
+    """
+    timer = StageTimer()
+    world = World() if snapshot_path is None else None
+    parser = timer.measure("ontology_load", OntologyParser, ontology_file, logger, reasoner=reasoner, world=world, snapshot_path=snapshot_path)
+    instrument(parser, timer)
+
+    rollback = WorldSavepoint.rollback
+    WorldSavepoint.rollback = timer.wrap("savepoint.rollback", rollback)
+    try:
+        start = time.perf_counter()
+        message = parser.parse_observations(dataset_path=dataset_file, max_rows=rows)
+        total = time.perf_counter() - start
+    finally:
+        WorldSavepoint.rollback = rollback
+        parser.close()
+        if world is not None: 
+            world.close()
+
+    return {
+        "rows": len(parser.labels),
+        "message": message,
+        "total_s": total,
+        "rows_per_s": len(parser.labels) / total if total else None,
+        "stages": timer.report(),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the stages of the OntologyParser pipeline.")
+    arg_parser.add_argument("--sizes", nargs="+", default=DATASET_SIZES, help="Numbers of rows of the runs, 'full' for the whole dataset.")
+    arg_parser.add_argument("--reasoner", choices=["pellet", "pellet_session", "native", "sql"], default="pellet")
+    arg_parser.add_argument("--snapshot", default=None, help="Open this snapshot instead of in_cabin_domain.rdf (see scripts/snapshot.py).")
+    arg_parser.add_argument("--output", default="benchmark_results.json")
+    args = arg_parser.parse_args()
+
+    parent_dir = os.getcwd()
+    ontology_file = os.path.join(parent_dir, "ontologies", "in_cabin_domain.rdf")
+    dataset_file = os.path.join(parent_dir, "data", "test_set_ontology.csv")
+
+    results = {
+        "reasoner": args.reasoner,
+        "snapshot": args.snapshot,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "peak_rss_per_stage": reset_peak_rss(),
+        "runs": [],
+    }
+    for size in args.sizes:
+        rows = None if size == "full" else int(size)
+        result = run_benchmark(ontology_file, dataset_file, rows, args.reasoner, args.snapshot)
+        results["runs"].append(result)
+        print(f"{result['rows']} rows in {result['total_s']:.2f}s.")
+
+        # Save after every run, so that the finished runs are kept if a longer one is interrupted.
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    print(f"Results saved in {args.output}")
+
+if __name__ == "__main__":
+    main()
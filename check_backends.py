@@ -0,0 +1,64 @@
+from owlready2 import *
+from check_missing_values import parse
+import owlready2
+import argparse
+import logging
+import shutil
+import sys
+import tempfile
+
+logging.getLogger("owlready2").setLevel(logging.ERROR)
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+def parses(batch_size, workers, java):
+    """
+    Returns the parses compared with the serial native one: name -> (reasoner, parse_observations arguments).
+    The Pellet backends are only compared when Java is available.
+    """
+    compared = {
+        "serial sql": ("sql", {}),
+        "batch native": ("native", {"batch_size": batch_size}),
+        "batch sql": ("sql", {"batch_size": batch_size}),
+        "sharded native": ("native", {"batch_size": batch_size, "workers": workers}),
+        "sharded sql": ("sql", {"batch_size": batch_size, "workers": workers}),
+    }
+    if java:
+        compared["serial pellet"] = ("pellet", {})
+        compared["serial pellet_session"] = ("pellet_session", {})
+    return compared
+
+
+def main():
+    """
+    Checks that the reasoner backends and parsing modes give the same labels as the native engine on the first rows of the dataset.
+    """
+    arg_parser = argparse.ArgumentParser(description="Compare the labels of the reasoner backends and parsing modes.")
+    arg_parser.add_argument("--rows", type=int, default=40)
+    arg_parser.add_argument("--batch-size", type=int, default=10)
+    arg_parser.add_argument("--workers", type=int, default=2)
+    args = arg_parser.parse_args()
+
+    parent_dir = os.getcwd()
+    ontology_file = os.path.join(parent_dir, "ontologies", "in_cabin_domain.rdf")
+    dataset_file = os.path.join(parent_dir, "data", "test_set_ontology.csv")
+    java = shutil.which(owlready2.JAVA_EXE) is not None
+    if not java:
+        print(f"Java ({owlready2.JAVA_EXE}) not found, the Pellet backends are not compared.")
+
+    different = 0
+    with tempfile.TemporaryDirectory() as directory:
+        reference = parse(ontology_file, dataset_file, "native", directory, max_rows=args.rows)
+        for name, (reasoner, kwargs) in parses(args.batch_size, args.workers, java).items():
+            labels = parse(ontology_file, dataset_file, reasoner, directory, max_rows=args.rows, **kwargs)
+            rows = [index for index in reference if reference[index] != labels.get(index)] + [index for index in labels if index not in reference]
+            for index in rows:
+                print(f"{name}, row {index}: native {reference.get(index)}, {name} {labels.get(index)}")
+            print(f"{name}: {len(labels)} labels, {len(rows)} different from serial native.")
+            different += len(rows)
+    return 1 if different else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
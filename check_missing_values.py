@@ -0,0 +1,69 @@
+from owlready2 import *
+from scripts.ontology_parser import OntologyParser
+from scripts.label_sink import JsonLinesLabelSink
+import pandas as pd
+import argparse
+import logging
+import sys
+import tempfile
+
+logging.getLogger("owlready2").setLevel(logging.ERROR)
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Columns blanked in the rows of the check: column -> every how many rows, from which row.
+BLANKED_COLUMNS = {"Age": (1, 0), "Sex": (4, 1), "HR": (5, 2), "Characteristics": (7, 3), "DROWSY": (6, 5)}
+
+
+def compared_fields(label):
+    """
+    Returns the fields of a label that must not depend on the parsing mode (every field but the random actor_id).
+    """
+    return {field: value for field, value in label["label"].items() if field != "actor_id"}
+
+
+def parse(ontology_file, dataset_file, reasoner, directory, **kwargs):
+    """
+    Labels the dataset in a World of its own and returns the compared fields of the labels, keyed by row index.
+    """
+    parser = OntologyParser(ontology_file, logger, reasoner=reasoner, world=World())
+    sink = JsonLinesLabelSink(os.path.join(directory, "labels.jsonl"))
+    message = parser.parse_observations(dataset_file, label_sink=sink, **kwargs)
+    sink.close()
+    parser.close()
+    if parser.row_errors:
+        raise RuntimeError(f"{message} {len(parser.row_errors)} rows failed: {parser.row_errors}")
+    return {index: compared_fields(label) for index, label in parser.labels.items()}
+
+
+def main():
+    """
+    Checks that the serial and batch paths give the same labels to rows with missing values (see MISSING_VALUE).
+    """
+    arg_parser = argparse.ArgumentParser(description="Compare the serial and batch labels of rows with missing values.")
+    arg_parser.add_argument("--rows", type=int, default=40)
+    arg_parser.add_argument("--reasoner", choices=["native", "sql", "pellet"], default="native")
+    arg_parser.add_argument("--batch-size", type=int, default=10)
+    args = arg_parser.parse_args()
+
+    parent_dir = os.getcwd()
+    ontology_file = os.path.join(parent_dir, "ontologies", "in_cabin_domain.rdf")
+    rows = pd.read_csv(os.path.join(parent_dir, "data", "test_set_ontology.csv"), nrows=args.rows)
+    for column, (step, start) in BLANKED_COLUMNS.items():
+        rows.loc[start::step, column] = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        dataset_file = os.path.join(directory, "missing_values.csv")
+        rows.to_csv(dataset_file, index=False)
+        serial = parse(ontology_file, dataset_file, args.reasoner, directory)
+        batch = parse(ontology_file, dataset_file, args.reasoner, directory, batch_size=args.batch_size)
+
+    different = [index for index in serial if serial[index] != batch.get(index)] + [index for index in batch if index not in serial]
+    for index in different:
+        print(f"Row {index}: serial {serial.get(index)}, batch {batch.get(index)}")
+    print(f"{len(serial)} rows with missing values compared, {len(different)} different labels.")
+    return 1 if different else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
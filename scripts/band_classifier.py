@@ -0,0 +1,142 @@
+from owlready2 import *
+from scripts.rule_creator import AGE_RULES, KSS_LEVELS
+from scripts.batch_rule_creator import MISSING_VALUE
+from scripts.thresholds import ThresholdRegistry, VITAL_BANDS, VITAL_COLUMNS
+import numpy as np
+import pandas as pd
+
+
+class BandClassifier:
+    """
+    BandClassifier classifies whole columns of observations into the threshold ranges
+    (bands) used by the SWRL rules, without going through the reasoner.
+
+    The thresholds are read once from the hasThrValue of the *_THR individuals of the ontology
+    into a ThresholdRegistry, the age groups and KSS levels are the ones used by the RuleCreator.
+    Every row is then classified with NumPy operations over the full columns.
+
+    NOTE: The age rules overlap at 18, where the reasoner assigns both Young and Adult groups.
+    Here the first matching group in AGE_RULES (Young) is kept, so that every row has a single band.
+    """
+
+    def __init__(self, ontology):
+        """
+        Args:
+            ontology (Ontology): The ontology holding the threshold individuals.
+        """
+        self.ontology = ontology
+        self.age_groups = [rule[0] for rule in AGE_RULES]
+        self.registry = ThresholdRegistry(ontology)
+        self.thresholds = self.registry.thresholds
+
+
+    @staticmethod
+    def compare(values, bound, inclusive, lower):
+        """
+        Compares the values with a bound (scalar or array). A None bound always matches.
+        """
+        if bound is None:
+            return np.ones(values.shape, dtype=bool)
+        if lower:
+            return values >= bound if inclusive else values > bound
+        return values <= bound if inclusive else values < bound
+
+
+    @staticmethod
+    def to_categorical(conditions, bands, length):
+        """
+        Turns the band conditions into a categorical column, rows matching no band are missing.
+        """
+        codes = np.select(conditions, np.arange(len(bands)), default=-1) if conditions else np.full(length, -1)
+        return pd.Categorical.from_codes(codes, categories=bands)
+
+
+    @staticmethod
+    def numeric_column(dataset, name):
+        """
+        Returns a column of the dataset as floats, NaN where the value (or the column) is missing.
+        """
+        if name not in dataset.columns:
+            return np.full(len(dataset), np.nan)
+        return pd.to_numeric(dataset[name], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+    def age_conditions(self, ages):
+        """
+        Returns, for every rule of determine_age, whether the ages match it.
+        Args:
+            ages (ndarray): The ages of the actors.
+        """
+        conditions = []
+        for rule in AGE_RULES:
+            condition = np.ones(ages.shape, dtype=bool)
+            for builtin, value in zip(rule[1::2], rule[2::2]):
+                lower = builtin.startswith("greater")
+                condition &= self.compare(ages, value, builtin.endswith("OrEqual"), lower)
+            conditions.append(condition)
+        return conditions
+
+
+    def classify_age(self, ages):
+        """
+        Classifies the ages into the age groups of determine_age.
+        Args:
+            ages (ndarray): The ages of the actors.
+        """
+        return self.to_categorical(self.age_conditions(ages), self.age_groups, len(ages))
+
+
+    def classify_vital(self, vital, values, age_groups):
+        """
+        Classifies the values of a vital sign into its bands, using the thresholds
+        of the age group of every row.
+        Args:
+            vital (str): HR, HRV, RR or SpO2.
+            values (ndarray): The values of the vital sign.
+            age_groups (Categorical): The age group of every row.
+        """
+        return self.registry.band(vital, age_groups, values)
+
+
+    def classify_drowsiness(self, values):
+        """
+        Classifies the DROWSY values into the KSS levels of determine_drowsiness.
+        """
+        conditions = [(values > lower) & (values <= upper) for _, lower, upper in KSS_LEVELS]
+        return self.to_categorical(conditions, [level[0] for level in KSS_LEVELS], len(values))
+
+
+    def classify(self, dataset):
+        """
+        Classifies every row of the dataset in one pass.
+        Args:
+            dataset (DataFrame): Observations with the columns of test_set_ontology.csv.
+        Returns:
+            DataFrame with one categorical column per vital sign (Age, HR, HRV, RR, SpO2, Drowsiness),
+            holding the names of the ontology classes.
+        """
+        age_groups = self.classify_age(self.numeric_column(dataset, "Age"))
+        bands = {"Age": age_groups}
+        for vital, column_name in VITAL_COLUMNS.items():
+            bands[vital] = self.classify_vital(vital, self.numeric_column(dataset, column_name), age_groups)
+        bands["Drowsiness"] = self.classify_drowsiness(self.numeric_column(dataset, "DROWSY"))
+        return pd.DataFrame(bands, index=dataset.index)
+
+
+    def state_keys(self, dataset):
+        """
+        Returns the discretized state of every row, as a tuple of the class names of classify
+        (None for a missing band), to be used as the key of the InferenceCache.
+        The missing values are classified as MISSING_VALUE, the value the parser asserts in their place,
+        so that a row with a missing Age is keyed with the Young group the reasoner assigns it.
+        Rows whose age matches more than one age group (e.g. 18) get no key, since the reasoner
+        applies the thresholds of every group they belong to.
+        Args:
+            dataset (DataFrame): Observations with the columns of test_set_ontology.csv.
+        """
+        columns = ["Age", "DROWSY", *VITAL_COLUMNS.values()]
+        reasoned = pd.DataFrame({column: np.nan_to_num(self.numeric_column(dataset, column), nan=MISSING_VALUE) for column in columns}, index=dataset.index)
+        bands = self.classify(reasoned)
+        bands = bands.astype(object).where(bands.notna(), None)
+        overlapping = np.sum(self.age_conditions(self.numeric_column(reasoned, "Age")), axis=0) > 1
+        return [None if overlap else key for key, overlap in zip(bands.itertuples(index=False, name=None), overlapping)]
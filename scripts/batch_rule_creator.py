@@ -0,0 +1,282 @@
+from owlready2 import *
+from scripts.rule_creator import RuleCreator, AGE_RULES, FATIGUE_RULES, EYE_STATES
+from scripts.thresholds import VITAL_BANDS
+import pandas as pd
+import uuid
+import json
+import time
+
+
+# Dataset columns passed to the physiological state individuals of every row: (class, column).
+NUMERICAL_COLUMNS = [("HR", "HR"), ("HRV", "HRV"), ("RR", "RR"), ("SpO2", "SPO2"), ("Drowsiness", "DROWSY")]
+
+# Dataset columns passed to the characteristics individuals of every row: (class, column).
+STRING_COLUMNS = [("Accessories", "Accessories"), ("Demographic", "Demographic"), ("Sex", "Sex"), ("FaceCharacteristics", "Characteristics")]
+
+# Observations data properties filled from the dataset columns.
+OBSERVATION_PROPERTIES = {
+    "HR": "hasHR", "HRV": "hasHRV", "RR": "hasRR", "SPO2": "hasSpO2", "DROWSY": "hasDROWSY",
+    "Accessories": "hasAccessories", "Age": "hasAge", "Sex": "hasSex",
+    "Characteristics": "hasFaceCharacteristics", "Demographic": "hasDemographic",
+}
+
+
+# Value asserted in place of a missing value of a record, as the serial path does: an Age of -1 is Young.
+MISSING_VALUE = -1
+
+
+def is_missing(value):
+    """
+    Whether a value of a dataset record is missing (absent column, None or NaN).
+    """
+    return value is None or pd.isna(value)
+
+
+def record_value(record, column):
+    """
+    Returns the value of a column of a dataset record, MISSING_VALUE if it is missing.
+    """
+    value = record.get(column)
+    return MISSING_VALUE if is_missing(value) else value
+
+
+class BatchRuleCreator(RuleCreator):
+    """
+    This class creates the rules and instances needed to classify many observations
+    with a single reasoner run.
+
+    Every row of the batch gets its own group of individuals (observation_{i}, driver_{i},
+    hr_{i}, ..., age_{i}, fatigue_{i}, label_{i}) connected directly to each other, and the
+    rules are written over variables only, following the actor through ActorHasPhysiologicalState
+    and ActorHasCharacteristics instead of the named singletons used by the RuleCreator.
+    The rules compute the same bands, fatigue and eye states as the RuleCreator rules.
+
+    NOTE: The batch rules must not share a world with the RuleCreator rules: the latter are written 
+    for a single actor and would join every actor of the batch with every physiological state.
+    """
+
+    def __init__(self, ontology_parser):
+        """
+        Initializes the BatchRuleCreator with the provided ontology parser.
+        Args:
+            ontology_parser (OntologyParser): An instance of the OntologyParser class.
+        """
+        super().__init__(ontology_parser)
+        self.batch_rules_ready = False
+        self.batch = []
+
+
+    def determine_batch_age(self):
+        """
+        This function creates the rules categorizing the age of every actor into
+        a group (Young, Adult, Old).
+        """
+        with self.ontology:
+            for rule in AGE_RULES:
+                self.create_instances(rule[0])
+                builtins = ", ".join(f"{builtin}(?age_value, {value})" for builtin, value in zip(rule[1::2], rule[2::2]))
+                age_rule = Imp()
+                age_rule.set_as_rule(
+                    f"""
+                    Age(?age),
+                    hasAgeValue(?age, ?age_value),
+                    {builtins},
+                    {rule[0]}(?age_group) -> AgeBelongsToGroup(?age, ?age_group)
+                    """
+                )
+            self.age_groups = [rule[0].lower() for rule in AGE_RULES]
+            self.age_group_names = [rule[0] for rule in AGE_RULES]
+
+
+    def band_condition(self, vital, bound, inclusive, lower, age):
+        """
+        This function returns the SWRL atoms comparing the value of a vital sign with a bound of a band.
+        Args:
+            vital (str): HR, HRV, RR or SpO2.
+            bound: The level of the threshold individual (e.g. "low"), a number, or None.
+            inclusive (bool): Whether the bound is part of the band.
+            lower (bool): Whether the bound is the lower bound of the band.
+            age (str): The age group of the threshold individual.
+        """
+        if bound is None:
+            return []
+        builtin = ("greaterThan" if lower else "lessThan") + ("OrEqual" if inclusive else "")
+        if not isinstance(bound, str):
+            return [f"{builtin}(?value, {bound})"]
+        threshold = f"{bound}_{vital.lower()}_{age}"
+        return [
+            f"{vital}_THR({threshold})",
+            f"hasThrValue({threshold}, ?{bound}_value)",
+            f"{builtin}(?value, ?{bound}_value)",
+        ]
+
+
+    def determine_batch_bands(self):
+        """
+        This function creates the rules categorizing the HR, HRV, RR and SpO2 of every actor into
+        the threshold ranges of its age group.
+        """
+        with self.ontology:
+            for vital, bands in VITAL_BANDS.items():
+                for i, group in enumerate(self.age_group_names):
+                    age = self.age_groups[i]
+                    for band, lower, lower_inclusive, upper, upper_inclusive in bands:
+                        self.create_instances(band)
+                        conditions = self.band_condition(vital, lower, lower_inclusive, True, age) + self.band_condition(vital, upper, upper_inclusive, False, age)
+                        conditions = ",\n".join(conditions)
+                        band_rule = Imp()
+                        band_rule.set_as_rule(
+                            f"""
+                            Actor(?actor),
+                            ActorHasCharacteristics(?actor, ?age),
+                            AgeBelongsToGroup(?age, ?group),
+                            {group}(?group),
+
+                            ActorHasPhysiologicalState(?actor, ?state),
+                            {vital}(?state),
+                            hasNumericalValue(?state, ?value),
+                            {conditions},
+
+                            {band}(?band) -> {vital}is(?state, ?band)
+                            """)
+
+
+    def determine_batch_fatigue(self):
+        """
+        This function creates the rules estimating the fatigue and the eye state of every actor.
+        """
+        with self.ontology:
+            for hr, hrv, rr, spo2, kss, fatigue in FATIGUE_RULES:
+                self.create_instances(fatigue)
+                fatigue_state = Imp()
+                fatigue_state.set_as_rule(
+                    f"""
+                    Actor(?actor),
+                    ActorHasPhysiologicalState(?actor, ?hr), HRis(?hr, ?hr_val), {hr}(?hr_val),
+                    ActorHasPhysiologicalState(?actor, ?hrv), HRVis(?hrv, ?hrv_val), {hrv}(?hrv_val),
+                    ActorHasPhysiologicalState(?actor, ?rr), RRis(?rr, ?rr_val), {rr}(?rr_val),
+                    ActorHasPhysiologicalState(?actor, ?spo2), SpO2is(?spo2, ?spo2_val), {spo2}(?spo2_val),
+                    ActorHasPhysiologicalState(?actor, ?ds), DrowsinessIs(?ds, ?ds_val), {kss}(?ds_val),
+                    ActorHasPhysiologicalState(?actor, ?fatigue_state), Fatigue(?fatigue_state),
+                    {fatigue}(?fatigue)
+                    -> FatigueIs(?fatigue_state, ?fatigue)
+                    """)
+
+            for fatigue, eye_state in EYE_STATES:
+                self.create_instances(eye_state)
+                rule = Imp()
+                rule.set_as_rule(
+                    f"""
+                    Actor(?actor),
+                    ActorHasPhysiologicalState(?actor, ?fatigue_state),
+                    FatigueIs(?fatigue_state, ?fatigue),
+                    {fatigue}(?fatigue),
+                    {eye_state}(?eye_state) -> EyeStateForActor(?eye_state, ?actor)
+                    """
+                )
+
+
+    def set_up_batch_rules(self):
+        """
+        This function sets up the batch rules, only once.
+        """
+        if self.batch_rules_ready:
+            return
+        self.determine_batch_age()
+        self.determine_batch_bands()
+        self.determine_drowsiness()
+        self.determine_batch_fatigue()
+        self.batch_rules_ready = True
+
+
+    def create_batch(self, rows):
+        """
+        This function creates one group of individuals per row of the batch,
+        with the values of the row and the relations between the individuals.
+        Missing values are asserted as MISSING_VALUE, as in the serial path (see OntologyParser.parse_rows).
+        The triples of the whole batch are written at once by the BulkTripleLoader.
+        Args:
+            rows (DataFrame): The rows of the batch, indexed by their position in the dataset
+                and typed with OBSERVATION_SCHEMA (see ObservationValidator).
+        """
+        self.set_up_batch_rules()
+        individuals, data, relations, groups = [], [], [], []
+        classes = ["Observations", "Actor", "Label", "Fatigue"] + [cls_name for cls_name, _ in NUMERICAL_COLUMNS] + ["Age"] + [cls_name for cls_name, _ in STRING_COLUMNS]
+        classes = [getattr(self.ontology, cls_name) for cls_name in classes]
+        for index, record in zip(rows.index, rows.to_dict("records")):
+            obs, driver, label = f"observation_{index}", f"driver_{index}", f"label_{index}"
+            states = [f"fatigue_{index}"] + [f"{cls_name.lower()}_{index}" for cls_name, _ in NUMERICAL_COLUMNS]
+            characteristics = [f"age_{index}"] + [f"{cls_name.lower()}_{index}" for cls_name, _ in STRING_COLUMNS]
+            individuals += zip([obs, driver, label] + states + characteristics, classes)
+
+            data += [(obs, prop, record_value(record, column)) for column, prop in OBSERVATION_PROPERTIES.items()]
+            data += [(state, "hasNumericalValue", record_value(record, column)) for state, (_, column) in zip(states[1:], NUMERICAL_COLUMNS)]
+            data.append((characteristics[0], "hasAgeValue", record_value(record, "Age")))
+            data += [(characteristic, "hasStringValue", record_value(record, column)) for characteristic, (_, column) in zip(characteristics[1:], STRING_COLUMNS)]
+
+            relations += [(driver, "ActorHasPhysiologicalState", state) for state in states]
+            relations += [(driver, "ActorHasCharacteristics", characteristic) for characteristic in characteristics]
+            relations += [(obs, "ObsIsDividedIntoPhS", state) for state in states]
+            # ActorFromObservations(driver, obs) is not asserted: it is the inverse of ObsIsDividedIntoActor,
+            # whose values are the characteristics only.
+            relations += [(obs, "ObsIsDividedIntoActor", characteristic) for characteristic in characteristics]
+            groups.append((index, driver, label, [obs, driver, label] + states + characteristics))
+
+        storids = dict(zip([name for name, _ in individuals], self.loader.add_individuals(individuals)))
+        self.loader.add_data([(storids[name], prop, value) for name, prop, value in data])
+        self.loader.add_relations([(storids[s], prop, storids[o]) for s, prop, o in relations])
+        for index, driver, label, names in groups:
+            self.batch.append((index, {"driver": storids[driver], "label": storids[label], "individuals": [storids[name] for name in names]}))
+
+
+    def create_batch_labels(self, sink):
+        """
+        This function creates the labels of every actor of the batch, once the reasoner
+        has been synchronized, and writes them to the label sink.
+        Args:
+            sink: The label sink writing the labels (see scripts/label_sink.py), None to only return them.
+        Returns:
+            dict: The label payloads keyed by row index.
+        """
+        labels = {}
+        with self.ontology:
+            for index, group in self.batch:
+                start = time.perf_counter()
+                try:
+                    driver = self.ontology.world._get_by_storid(group["driver"])
+                    driver.hasUniqueIdentifier.append(str(uuid.uuid4()))
+                    characteristics = self.actor_characteristics(driver)
+                    actor_data = self.build_label(driver.hasUniqueIdentifier[0], self.actor_eye_state(driver), characteristics)
+                    if sink is not None:
+                        sink.write(index, actor_data)
+                    label = self.ontology.world._get_by_storid(group["label"])
+                    label.hasDescription.append(json.dumps(actor_data))
+                    label.LabelTargetsActor = [driver]
+                    labels[index] = actor_data
+                    self.metrics.observe("label_write_seconds", time.perf_counter() - start)
+                except Exception as e:
+                    self.metrics.increment("label_errors_total")
+                    self.logger.error(f"Error creating label {index}: {e}")
+        self.logger.info(f"{len(labels)} labels created.")
+        return labels
+
+
+    def batch_results(self):
+        """
+        This function returns the fatigue and eye state inferred for every actor of the batch, keyed by row index
+        (see RuleCreator.reasoning_result).
+        """
+        results = {}
+        for index, group in self.batch:
+            driver = self.ontology.world._get_by_storid(group["driver"])
+            results[index] = {"fatigue": self.actor_fatigue(driver), "eye_state": self.actor_eye_state(driver)}
+        return results
+
+
+    def remove_batch(self):
+        """
+        This function destroys every individual created for the batch, together with
+        all the relations asserted or inferred on them.
+        """
+        self.loader.remove_individuals(storid for _, group in self.batch for storid in group["individuals"])
+        self.batch = []
@@ -0,0 +1,169 @@
+from owlready2 import *
+
+
+# Maximum number of storids bound in a single IN (...) clause.
+MAX_VARIABLES = 500
+
+
+def chunked(values, size=MAX_VARIABLES):
+    """
+    Yields successive slices of values of at most size items.
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class BulkTripleLoader:
+    """
+    BulkTripleLoader writes individuals, data values and relations to the quadstore of an ontology
+    with executemany, instead of going through the Python properties of owlready2, which run several
+    statements for every value (reading the current values, writing the new one, updating the inverse).
+
+    The triples are the ones owlready2 asserts for the same individuals and values: the individual
+    typed with owl:NamedIndividual and its class, the data values converted with World._to_rdf,
+    all in the ontology's graph. The statements run in the current transaction of the world, so they
+    are committed by the next world.save() and undone by a rollback (see WorldSavepoint).
+
+    The individuals are not loaded in Python: the cached values of the entities already loaded are dropped,
+    to be read again from the quadstore on the next access, and World._get_by_storid loads the others.
+
+    NOTE: The loader relies on internals of owlready2 0.46 (the version of requirements.txt), to be checked
+    again on an upgrade: the storid allocation of the resources and store tables (current_resource),
+    World._to_rdf, World._props, and the cache of entities World._entities with the property values
+    cached in the __dict__ of the entities.
+    """
+
+    def __init__(self, ontology):
+        """
+        Args:
+            ontology (Ontology): The ontology receiving the triples.
+        """
+        self.ontology = ontology
+        self.world = ontology.world
+        self.graph = ontology.world.graph
+        self.c = ontology.graph.c
+
+
+    def prop(self, name):
+        """
+        Returns the property of the world with the Python name name.
+        """
+        prop = self.world._props.get(name)
+        if prop is None:
+            raise ValueError(f"Property {name} not found in the ontology.")
+        return prop
+
+
+    def abbreviate(self, iris):
+        """
+        Returns the storids of iris, allocating a single block of storids for the missing ones.
+        """
+        storids = {}
+        for iris_chunk in chunked(set(iris)):
+            storids.update(self.graph.execute(
+                f"SELECT iri, storid FROM resources WHERE iri IN ({','.join('?' * len(iris_chunk))})", iris_chunk
+            ))
+        missing = [iri for iri in dict.fromkeys(iris) if iri not in storids]
+        if missing:
+            current = self.graph.execute("SELECT current_resource FROM store").fetchone()[0]
+            self.graph.execute("UPDATE store SET current_resource=?", (current + len(missing),))
+            new = {iri: current + position for position, iri in enumerate(missing, 1)}
+            self.graph.db.executemany("INSERT INTO resources VALUES (?,?)", [(storid, iri) for iri, storid in new.items()])
+            storids.update(new)
+        return [storids[iri] for iri in iris]
+
+
+    def add_individuals(self, individuals):
+        """
+        Creates the individuals, or adds the class to the existing ones.
+        Args:
+            individuals: (name, class) pairs, the names being relative to the base IRI of the ontology.
+        Returns:
+            list: The storids of the individuals.
+        """
+        base_iri = self.ontology.base_iri
+        storids = self.abbreviate([base_iri + name for name, _ in individuals])
+        existing = set()
+        for storids_chunk in chunked(set(storids)):
+            existing.update(self.graph.execute(
+                f"SELECT s, o FROM objs WHERE s IN ({','.join('?' * len(storids_chunk))}) AND p=?", storids_chunk + [rdf_type]
+            ))
+        types = [(storid, owl_named_individual) for storid in storids] + [(storid, cls.storid) for storid, (_, cls) in zip(storids, individuals)]
+        types = [triple for triple in dict.fromkeys(types) if triple not in existing]
+        self.graph.db.executemany("INSERT INTO objs (c,s,p,o) VALUES (?,?,?,?)", [(self.c, s, rdf_type, o) for s, o in types])
+        for storid, _ in types:
+            # Loaded again with their new types on the next access
+            self.world._entities.pop(storid, None)
+        return storids
+
+
+    def add_data(self, triples):
+        """
+        Adds data values to individuals.
+        Args:
+            triples: (storid, property name, value) triples.
+        """
+        rows = []
+        for s, name, value in triples:
+            o, d = self.world._to_rdf(value)
+            rows.append((self.c, s, self.prop(name).storid, o, d))
+        self.graph.db.executemany("INSERT INTO datas (c,s,p,o,d) VALUES (?,?,?,?,?)", rows)
+        self.invalidate(s for s, _, _ in triples)
+
+
+    def remove_data(self, triples):
+        """
+        Removes data values from individuals.
+        Args:
+            triples: (storid, property name, value) triples.
+        """
+        rows = []
+        for s, name, value in triples:
+            o, d = self.world._to_rdf(value)
+            rows.append((self.c, s, self.prop(name).storid, o, d))
+        self.graph.db.executemany("DELETE FROM datas WHERE c=? AND s=? AND p=? AND o=? AND d IS ?", rows)
+        self.invalidate(s for s, _, _ in triples)
+
+
+    def add_relations(self, triples):
+        """
+        Adds object property relations between individuals.
+        Args:
+            triples: (subject storid, property name, object storid) triples.
+        """
+        rows = [(self.c, s, self.prop(name).storid, o) for s, name, o in triples]
+        self.graph.db.executemany("INSERT INTO objs (c,s,p,o) VALUES (?,?,?,?)", rows)
+        self.invalidate(storid for s, _, o in triples for storid in (s, o))
+
+
+    def remove_individuals(self, storids):
+        """
+        Removes the individuals, with every triple they are the subject or the object of, like destroy_entity.
+        """
+        storids = set(storids)
+        related = set()
+        for storids_chunk in chunked(storids):
+            marks = ",".join("?" * len(storids_chunk))
+            related.update(s for s, in self.graph.execute(f"SELECT DISTINCT s FROM objs WHERE o IN ({marks})", storids_chunk))
+            related.update(o for o, in self.graph.execute(f"SELECT DISTINCT o FROM objs WHERE s IN ({marks})", storids_chunk))
+            # One IN clause per statement, SQLite before 3.32 binds at most 999 parameters
+            self.graph.execute(f"DELETE FROM objs WHERE s IN ({marks})", storids_chunk)
+            self.graph.execute(f"DELETE FROM objs WHERE o IN ({marks})", storids_chunk)
+            self.graph.execute(f"DELETE FROM datas WHERE s IN ({marks})", storids_chunk)
+            self.graph.execute(f"DELETE FROM resources WHERE storid IN ({marks})", storids_chunk)
+        for storid in storids:
+            self.world._entities.pop(storid, None)
+        self.invalidate(related - storids)
+
+
+    def invalidate(self, storids):
+        """
+        Drops the cached property values of the loaded entities among storids.
+        """
+        for storid in set(storids):
+            entity = self.world._entities.get(storid)
+            if entity is None:
+                continue
+            for name in [name for name in entity.__dict__ if name in self.world._props]:
+                del entity.__dict__[name]
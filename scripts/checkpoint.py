@@ -0,0 +1,126 @@
+from scripts.fingerprint import file_digest
+import json
+import os
+import sqlite3
+
+
+class ProgressJournal:
+    """
+    ProgressJournal records the progress of a parse in an SQLite database, so that a run interrupted
+    by an error, a crash or a kill resumes where it stopped instead of starting over.
+
+    It stands between the parser and the label sink: every label is handed to the wrapped sink and kept
+    in the journal, and every commit_every rows the wrapped sink is flushed and the labels (or the errors)
+    of the rows are committed in a single transaction. A committed label is never reasoned over again:
+    OntologyParser.parse_observations skips the labelled rows of the journal and returns their labels from it.
+    The rows committed with an error are not completed, a resumed run tries them again.
+    Every row is reasoned over from the same ontology state (see OntologyParser.parse_rows), so a resumed
+    run labels the remaining rows as the interrupted run would have.
+
+    The journal is bound to the digests of the ontology file and of the dataset it was started with,
+    and refuses to be resumed with others.
+
+    NOTE: The rows written to the wrapped sink after the last commit are written again on resume,
+    so a sink appending the labels (e.g. JsonLinesLabelSink) may hold them twice; the journal does not.
+    """
+
+    def __init__(self, path, ontology_path, dataset_path, commit_every=100):
+        """
+        Args:
+            path (str): The SQLite database of the journal, created if missing and resumed otherwise.
+            ontology_path (str): The ontology file of the parse.
+            dataset_path (str): The dataset of the parse.
+            commit_every (int): The number of rows committed at once, at most lost by a crash.
+        """
+        self.path = path
+        self.commit_every = commit_every
+        self.sink = None
+        self.buffer = []
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA synchronous=FULL")
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS rows (row_index INTEGER PRIMARY KEY, label TEXT, error TEXT);
+            """)
+            state = {"ontology_digest": file_digest(ontology_path), "dataset_digest": file_digest(dataset_path)}
+            saved = dict(self.db.execute("SELECT name, value FROM meta"))
+            if saved and saved != state:
+                raise ValueError(f"Journal {path} was started with another ontology or dataset, remove it to start over.")
+            self.db.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)", state.items())
+        self.completed = set(row_index for row_index, in self.db.execute("SELECT row_index FROM rows WHERE label IS NOT NULL"))
+
+
+    @property
+    def last_index(self):
+        """
+        The index of the last committed label, None if no label was committed.
+        """
+        return max(self.completed) if self.completed else None
+
+
+    def attach(self, sink):
+        """
+        Sets the sink receiving the labels and returns the journal, to be used as the sink of the parse.
+        """
+        self.sink = sink
+        return self
+
+
+    def labels(self):
+        """
+        Yields the committed labels as (row index, label) pairs in row order, read from the database
+        as they are consumed instead of all at once.
+        """
+        for row_index, label in self.db.execute("SELECT row_index, label FROM rows WHERE label IS NOT NULL ORDER BY row_index"):
+            yield row_index, json.loads(label)
+
+
+    def errors(self):
+        """
+        Returns the error messages of the committed rows that failed, keyed by row index.
+        """
+        return dict(self.db.execute("SELECT row_index, error FROM rows WHERE error IS NOT NULL"))
+
+
+    def write(self, index, label):
+        if self.sink is not None:
+            self.sink.write(index, label)
+        self.buffer.append((int(index), json.dumps(label), None))
+        if len(self.buffer) >= self.commit_every:
+            self.flush()
+
+
+    def write_error(self, index, message):
+        self.buffer.append((int(index), None, message))
+        if len(self.buffer) >= self.commit_every:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Flushes the wrapped sink, then commits the buffered rows in one transaction.
+        """
+        if self.sink is not None:
+            self.sink.flush()
+        if self.buffer:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", self.buffer)
+            self.completed.update(row_index for row_index, label, _ in self.buffer if label is not None)
+            self.buffer = []
+
+
+    def close(self):
+        """
+        Commits the buffered rows and closes the journal (not the wrapped sink).
+        """
+        self.flush()
+        self.db.close()
+
+
+    def remove(self):
+        """
+        Closes the journal and deletes its database, once the parse is complete.
+        """
+        self.close()
+        os.remove(self.path)
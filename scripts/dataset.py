@@ -1,33 +1,224 @@
-import numpy as np 
-import pandas as pd 
-import pdb 
-import random
-
-csv = pd.read_csv("../data/Synthetic_dataset/data_SAT_20240603.csv")
-
-columns_to_add = ['Demographic','Age','Sex','Accessories','Characteristics']
-drowsy = [1,2,3,4]
-demographic = ["Afghan", "Brazilian", "African", "American", "Austrian", "Canadian", "Czech", "German", "Japanese", "Mexican", "Swedish"]
-ages = [15,18, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100]
-sexes = ["Man", "Woman"]
-accessories = ["Glasses", "Scarf", "Hat"]
-characteristics = ["Grey_hair", "Long_hair", "Short_hair", "Beard"]
-drowsy = np.array([random.choice(drowsy) for _ in range(len(csv))]).reshape(-1,1)
-demo = np.array([random.choice(demographic) for _ in range(len(csv))]).reshape(-1,1)
-ages = np.array([random.choice(ages) for _ in range(len(csv))]).reshape(-1,1)
-sexes = np.array([random.choice(sexes) for _ in range(len(csv))]).reshape(-1,1)
-accessories = np.array([random.choice(accessories) for _ in range(len(csv))]).reshape(-1,1)
-characteristics = np.array([random.choice(characteristics) for _ in range(len(csv))]).reshape(-1,1)
-hrv = np.array([random.randint(20,200) for _ in range(len(csv))]).reshape(-1,1)
-csv['HRV'] = hrv 
-csv['DROWSY'] = drowsy
-csv_pd = np.hstack([demo, ages, sexes, accessories, characteristics])
-csv_pd = pd.DataFrame(csv_pd, columns=columns_to_add)
-
-try: 
-    final = pd.concat([csv, csv_pd], axis=1)
-    final.dropna(inplace=True)
-    final.to_csv("../data/Synthetic_dataset/test_set_ontology.csv", index=False)               
-    print("Dataset saved successfully!")
-except  Exception as e:
-    print(e)
\ No newline at end of file
+from scripts.observation_reader import OBSERVATION_SCHEMA, apply_schema
+import numpy as np
+import pandas as pd
+import argparse
+import os
+
+
+# Values of the characteristics of the actors.
+DEMOGRAPHICS = ["Afghan", "Brazilian", "African", "American", "Austrian", "Canadian", "Czech", "German", "Japanese", "Mexican", "Swedish"]
+AGES = [15, 18, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100]
+SEXES = ["Man", "Woman"]
+ACCESSORIES = ["Glasses", "Scarf", "Hat"]
+CHARACTERISTICS = ["Grey_hair", "Long_hair", "Short_hair", "Beard"]
+DROWSY_LEVELS = [1, 2, 3, 4]
+
+# Distribution of the vital signs, as in data/test_set_ontology.csv: (mean, standard deviation, minimum, maximum).
+VITAL_PROFILES = {
+    "HR": (72.0, 15.7, 40, 155),
+    "RR": (15.4, 4.7, 6, 24),
+    "HRV": (110.0, 52.0, 20, 200),
+    "SPO2": (98.6, 1.6, 85, 100),
+}
+
+# Share of the variance of a vital sign between the actors (their baselines) in the per-actor series.
+ACTOR_VARIANCE = 0.25
+
+# Column of the actor of every row in the per-actor series.
+ACTOR_COLUMN = "ACTOR"
+
+
+def ar1(noise, phi, start):
+    """
+    Returns the AR(1) series x[t] = phi * x[t - 1] + noise[t] of every column of noise, from x[-1] = start.
+    The recursion is computed in blocks, x[t] = phi ** t * (x[-1] + cumsum(noise[k] / phi ** k)),
+    small enough for phi ** -t to stay far from overflowing.
+    Args:
+        noise (ndarray): The innovations, one row per time step and one column per series.
+        phi (float): The autocorrelation, in [0, 1).
+        start (ndarray): The value of every series before the first step.
+    """
+    if phi == 0:
+        return noise.copy()
+    series = np.empty_like(noise)
+    block = max(1, int(12 / -np.log10(phi)))
+    last = start
+    for begin in range(0, len(noise), block):
+        powers = phi ** np.arange(1, min(block, len(noise) - begin) + 1)[:, None]
+        series[begin:begin + len(powers)] = powers * (last + np.cumsum(noise[begin:begin + len(powers)] / powers, axis=0))
+        last = series[begin + len(powers) - 1]
+    return series
+
+
+class DatasetGenerator:
+    """
+    DatasetGenerator produces synthetic observation logs with the columns of OBSERVATION_SCHEMA, in chunks,
+    so that logs of tens of millions of rows can be written with the memory of a single chunk.
+    The same seed and chunk size always give the same log.
+
+    Without actors, every row is independent: the characteristics are drawn uniformly and the vital signs
+    from VITAL_PROFILES, like the rows of data/test_set_ontology.csv. With actors, every actor keeps its
+    characteristics and has a baseline for every vital sign, and its vital signs (and its drowsiness,
+    a discretized series) follow an AR(1) series around it with the given correlation between two samples.
+    The rows of the actors are interleaved (one row per actor and time step) and numbered in ACTOR_COLUMN.
+    """
+
+    def __init__(self, seed=None, actors=None, correlation=0.95, start="2024-04-15", interval=1.0, missing_rate=0.0):
+        """
+        Args:
+            seed (int): The seed of the NumPy Generator.
+            actors (int): The number of actors of the per-actor series, None for independent rows.
+            correlation (float): The correlation of two consecutive samples of an actor, in [0, 1).
+            start (str): The TIME of the first row.
+            interval (float): The time in seconds between two rows (between two samples of an actor with actors).
+            missing_rate (float): The probability of a vital sign to be missing, as a sensor dropout.
+        """
+        if actors is not None and actors < 1:
+            raise ValueError("The number of actors must be positive.")
+        if not 0 <= correlation < 1:
+            raise ValueError("The correlation must be in [0, 1).")
+        self.rng = np.random.default_rng(seed)
+        self.actors = actors
+        self.correlation = correlation
+        self.start = pd.Timestamp(start)
+        self.interval = pd.Timedelta(seconds=interval)
+        self.missing_rate = missing_rate
+        self.rows_generated = 0
+        if actors is not None:
+            self.create_actors()
+
+
+    def create_actors(self):
+        """
+        Draws the characteristics and baselines of the actors, and the first state of their series.
+        """
+        n = self.actors
+        self.profiles = {
+            "Demographic": self.rng.choice(DEMOGRAPHICS, n),
+            "Age": self.rng.choice(AGES, n),
+            "Sex": self.rng.choice(SEXES, n),
+            "Accessories": self.rng.choice(ACCESSORIES, n),
+            "Characteristics": self.rng.choice(CHARACTERISTICS, n),
+        }
+        self.baselines = {vital: mean + std * np.sqrt(ACTOR_VARIANCE) * self.rng.standard_normal(n) for vital, (mean, std, _, _) in VITAL_PROFILES.items()}
+        # Deviations of the actors from their baselines (and their drowsiness), in standard deviations
+        self.states = self.rng.standard_normal((len(VITAL_PROFILES) + 1, n))
+
+
+    def vitals(self, rows):
+        """
+        Returns independent values of the vital signs and drowsiness for rows rows.
+        """
+        columns = {vital: mean + std * self.rng.standard_normal(rows) for vital, (mean, std, _, _) in VITAL_PROFILES.items()}
+        columns["DROWSY"] = self.rng.choice(DROWSY_LEVELS, rows)
+        return columns
+
+
+    def series(self, steps):
+        """
+        Returns the next steps samples of the vital signs and drowsiness of every actor, actor by actor within a step.
+        """
+        noise = self.rng.standard_normal((len(self.states), steps, self.actors)) * np.sqrt(1 - self.correlation ** 2)
+        columns = {}
+        for position, vital in enumerate(list(VITAL_PROFILES) + ["DROWSY"]):
+            deviations = ar1(noise[position], self.correlation, self.states[position])
+            self.states[position] = deviations[-1]
+            if vital == "DROWSY":
+                # Equally likely levels of a standard normal deviation
+                columns[vital] = np.searchsorted([-0.6745, 0.0, 0.6745], deviations.ravel()) + DROWSY_LEVELS[0]
+            else:
+                _, std, _, _ = VITAL_PROFILES[vital]
+                columns[vital] = (self.baselines[vital] + std * np.sqrt(1 - ACTOR_VARIANCE) * deviations).ravel()
+        return columns
+
+
+    def chunk(self, rows):
+        """
+        Returns the next rows rows of the log, typed with OBSERVATION_SCHEMA and indexed by row number.
+        With actors, rows must be a multiple of the number of actors (except for the last chunk).
+        """
+        first = self.rows_generated
+        if self.actors is None:
+            columns = self.vitals(rows)
+            for column, values in [("Demographic", DEMOGRAPHICS), ("Age", AGES), ("Sex", SEXES), ("Accessories", ACCESSORIES), ("Characteristics", CHARACTERISTICS)]:
+                columns[column] = self.rng.choice(values, rows)
+            times = first + np.arange(rows)
+        else:
+            steps = -(-rows // self.actors)
+            columns = {column: values[:rows] for column, values in self.series(steps).items()}
+            for column, values in self.profiles.items():
+                columns[column] = np.tile(values, steps)[:rows]
+            columns[ACTOR_COLUMN] = np.tile(np.arange(self.actors), steps)[:rows]
+            times = (first + np.arange(rows)) // self.actors
+
+        for vital, (_, _, low, high) in VITAL_PROFILES.items():
+            values = pd.array(np.clip(np.rint(columns[vital]), low, high).astype("int64"), dtype="Int64")
+            if self.missing_rate:
+                values[self.rng.random(rows) < self.missing_rate] = pd.NA
+            columns[vital] = values
+        columns["TIME"] = self.start + self.interval * times
+
+        frame = pd.DataFrame(columns, index=pd.RangeIndex(first, first + rows))
+        frame = apply_schema(frame)[list(OBSERVATION_SCHEMA) + ([ACTOR_COLUMN] if self.actors is not None else [])]
+        self.rows_generated += rows
+        return frame
+
+
+    def generate(self, rows, chunksize=1000000):
+        """
+        Yields the next rows rows of the log, in chunks of about chunksize rows (a multiple of the number of actors).
+        """
+        if self.actors is not None:
+            chunksize = max(1, chunksize // self.actors) * self.actors
+        end = self.rows_generated + rows
+        while self.rows_generated < end:
+            yield self.chunk(min(chunksize, end - self.rows_generated))
+
+
+def write_dataset(path, chunks):
+    """
+    Writes chunks of a log to a CSV file, or to a Parquet file (one row group per chunk, requires pyarrow)
+    if path ends with .parquet. Returns the number of rows written.
+    """
+    rows = 0
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow (pip install pyarrow).")
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    for chunk in chunks:
+        chunk.to_csv(path, mode="w" if rows == 0 else "a", header=rows == 0, index=False)
+        rows += len(chunk)
+    return rows
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic observation log for load testing.")
+    arg_parser.add_argument("output", help="The .csv or .parquet file, e.g. data/synthetic_10M.csv")
+    arg_parser.add_argument("--rows", type=int, default=32228)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    arg_parser.add_argument("--chunksize", type=int, default=1000000)
+    arg_parser.add_argument("--actors", type=int, default=None, help="Generate one correlated series per actor instead of independent rows.")
+    arg_parser.add_argument("--correlation", type=float, default=0.95, help="Correlation of two consecutive samples of an actor.")
+    arg_parser.add_argument("--start", default="2024-04-15")
+    arg_parser.add_argument("--interval", type=float, default=1.0, help="Seconds between two rows (two samples of an actor).")
+    arg_parser.add_argument("--missing-rate", type=float, default=0.0)
+    args = arg_parser.parse_args()
+
+    generator = DatasetGenerator(args.seed, args.actors, args.correlation, args.start, args.interval, args.missing_rate)
+    rows = write_dataset(args.output, generator.generate(args.rows, args.chunksize))
+    print(f"{rows} rows written to {os.path.abspath(args.output)}.")
@@ -0,0 +1,132 @@
+from owlready2 import *
+
+
+class EntityIndex:
+    """
+    EntityIndex maps the names of the classes and properties of an ontology to the entities,
+    together with the subclasses of every class and the domain and range of every property,
+    so that lookups do not scan ontology.classes() each time.
+
+    The index is built on the first lookup and rebuilt on the first lookup after invalidate(),
+    which must be called whenever the classes or properties of the ontology are edited.
+    refresh() invalidates the index only if the declarations or subclass axioms of the world changed
+    (e.g. after the reasoner reclassified the ontology).
+    """
+
+    def __init__(self, ontology):
+        """
+        Args:
+            ontology (Ontology): The indexed ontology.
+        """
+        self.ontology = ontology
+        self.ready = False
+
+
+    def build(self):
+        """
+        Builds the index in a single pass over the classes and properties of the ontology.
+        """
+        self.classes = {}
+        self.children = {}
+        self.closures = {}
+        for cls in self.ontology.classes():
+            self.classes.setdefault(cls.name.strip(), cls)
+            self.children[cls] = list(cls.subclasses())
+
+        self.properties = {}
+        self.domains = {}
+        self.ranges = {}
+        for prop in self.ontology.properties():
+            self.properties.setdefault(prop.name, prop)
+            self.domains[prop] = list(prop.domain)
+            self.ranges[prop] = list(prop.range)
+        self.built_stamp = self.stamp()
+        self.ready = True
+
+
+    def stamp(self):
+        """
+        Returns a checksum of the class and property declarations and of the subclass axioms of the world.
+        """
+        return self.ontology.world.graph.execute(
+            "SELECT COUNT(), TOTAL(s), TOTAL(o) FROM objs WHERE p=? OR (p=? AND o IN (?,?,?))",
+            (rdfs_subclassof, rdf_type, owl_class, owl_object_property, owl_data_property),
+        ).fetchone()
+
+
+    def invalidate(self):
+        """
+        Drops the index, to be rebuilt on the next lookup.
+        """
+        self.ready = False
+
+
+    def refresh(self):
+        """
+        Invalidates the index if the classes, properties or subclass axioms changed since it was built.
+        """
+        if self.ready and self.stamp() != self.built_stamp:
+            self.invalidate()
+
+
+    def get_class(self, name):
+        """
+        Returns the class with the given name, or None.
+        """
+        if not self.ready:
+            self.build()
+        return self.classes.get(name.strip())
+
+
+    def subclasses(self, cls):
+        """
+        Returns the direct subclasses of a class.
+        """
+        if not self.ready:
+            self.build()
+        return self.children.get(cls, [])
+
+
+    def descendants(self, cls):
+        """
+        Returns every subclass of a class, direct or not.
+        """
+        if not self.ready:
+            self.build()
+        if cls not in self.closures:
+            closure = set()
+            stack = list(self.children.get(cls, []))
+            while stack:
+                child = stack.pop()
+                if child not in closure:
+                    closure.add(child)
+                    stack.extend(self.children.get(child, []))
+            self.closures[cls] = closure
+        return self.closures[cls]
+
+
+    def get_property(self, name):
+        """
+        Returns the property with the given name, or None.
+        """
+        if not self.ready:
+            self.build()
+        return self.properties.get(name)
+
+
+    def domain(self, prop):
+        """
+        Returns the domain of a property.
+        """
+        if not self.ready:
+            self.build()
+        return self.domains.get(prop, [])
+
+
+    def range(self, prop):
+        """
+        Returns the range of a property.
+        """
+        if not self.ready:
+            self.build()
+        return self.ranges.get(prop, [])
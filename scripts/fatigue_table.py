@@ -0,0 +1,214 @@
+from owlready2 import *
+from scripts.rule_creator import RuleCreator, FATIGUE_RULES, EYE_STATES, KSS_LEVELS
+from scripts.batch_rule_creator import BatchRuleCreator
+from scripts.thresholds import VITAL_BANDS
+from scripts.fingerprint import file_digest, rules_digest
+import numpy as np
+import pandas as pd
+import json
+
+
+# Axes of the table, in the order of the columns of BandClassifier.classify:
+# (column, physiological state class, property linking the state to its band, bands).
+TABLE_AXES = [(vital, vital, f"{vital}is", [band[0] for band in bands]) for vital, bands in VITAL_BANDS.items()]
+TABLE_AXES.append(("Drowsiness", "Drowsiness", "DrowsinessIs", [level[0] for level in KSS_LEVELS]))
+
+# Outcome of the cells where no rule fires, and of the rows with a missing band.
+UNDEFINED = "Undefined"
+
+
+def table_fingerprint(ontology_path):
+    """
+    Returns the fingerprint a table compiled from the ontology must match: the digest of the ontology file
+    and the digest of the fatigue and eye state rules (their tables and the functions writing them).
+    """
+    return {
+        "ontology_digest": file_digest(ontology_path),
+        "rules_digest": rules_digest(
+            FATIGUE_RULES, EYE_STATES, KSS_LEVELS, VITAL_BANDS,
+            RuleCreator.determine_fatigue, RuleCreator.determine_eye_state, BatchRuleCreator.determine_batch_fatigue,
+        ),
+    }
+
+
+def default_table_path(ontology_path):
+    """
+    Returns the path of the table compiled from an ontology, next to the ontology file.
+    """
+    return os.path.splitext(ontology_path)[0] + "_fatigue_table.npz"
+
+
+class FatigueTable:
+    """
+    FatigueTable holds the fatigue and eye state inferred by the SWRL rules for every combination of
+    HR, HRV, RR and SpO2 bands and KSS level (4 x 4 x 4 x 3 x 4 cells), so that the reasoning result of a
+    row is a lookup in a dense array once the row has been classified by the BandClassifier.
+
+    The table is compiled once with the real rules of determine_batch_fatigue: one actor per cell,
+    with its physiological states linked directly to the band individuals, and a single reasoner run.
+    It is saved with the fingerprint of the ontology and of the rules, and compiled again by
+    load_or_compile as soon as either of them changes.
+
+    NOTE: Like the BandClassifier, a row whose age matches two age groups (18) is looked up with the bands
+    of the first group only, while the reasoner may infer the fatigue of both.
+    """
+
+    def __init__(self, fatigue, eye_state, fatigue_names, eye_state_names, fingerprint):
+        """
+        Args:
+            fatigue (ndarray): The code of the fatigue of every cell, in fatigue_names.
+            eye_state (ndarray): The code of the eye state of every cell, in eye_state_names.
+            fatigue_names (list): The fatigue classes, UNDEFINED last.
+            eye_state_names (list): The eye states (as in the labels, e.g. "blinking"), UNDEFINED last.
+            fingerprint (dict): The fingerprint of the ontology and rules the table was compiled from.
+        """
+        self.fatigue = fatigue
+        self.eye_state = eye_state
+        self.fatigue_names = list(fatigue_names)
+        self.eye_state_names = list(eye_state_names)
+        self.fingerprint = fingerprint
+        self.positions = [{band: i for i, band in enumerate(bands)} for _, _, _, bands in TABLE_AXES]
+
+
+    @property
+    def shape(self):
+        return tuple(len(bands) for _, _, _, bands in TABLE_AXES)
+
+
+    @classmethod
+    def compile(cls, ontology_path, logger, reasoner="native"):
+        """
+        Runs the fatigue and eye state rules over every cell of the table, in a new World.
+        Args:
+            ontology_path (str): The path to the ontology file.
+            logger (Logger): The logger of the parser used for the compilation.
+            reasoner (str): The reasoner of the parser (see OntologyParser).
+        """
+        from scripts.ontology_parser import OntologyParser
+
+        world = World()
+        parser = OntologyParser(ontology_path, logger, reasoner=reasoner, world=world)
+        try:
+            creator = BatchRuleCreator(parser)
+            ontology = parser.ontology
+            with ontology:
+                band_individuals = []
+                for _, _, _, bands in TABLE_AXES:
+                    for band in bands:
+                        creator.create_instances(band)
+                    band_individuals.append([getattr(ontology, band).instances()[0] for band in bands])
+                creator.determine_batch_fatigue()
+
+                shape = tuple(len(bands) for bands in band_individuals)
+                actors = []
+                for cell, position in enumerate(np.ndindex(*shape)):
+                    driver = ontology.Actor(f"driver_{cell}")
+                    states = [ontology.Fatigue(f"fatigue_{cell}")]
+                    for (_, state_class, prop, _), individuals, i in zip(TABLE_AXES, band_individuals, position):
+                        state = getattr(ontology, state_class)(f"{state_class.lower()}_{cell}")
+                        # prop[state] is a list even for the functional properties (SpO2is).
+                        getattr(ontology, prop)[state].append(individuals[i])
+                        states.append(state)
+                    driver.ActorHasPhysiologicalState = states
+                    actors.append(driver)
+
+            creator.synchronize_ontology()
+            results = [(creator.actor_fatigue(driver), creator.actor_eye_state(driver)) for driver in actors]
+        finally:
+            parser.close()
+            world.close()
+
+        fatigue_names = sorted(set(rule[-1] for rule in FATIGUE_RULES)) + [UNDEFINED]
+        eye_state_names = sorted(set(eye_state for _, eye_state in results) - {UNDEFINED}) + [UNDEFINED]
+        fatigue = np.array([fatigue_names.index(fatigue) for fatigue, _ in results], dtype=np.int8)
+        eye_state = np.array([eye_state_names.index(eye_state) for _, eye_state in results], dtype=np.int8)
+
+        table = cls(fatigue.reshape(shape), eye_state.reshape(shape), fatigue_names, eye_state_names, table_fingerprint(ontology_path))
+        logger.info(f"Fatigue table compiled: {fatigue.size} cells, {int(np.sum(fatigue != len(fatigue_names) - 1))} with a fatigue.")
+        return table
+
+
+    def save(self, path):
+        """
+        Saves the table and its fingerprint in NumPy .npz format.
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                fatigue=self.fatigue,
+                eye_state=self.eye_state,
+                fatigue_names=np.array(self.fatigue_names),
+                eye_state_names=np.array(self.eye_state_names),
+                fingerprint=np.array(json.dumps(self.fingerprint)),
+            )
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a table saved by save.
+        """
+        with np.load(path) as data:
+            return cls(
+                data["fatigue"],
+                data["eye_state"],
+                data["fatigue_names"].tolist(),
+                data["eye_state_names"].tolist(),
+                json.loads(str(data["fingerprint"])),
+            )
+
+
+    @classmethod
+    def load_or_compile(cls, ontology_path, logger, path=None, reasoner="native"):
+        """
+        Loads the table saved for the ontology, or compiles (and saves) it if there is none or if
+        the ontology or the rules changed since it was compiled.
+        Args:
+            ontology_path (str): The path to the ontology file.
+            logger (Logger): The logger of the parser.
+            path (str): The .npz file of the table, defaults to default_table_path.
+            reasoner (str): The reasoner used for the compilation.
+        """
+        path = path or default_table_path(ontology_path)
+        if os.path.exists(path):
+            table = cls.load(path)
+            if table.fingerprint == table_fingerprint(ontology_path) and table.fatigue.shape == table.shape:
+                return table
+            logger.info(f"Fatigue table {path} is out of date, compiling it again.")
+        table = cls.compile(ontology_path, logger, reasoner)
+        table.save(path)
+        return table
+
+
+    def lookup(self, hr, hrv, rr, spo2, drowsiness):
+        """
+        Returns the reasoning result of a single discretized state, e.g. a key of the InferenceCache.
+        Args:
+            hr, hrv, rr, spo2, drowsiness (str): The band classes, None when missing.
+        Returns:
+            dict: {"fatigue": ..., "eye_state": ...} as returned by RuleCreator.reasoning_result.
+        """
+        try:
+            cell = tuple(positions[band] for positions, band in zip(self.positions, (hr, hrv, rr, spo2, drowsiness)))
+        except KeyError:
+            return {"fatigue": UNDEFINED, "eye_state": UNDEFINED}
+        return {"fatigue": self.fatigue_names[self.fatigue[cell]], "eye_state": self.eye_state_names[self.eye_state[cell]]}
+
+
+    def classify(self, bands):
+        """
+        Looks up the fatigue and eye state of every row at once.
+        Args:
+            bands (DataFrame): The bands of the rows, as returned by BandClassifier.classify.
+        Returns:
+            DataFrame with the categorical columns Fatigue and EyeState.
+        """
+        codes = [pd.Categorical(bands[column], categories=categories).codes for column, _, _, categories in TABLE_AXES]
+        missing = np.any([c < 0 for c in codes], axis=0)
+        cells = np.ravel_multi_index([np.maximum(c, 0) for c in codes], self.shape)
+        fatigue = np.where(missing, len(self.fatigue_names) - 1, self.fatigue.ravel()[cells])
+        eye_state = np.where(missing, len(self.eye_state_names) - 1, self.eye_state.ravel()[cells])
+        return pd.DataFrame({
+            "Fatigue": pd.Categorical.from_codes(fatigue, categories=self.fatigue_names),
+            "EyeState": pd.Categorical.from_codes(eye_state, categories=self.eye_state_names),
+        }, index=bands.index)
@@ -0,0 +1,28 @@
+import hashlib
+import inspect
+import json
+
+
+def file_digest(path):
+    """
+    Returns the SHA-256 digest of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def rules_digest(*parts):
+    """
+    Returns the SHA-256 digest of a rule set, given as rule tables (lists, dicts, tuples of strings and numbers)
+    and the functions generating the SWRL rules from them, whose source code is hashed.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if callable(part):
+            digest.update(inspect.getsource(part).encode())
+        else:
+            digest.update(json.dumps(part, sort_keys=True).encode())
+    return digest.hexdigest()
@@ -0,0 +1,293 @@
+from scripts.rule_creator import RuleCreator, AGE_RULES, KSS_LEVELS, FATIGUE_RULES, EYE_STATES
+from scripts.batch_rule_creator import BatchRuleCreator, OBSERVATION_PROPERTIES, MISSING_VALUE
+from scripts.thresholds import VITAL_BANDS
+from scripts.observation_reader import OBSERVATION_SCHEMA
+from scripts.fingerprint import file_digest, rules_digest
+from collections import OrderedDict
+import hashlib
+import json
+import pandas as pd
+import sqlite3
+import time
+import uuid
+
+
+# Columns of a row taking part in the key of the PersistentInferenceCache (TIME does not reach the ontology).
+KEY_COLUMNS = [column for column in OBSERVATION_SCHEMA if column != "TIME"]
+
+
+class InferenceCache:
+    """
+    InferenceCache is a least recently used cache of the reasoning results (fatigue and eye state),
+    keyed on the discretized physiological state of a row: age group, HR/HRV/RR/SpO2 bands and
+    KSS level, as given by the BandClassifier.
+
+    The string attributes of a row (sex, accessories, ...) are passed through to the label and
+    do not take part in the rules, so they are not part of the key.
+    """
+
+    def __init__(self, maxsize=4096):
+        """
+        Args:
+            maxsize (int): The maximum number of cached states, the least recently used is dropped first.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of the lookups answered by the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+    def get(self, key):
+        """
+        Returns the cached result of a state, or None on a miss.
+        Args:
+            key (tuple): The discretized state.
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.entries[key]
+
+
+    def put(self, key, value):
+        """
+        Caches the result of a state.
+        Args:
+            key (tuple): The discretized state.
+            value (dict): The reasoning result, e.g. {"fatigue": "Awake", "eye_state": "blinking"}.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+    def save(self, path):
+        """
+        Saves the cached states in JSON format, from the least to the most recently used.
+        """
+        with open(path, "w") as f:
+            json.dump({"maxsize": self.maxsize, "entries": [[list(key), value] for key, value in self.entries.items()]}, f)
+
+
+    @classmethod
+    def load(cls, path, maxsize=None):
+        """
+        Loads the states saved by save. The counters start from zero.
+        Args:
+            path (str): The JSON file written by save.
+            maxsize (int): Overrides the saved maximum size.
+        """
+        with open(path) as f:
+            data = json.load(f)
+        cache = cls(maxsize or data["maxsize"])
+        for key, value in data["entries"]:
+            cache.put(tuple(key), value)
+        return cache
+
+
+# Methods of the rule creators whose code decides the reasoning result of a row: the rules they write,
+# the facts they assert for a row and how the fatigue and eye state are read back (not the label format).
+RESULT_METHODS = [
+    RuleCreator.observations_to_classes, RuleCreator.assign_values, RuleCreator.determine_age, RuleCreator.determine_HR,
+    RuleCreator.determine_HRV, RuleCreator.determine_RR, RuleCreator.determine_spo2, RuleCreator.determine_drowsiness,
+    RuleCreator.connect_actor_to_values, RuleCreator.determine_fatigue, RuleCreator.determine_eye_state, RuleCreator.set_up_rules,
+    RuleCreator.actor_fatigue, RuleCreator.actor_eye_state,
+    BatchRuleCreator.determine_batch_age, BatchRuleCreator.band_condition, BatchRuleCreator.determine_batch_bands,
+    BatchRuleCreator.determine_batch_fatigue, BatchRuleCreator.set_up_batch_rules, BatchRuleCreator.create_batch,
+    BatchRuleCreator.batch_results,
+]
+
+
+def cache_fingerprint(ontology_path, reasoner=None):
+    """
+    Returns the digests the entries of a PersistentInferenceCache are keyed on: the digest of the ontology file
+    and the digest of the rule set (the rule tables and RESULT_METHODS) with the reasoner backend reasoning over it.
+    """
+    return (
+        file_digest(ontology_path),
+        rules_digest(AGE_RULES, KSS_LEVELS, FATIGUE_RULES, EYE_STATES, VITAL_BANDS, OBSERVATION_PROPERTIES, MISSING_VALUE, reasoner, *RESULT_METHODS),
+    )
+
+
+def normalize_row(record):
+    """
+    Returns the digest of the columns of a row reaching the ontology, missing values and number types normalized.
+    """
+    values = []
+    for column in KEY_COLUMNS:
+        value = record.get(column)
+        if value is None or pd.isna(value):
+            values.append(None)
+        elif isinstance(value, str):
+            values.append(value.strip())
+        else:
+            values.append(float(value))
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()
+
+
+class PersistentInferenceCache:
+    """
+    PersistentInferenceCache keeps the labels and reasoning results (fatigue and eye state) of the rows
+    in an SQLite database, so that a later run, or another job over an overlapping dataset, labels
+    the rows already seen without running the reasoner.
+
+    The entries are keyed on the digest of the ontology file, the digest of the rule set and reasoner backend
+    (bound by the parser, see use_reasoner) and the digest of the row (see cache_fingerprint and normalize_row):
+    once the ontology, the rules or the backend change, the old entries
+    are never matched again. They are kept for the jobs still running with the other version (several may share
+    the cache), and evicted like any entry no longer used: at most max_entries are kept, the least recently used
+    are evicted first. Writes and usage updates are buffered until flush.
+
+    The label of a row read from the cache is built again from its cached reasoning result and its values
+    (see RuleCreator.create_cached_label), so the format of the labels may change without invalidating the cache.
+    """
+
+    # Number of row digests looked up per query.
+    LOOKUP_SIZE = 500
+
+    def __init__(self, path, ontology_path, max_entries=1000000, reasoner=None):
+        """
+        Args:
+            path (str): The SQLite database, created if missing. Several processes may share it.
+            ontology_path (str): The ontology file the labels are reasoned with.
+            max_entries (int): The maximum number of cached rows.
+            reasoner (str): The reasoner backend of the parser (see OntologyParser), set by the parser using the cache.
+        """
+        self.path = path
+        self.ontology_path = ontology_path
+        self.max_entries = max_entries
+        self.reasoner = reasoner
+        self.ontology_digest, self.rules_digest = cache_fingerprint(ontology_path, reasoner)
+        self.hits = 0
+        self.misses = 0
+        self.pending = {}
+        self.used = set()
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    ontology_digest TEXT, rules_digest TEXT, row_digest TEXT, label TEXT NOT NULL, facts TEXT NOT NULL, last_used REAL,
+                    PRIMARY KEY (ontology_digest, rules_digest, row_digest)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+            """)
+
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM entries").fetchone()[0] + len(self.pending)
+
+
+    def use_reasoner(self, reasoner):
+        """
+        Keys the next lookups and entries on the reasoner backend reasoner, so that the results of a backend
+        are never served to a parser using another one. The buffered entries are written first.
+        """
+        if reasoner != self.reasoner:
+            self.flush()
+            self.reasoner = reasoner
+            self.ontology_digest, self.rules_digest = cache_fingerprint(self.ontology_path, reasoner)
+
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of the lookups answered by the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+    def get_many(self, records):
+        """
+        Looks up rows in the cache.
+        Args:
+            records (list): The rows, as dictionaries.
+        Returns:
+            {position in records: (label payload, facts)} for the rows found.
+        """
+        digests = [normalize_row(record) for record in records]
+        found = {}
+        for start in range(0, len(digests), self.LOOKUP_SIZE):
+            part = list(set(digests[start:start + self.LOOKUP_SIZE]) - set(found) - set(self.pending))
+            placeholders = ", ".join("?" * len(part))
+            found.update((row_digest, (label, facts)) for row_digest, label, facts in self.db.execute(
+                f"SELECT row_digest, label, facts FROM entries WHERE ontology_digest = ? AND rules_digest = ? AND row_digest IN ({placeholders})",
+                [self.ontology_digest, self.rules_digest] + part,
+            ))
+
+        results = {}
+        for position, row_digest in enumerate(digests):
+            entry = self.pending.get(row_digest) or found.get(row_digest)
+            if entry is None:
+                self.misses += 1
+                continue
+            self.hits += 1
+            self.used.add(row_digest)
+            label = json.loads(entry[0])
+            label["label"]["actor_id"] = str(uuid.uuid4())
+            results[position] = (label, json.loads(entry[1]))
+        return results
+
+
+    def get(self, record):
+        """
+        Returns the (label payload, facts) of a row, or None on a miss.
+        """
+        return self.get_many([record]).get(0)
+
+
+    def put(self, record, label, facts):
+        """
+        Caches the label and reasoning result of a row.
+        Args:
+            record (dict): The row of the dataset.
+            label (dict): The label payload of the row.
+            facts (dict): The reasoning result, e.g. {"fatigue": "Awake", "eye_state": "blinking"}.
+        """
+        self.pending[normalize_row(record)] = (json.dumps(label), json.dumps(facts))
+
+
+    def flush(self):
+        """
+        Writes the buffered entries and usage times, then evicts the least recently used entries above max_entries.
+        """
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.ontology_digest, self.rules_digest, row_digest, label, facts, now) for row_digest, (label, facts) in self.pending.items()],
+            )
+            self.db.executemany(
+                "UPDATE entries SET last_used = ? WHERE ontology_digest = ? AND rules_digest = ? AND row_digest = ?",
+                [(now, self.ontology_digest, self.rules_digest, row_digest) for row_digest in self.used],
+            )
+            excess = self.db.execute("SELECT count(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.execute(
+                    "DELETE FROM entries WHERE (ontology_digest, rules_digest, row_digest) IN "
+                    "(SELECT ontology_digest, rules_digest, row_digest FROM entries ORDER BY last_used LIMIT ?)", (excess,)
+                )
+        self.pending = {}
+        self.used = set()
+
+
+    def close(self):
+        self.flush()
+        self.db.close()
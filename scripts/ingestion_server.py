@@ -0,0 +1,277 @@
+from scripts.metrics import COUNT_BUCKETS
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import pandas as pd
+import time
+
+
+class IngestionServer:
+    """
+    IngestionServer receives live observation records over a local TCP or Unix socket and streams their labels back.
+
+    The protocol is newline-delimited JSON: every line sent by a client is one record with the columns of
+    OBSERVATION_SCHEMA (missing columns are missing values) and an optional "id", and every line sent back is
+    {"id": ..., "index": ..., "label": ...} or {"id": ..., "error": ...}, in the order of the records of the connection.
+
+    The records of all the connections are gathered into micro-batches, closed when max_batch_size records
+    are waiting or max_wait seconds after the first one arrived, whichever comes first: a larger batch gives
+    more throughput, a shorter wait a lower latency. Every batch is reasoned over by the OntologyParser in a
+    single background thread (an owlready2 world must not be used by several threads), so the event loop keeps
+    accepting records meanwhile. At most max_pending records wait for a batch, further records wait for room.
+
+    close() stops accepting connections and records, lets the batcher reason over the records already queued,
+    and answers the records it could not label with an error before closing the connections.
+    """
+
+    def __init__(self, parser, max_batch_size=32, max_wait=0.05, batch_rules=False, label_sink=None, max_pending=1024):
+        """
+        Args:
+            parser (OntologyParser): The parser reasoning over the batches.
+            max_batch_size (int): The maximum number of records of a batch.
+            max_wait (float): The maximum time in seconds a record waits for its batch to be closed.
+            batch_rules (bool): If True, every batch is reasoned over in a single run (see OntologyParser.parse_rows_batch),
+                otherwise its records are reasoned over one by one (see OntologyParser.parse_rows).
+            label_sink: An optional sink also receiving the labels (see scripts/label_sink.py).
+            max_pending (int): The maximum number of records waiting for a batch.
+        """
+        self.parser = parser
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_rules = batch_rules
+        self.label_sink = label_sink
+        self.max_pending = max_pending
+        self.metrics = parser.metrics
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reasoner")
+        self.next_index = 0
+        self.queue = None
+        self.servers = []
+        self.batcher = None
+        self.batch = []
+        self.connections = set()
+        self.closing = False
+
+
+    async def start(self, host="127.0.0.1", port=8765, path=None):
+        """
+        Starts listening on a TCP port, or on a Unix socket if path is given, and starts the batcher.
+        """
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.max_pending)
+            self.batcher = asyncio.create_task(self.run_batches())
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        self.servers.append(server)
+        self.parser.logger.info(f"Ingestion server listening on {path or f'{host}:{port}'}.")
+        return server
+
+
+    async def serve_forever(self):
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+
+    async def close(self):
+        """
+        Stops listening and accepting records, waits for the queued records to be reasoned over and stops the batcher.
+        The records left without a label (e.g. the batcher failed) get an error, then the connections are closed
+        once their responses are written.
+        """
+        self.closing = True
+        for server in self.servers:
+            server.close()
+        if self.batcher is not None:
+            drained = asyncio.ensure_future(self.queue.join())
+            await asyncio.wait([drained, self.batcher], return_when=asyncio.FIRST_COMPLETED)
+            for task in (drained, self.batcher):
+                task.cancel()
+            await asyncio.gather(drained, self.batcher, return_exceptions=True)
+            pending = self.batch
+            while not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            for record, future, _ in pending:
+                if not future.done():
+                    future.set_result((None, None, "Server closed before the record was labelled."))
+            self.batch = []
+        # The connections write the responses of their records, then close
+        connections = list(self.connections)
+        for connection in connections:
+            connection.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        for server in self.servers:
+            await server.wait_closed()
+        self.executor.shutdown(wait=True)
+        if self.label_sink is not None:
+            self.label_sink.flush()
+
+
+    async def submit(self, record):
+        """
+        Queues a record for the next batch and returns the future of its label payload.
+        Once the server is closing, the future holds an error instead.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if self.closing:
+            future.set_result((None, None, "Server closing, record not accepted."))
+            return future
+        await self.queue.put((record, future, time.perf_counter()))
+        self.metrics.set_gauge("ingest_queue_depth", self.queue.qsize())
+        return future
+
+
+    async def next_batch(self):
+        """
+        Waits for a first record, then gathers records until the batch is full or max_wait has passed.
+        """
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Kept in self.batch until answered, for close() to answer it if the batcher stops
+            self.batch = batch = await self.next_batch()
+            index = self.next_index
+            self.next_index += len(batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.reason, [record for record, _, _ in batch], index)
+            except Exception as e:
+                self.metrics.increment("errors_total")
+                self.parser.logger.error(f"Error reasoning over batch {index}: {e}")
+                results = [(index + i, None, str(e)) for i in range(len(batch))]
+
+            now = time.perf_counter()
+            self.metrics.observe("ingest_batch_size", len(batch), COUNT_BUCKETS)
+            for (_, future, queued), result in zip(batch, results):
+                self.metrics.observe("ingest_latency_seconds", now - queued)
+                if not future.done():
+                    future.set_result(result)
+            self.batch = []
+            for _ in batch:
+                self.queue.task_done()
+            self.metrics.maybe_flush()
+
+
+    def reason(self, records, first_index):
+        """
+        Reasons over a batch of records, in the reasoner thread.
+        Returns, for every record, (index, label payload or None, error message or None).
+        """
+        indexes = list(range(first_index, first_index + len(records)))
+        frame, errors = self.to_frame(records, indexes)
+        labels = {}
+        if len(frame):
+            if self.batch_rules:
+                labels = self.parser.parse_rows_batch([frame], self.label_sink, len(frame))
+            else:
+                labels = self.parser.parse_rows([frame], self.label_sink)
+            if labels is None:
+                raise RuntimeError("Class Observation not found in the ontology.")
+        return [
+            (index, labels.get(index), errors.get(index) or (None if labels.get(index) is not None else "No label created."))
+            for index in indexes
+        ]
+
+
+    def to_frame(self, records, indexes):
+        """
+        Types the records with OBSERVATION_SCHEMA, validating the batch as a whole (see OntologyParser.validate_rows):
+        the invalid records are left out, with their error.
+        Returns:
+            (DataFrame of the valid records indexed by their index, {index: error message})
+        """
+        frame, valid, errors = self.parser.validate_rows(pd.DataFrame.from_records(records, index=indexes))
+        return frame[valid], errors
+
+
+    async def handle_connection(self, reader, writer):
+        """
+        Reads the records of a connection and writes back their labels in order, while reading the next records.
+        Cancelled by close(), it stops reading and writes back the responses of the records already read.
+        """
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        responses = asyncio.Queue()
+
+        async def respond():
+            while True:
+                item = await responses.get()
+                if item is None:
+                    break
+                record_id, response = item
+                if asyncio.isfuture(response):
+                    index, label, error = await response
+                    response = {"id": record_id, "index": index, "label": label} if error is None else {"id": record_id, "index": index, "error": error}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+
+        responder = asyncio.create_task(respond())
+        try:
+            async for line in reader:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError("a record must be a JSON object")
+                except ValueError as e:
+                    await responses.put((None, {"id": None, "error": f"Invalid record: {e}"}))
+                    continue
+                record_id = record.pop("id", None)
+                await responses.put((record_id, await self.submit(record)))
+        except asyncio.CancelledError:
+            if not self.closing:
+                raise
+        finally:
+            responses.put_nowait(None)
+            try:
+                await responder
+            finally:
+                writer.close()
+                self.connections.discard(connection)
+
+
+if __name__ == "__main__":
+    from scripts.ontology_parser import OntologyParser
+    from owlready2 import World
+    import argparse
+    import logging
+    import os
+
+    logging.getLogger("owlready2").setLevel(logging.ERROR)
+    logging.basicConfig(level=logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description="Serve the ontology parser over a socket, one JSON record per line.")
+    arg_parser.add_argument("ontology_path", help="The ontology file, e.g. ontologies/in_cabin_domain.rdf")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--unix", default=None, help="Listen on this Unix socket instead of TCP.")
+    arg_parser.add_argument("--max-batch-size", type=int, default=32)
+    arg_parser.add_argument("--max-wait", type=float, default=0.05, help="Seconds a record waits for its batch to be closed.")
+    arg_parser.add_argument("--batch-rules", action="store_true", help="Reason over every batch in a single run.")
+    arg_parser.add_argument("--reasoner", choices=["pellet", "pellet_session", "native", "sql"], default="native")
+    arg_parser.add_argument("--snapshot", default=None, help="Open this snapshot instead of the ontology file (see scripts/snapshot.py).")
+    args = arg_parser.parse_args()
+
+    async def main():
+        world = World() if args.snapshot is None else None
+        parser = OntologyParser(os.path.abspath(args.ontology_path), logging.getLogger(__name__), reasoner=args.reasoner, world=world, snapshot_path=args.snapshot)
+        server = IngestionServer(parser, args.max_batch_size, args.max_wait, args.batch_rules)
+        await server.start(args.host, args.port, args.unix)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+            parser.close()
+
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.io.StringReader;
+import java.util.Set;
+
+import aterm.ATermAppl;
+
+import com.hp.hpl.jena.ontology.OntModel;
+import com.hp.hpl.jena.rdf.model.Model;
+import com.hp.hpl.jena.rdf.model.ModelFactory;
+
+import org.mindswap.pellet.KnowledgeBase;
+import org.mindswap.pellet.exceptions.InconsistentOntologyException;
+import org.mindswap.pellet.jena.PelletInfGraph;
+import org.mindswap.pellet.jena.PelletReasonerFactory;
+import org.mindswap.pellet.utils.ATermUtils;
+
+
+/**
+ * Long-lived Pellet process used by scripts/reasoner_session.py.
+ *
+ * The process keeps a Jena model bound to the Pellet reasoner and reads
+ * line based commands from stdin:
+ *
+ *   RESET n   - drop every triple and load the n N-Triples lines that follow
+ *   ADD n     - add the n N-Triples lines that follow
+ *   REMOVE n  - remove the n N-Triples lines that follow
+ *   REALIZE   - realize the knowledge base and print the inferred facts
+ *   QUIT      - stop the process
+ *
+ * Every command is answered with "OK", "END" (after REALIZE), "INCONSISTENT msg"
+ * (REALIZE on an inconsistent ontology) or "ERROR exception: msg", the stack trace of
+ * the errors being printed on stderr.
+ * REALIZE prints "TYPE: individual class" and "PROPINST: subject property object"
+ * lines, the latter in the same format as the Pellet build shipped with owlready2.
+ * The classes are not reclassified: only the types and object property values of the
+ * individuals are printed.
+ */
+public class PelletSession {
+
+    public static void main(String[] args) throws Exception {
+        Model base = ModelFactory.createDefaultModel();
+        OntModel model = ModelFactory.createOntologyModel(PelletReasonerFactory.THE_SPEC, base);
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintStream out = new PrintStream(new BufferedOutputStream(System.out), false, "UTF-8");
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] command = line.trim().split(" ");
+            try {
+                if (command[0].equals("RESET") || command[0].equals("ADD") || command[0].equals("REMOVE")) {
+                    Model delta = readTriples(in, Integer.parseInt(command[1]));
+                    if (command[0].equals("RESET")) {
+                        base.removeAll();
+                        base.add(delta);
+                    } else if (command[0].equals("ADD")) {
+                        base.add(delta);
+                    } else {
+                        base.remove(delta);
+                    }
+                    out.println("OK");
+                } else if (command[0].equals("REALIZE")) {
+                    realize((PelletInfGraph) model.getGraph(), out);
+                    out.println("END");
+                } else if (command[0].equals("QUIT")) {
+                    break;
+                } else {
+                    out.println("ERROR unknown command " + command[0]);
+                }
+            } catch (InconsistentOntologyException e) {
+                out.println("INCONSISTENT " + String.valueOf(e.getMessage()).replace('\n', ' '));
+            } catch (Exception e) {
+                e.printStackTrace();
+                System.err.flush();
+                out.println("ERROR " + e.getClass().getName() + ": " + String.valueOf(e.getMessage()).replace('\n', ' '));
+            }
+            out.flush();
+        }
+        out.flush();
+    }
+
+
+    private static Model readTriples(BufferedReader in, int count) throws Exception {
+        StringBuilder triples = new StringBuilder();
+        for (int i = 0; i < count; i++) {
+            triples.append(in.readLine()).append('\n');
+        }
+        Model delta = ModelFactory.createDefaultModel();
+        delta.read(new StringReader(triples.toString()), null, "N-TRIPLES");
+        return delta;
+    }
+
+
+    private static void realize(PelletInfGraph graph, PrintStream out) {
+        // prepare() only reloads what changed in the base model since the last call.
+        graph.prepare();
+        KnowledgeBase kb = graph.getKB();
+        kb.realize();
+
+        for (ATermAppl individual : kb.getIndividuals()) {
+            if (ATermUtils.isBnode(individual)) {
+                continue;
+            }
+            for (Set<ATermAppl> types : kb.getTypes(individual, true)) {
+                for (ATermAppl type : types) {
+                    if (ATermUtils.isPrimitive(type)) {
+                        out.println("TYPE: " + individual.getName() + " " + type.getName());
+                    }
+                }
+            }
+            for (ATermAppl property : kb.getObjectProperties()) {
+                for (ATermAppl value : kb.getPropertyValues(property, individual)) {
+                    if (!ATermUtils.isBnode(value)) {
+                        out.println("PROPINST: " + individual.getName() + " " + property.getName() + " " + value.getName());
+                    }
+                }
+            }
+        }
+    }
+}
@@ -0,0 +1,240 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+
+# Fields of the "label" part of the payload kept as columns by the ParquetLabelSink.
+LABEL_FIELDS = ["actor_id", "eye_state", "age", "face", "sex", "demographic", "accessories"]
+
+
+class JsonFileLabelSink:
+    """
+    JsonFileLabelSink writes every label to its own file, label_{index}.json, in a folder.
+    """
+
+    def __init__(self, folder):
+        """
+        Args:
+            folder (str): The folder of the labels, e.g. labels/.
+        """
+        self.folder = folder
+
+
+    def write(self, index, label):
+        with open(os.path.join(self.folder, f"label_{index}.json"), "w") as f:
+            json.dump(label, f, indent=4)
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        pass
+
+
+class JsonLinesLabelSink:
+    """
+    JsonLinesLabelSink appends the labels to a single file, one JSON object per line with the index of the row,
+    written buffer_size labels at a time.
+    """
+
+    def __init__(self, path, buffer_size=1000):
+        """
+        Args:
+            path (str): The .jsonl file, created if missing and appended to otherwise.
+            buffer_size (int): The number of labels kept in memory before being written.
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.file = open(path, "a")
+
+
+    def write(self, index, label):
+        self.buffer.append(json.dumps(dict(index=int(index), **label)))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+        self.file.flush()
+
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class SQLiteLabelSink:
+    """
+    SQLiteLabelSink inserts the labels into the labels table of an SQLite database
+    (row_index, actor_id, eye_state, payload), indexed on actor_id and eye_state,
+    with one transaction per batch_size labels. A label of an already written row replaces it.
+    """
+
+    def __init__(self, path, batch_size=1000):
+        """
+        Args:
+            path (str): The SQLite database, created if missing.
+            batch_size (int): The number of labels inserted per transaction.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        # The connection is used by the writer thread of a ThreadedLabelSink.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS labels (row_index INTEGER PRIMARY KEY, actor_id TEXT, eye_state TEXT, payload TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS labels_actor_id ON labels(actor_id);
+            CREATE INDEX IF NOT EXISTS labels_eye_state ON labels(eye_state);
+        """)
+
+
+    def write(self, index, label):
+        self.buffer.append((int(index), label["label"]["actor_id"], label["label"]["eye_state"], json.dumps(label)))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        if self.buffer:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?)", self.buffer)
+            self.buffer = []
+
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+class ParquetLabelSink:
+    """
+    ParquetLabelSink writes the labels to a Parquet file, one row group per batch_size labels,
+    with the row index, the LABEL_FIELDS and the whole payload in JSON format. Requires pyarrow.
+    """
+
+    def __init__(self, path, batch_size=10000):
+        """
+        Args:
+            path (str): The .parquet file, overwritten.
+            batch_size (int): The number of labels per row group.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetLabelSink requires pyarrow (pip install pyarrow).")
+        self.pyarrow = pyarrow
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.schema = pyarrow.schema(
+            [("row_index", pyarrow.int64())] + [(field, pyarrow.string()) for field in LABEL_FIELDS] + [("payload", pyarrow.string())]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+
+    def write(self, index, label):
+        self.buffer.append((int(index), label))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        if not self.buffer:
+            return
+        columns = {"row_index": [index for index, _ in self.buffer]}
+        for field in LABEL_FIELDS:
+            columns[field] = [None if label["label"].get(field) is None else str(label["label"][field]) for _, label in self.buffer]
+        columns["payload"] = [json.dumps(label) for _, label in self.buffer]
+        self.writer.write_table(self.pyarrow.table(columns, schema=self.schema))
+        self.buffer = []
+
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ThreadedLabelSink:
+    """
+    ThreadedLabelSink hands the labels to another sink from a background thread, so that writing
+    overlaps reasoning. The queue between the parser and the thread holds at most maxsize labels:
+    when the thread falls behind, write blocks until there is room again.
+
+    An error of the wrapped sink stops the writes and is raised by the next write, flush or close.
+    """
+
+    # Markers passed through the queue to the writer thread.
+    FLUSH = object()
+    CLOSE = object()
+
+    def __init__(self, sink, maxsize=1024):
+        """
+        Args:
+            sink: The wrapped sink (JsonLinesLabelSink, SQLiteLabelSink, ...).
+            maxsize (int): The maximum number of labels waiting in the queue.
+        """
+        self.sink = sink
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="label-sink", daemon=True)
+        self.thread.start()
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if self.error is not None and item is not self.CLOSE:
+                    continue
+                if item is self.FLUSH:
+                    self.sink.flush()
+                elif item is self.CLOSE:
+                    self.sink.close()
+                else:
+                    self.sink.write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+                if item is self.CLOSE:
+                    return
+
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Label sink failed: {self.error}") from self.error
+
+
+    def write(self, index, label):
+        self.raise_error()
+        self.queue.put((index, label))
+
+
+    def flush(self):
+        """
+        Waits until every queued label has been written, and flushes the wrapped sink.
+        """
+        self.queue.put(self.FLUSH)
+        self.queue.join()
+        self.raise_error()
+
+
+    def close(self):
+        """
+        Writes the queued labels, closes the wrapped sink and stops the thread.
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(self.CLOSE)
+            self.thread.join()
+        self.raise_error()
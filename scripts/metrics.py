@@ -0,0 +1,228 @@
+from contextlib import contextmanager
+import bisect
+import json
+import os
+import time
+
+
+# Upper bounds of the latency histograms, in seconds.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Upper bounds of the histograms counting triples.
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+
+class Histogram:
+    """
+    Histogram counts the observed values falling under every bucket bound, plus their sum and count.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Args:
+            buckets (tuple): The increasing upper bounds of the buckets, values above the last bound are only counted in +Inf.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def snapshot(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+    def merge(self, snapshot):
+        """
+        Adds the counts of a snapshot of a histogram with the same buckets.
+        """
+        for i, count in enumerate(snapshot["counts"]):
+            self.counts[i] += count
+        self.sum += snapshot["sum"]
+        self.count += snapshot["count"]
+
+
+class MetricsRegistry:
+    """
+    MetricsRegistry holds the counters, gauges and histograms of the parser and pushes snapshots
+    of them to its sinks (InMemoryMetricsSink, JsonLinesMetricsSink, PrometheusMetricsSink).
+
+    Metrics are created on their first update. Counters only grow, gauges hold the last value set,
+    histograms count the observed values per bucket.
+    """
+
+    def __init__(self, sinks=(), flush_interval=10.0):
+        """
+        Args:
+            sinks (iterable): The sinks receiving the snapshots.
+            flush_interval (float): The minimum time in seconds between two flushes of maybe_flush.
+        """
+        self.sinks = list(sinks)
+        self.flush_interval = flush_interval
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.last_flush = time.monotonic()
+
+
+    def increment(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        """
+        Adds a value to a histogram, created with the given buckets on its first observation.
+        """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(buckets)
+        self.histograms[name].observe(value)
+
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Observes the wall time of the block in the histogram name, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    def reset(self):
+        """
+        Drops every metric.
+        """
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+
+    def snapshot(self):
+        """
+        Returns the current values of every metric.
+        """
+        return {
+            "time": time.time(),
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+
+    def merge(self, snapshot):
+        """
+        Adds the counters and histograms of a snapshot (e.g. from a worker process), gauges are overwritten.
+        """
+        for name, value in snapshot["counters"].items():
+            self.increment(name, value)
+        self.gauges.update(snapshot["gauges"])
+        for name, histogram in snapshot["histograms"].items():
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(histogram["buckets"])
+            self.histograms[name].merge(histogram)
+
+
+    def flush(self):
+        """
+        Pushes a snapshot to every sink.
+        """
+        self.last_flush = time.monotonic()
+        if not self.sinks:
+            return
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.write(snapshot)
+
+
+    def maybe_flush(self):
+        """
+        Flushes if flush_interval seconds passed since the last flush.
+        """
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+
+class InMemoryMetricsSink:
+    """
+    InMemoryMetricsSink keeps the last snapshot pushed by the registry.
+    """
+
+    def __init__(self):
+        self.last = None
+
+
+    def write(self, snapshot):
+        self.last = snapshot
+
+
+    def snapshot(self):
+        return self.last
+
+
+class JsonLinesMetricsSink:
+    """
+    JsonLinesMetricsSink appends every snapshot as one line of JSON to a file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def write(self, snapshot):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+
+class PrometheusMetricsSink:
+    """
+    PrometheusMetricsSink writes the last snapshot in the Prometheus text format, e.g. for the
+    textfile collector of the node exporter. The file is replaced atomically on every write.
+    """
+
+    def __init__(self, path, prefix="incabin_"):
+        """
+        Args:
+            path (str): The .prom file to write.
+            prefix (str): The prefix of every metric name.
+        """
+        self.path = path
+        self.prefix = prefix
+
+
+    def format(self, snapshot):
+        """
+        Returns the snapshot in the Prometheus text format.
+        """
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines += [f"# TYPE {self.prefix}{name} counter", f"{self.prefix}{name} {value}"]
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines += [f"# TYPE {self.prefix}{name} gauge", f"{self.prefix}{name} {value}"]
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            metric = self.prefix + name
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(list(histogram["buckets"]) + ["+Inf"], histogram["counts"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f"{metric}_sum {histogram['sum']}", f"{metric}_count {histogram['count']}"]
+        return "\n".join(lines) + "\n"
+
+
+    def write(self, snapshot):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(self.format(snapshot))
+        os.replace(temporary, self.path)
@@ -0,0 +1,242 @@
+from scripts.observation_reader import OBSERVATION_SCHEMA, DEFAULT_CHUNKSIZE, read_observations
+from scripts.fingerprint import file_digest
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import uuid
+
+
+# Kinds of columns of the cache -> dtype of their binary file. Integers keep their missing values in a separate mask,
+# times are stored in nanoseconds (NaT included), strings as codes in the categories of their column (-1 for a missing value).
+COLUMN_KINDS = {
+    "integer": "int64",
+    "float": "float64",
+    "time": "int64",
+    "string": "int32",
+}
+
+# Name of the metadata file of a cache.
+METADATA_FILE = "metadata.json"
+
+
+def default_cache_dir(dataset_path):
+    """
+    Returns the directory of the binary caches of a dataset, next to the dataset file.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(dataset_path)), ".observation_cache")
+
+
+def column_kind(dtype):
+    """
+    Returns the kind of storage of a column of the pandas dtype dtype.
+    """
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "time"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "integer"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    return "string"
+
+
+class BinaryObservationCache:
+    """
+    BinaryObservationCache holds an observation log converted once into a columnar binary format, so that
+    the text of the log (numbers, strings and TIME) is not parsed again at every run.
+
+    Every column is a flat binary file memory-mapped with numpy.memmap: the vital signs and the other
+    integers as int64 with a mask of the missing values, TIME in nanoseconds and the strings (Demographic,
+    Sex, Accessories, Characteristics, ...) dictionary-encoded as int32 codes in the categories of the column.
+    Opening a cache reads its metadata only; the rows are read from the page cache of the system when
+    a range of them is sliced, and the processes opening the same cache share a single copy of it.
+
+    The cache of a dataset is stored in a directory named after the SHA-256 digest of the dataset file,
+    so that a modified dataset is converted again instead of being read from a stale cache.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The directory of the cache, as written by build.
+        """
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.rows = metadata["rows"]
+        self.digest = metadata["digest"]
+        self.dtypes = metadata["dtypes"]
+        self.kinds = metadata["kinds"]
+        self.categories = {column: pd.array(values, dtype="string") for column, values in metadata["categories"].items()}
+        self.values = {}
+        self.masks = {}
+        for column, kind in self.kinds.items():
+            self.values[column] = self.map(column, COLUMN_KINDS[kind])
+            if kind == "integer":
+                self.masks[column] = self.map(column + ".mask", "bool")
+
+
+    def __len__(self):
+        return self.rows
+
+
+    def map(self, name, dtype):
+        """
+        Memory-maps the binary file of a column (read-only).
+        """
+        if self.rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name + ".bin"), dtype=dtype, mode="r", shape=(self.rows,))
+
+
+    @classmethod
+    def build(cls, dataset_path, path, chunksize=DEFAULT_CHUNKSIZE, digest=None):
+        """
+        Converts a dataset into a cache in the directory path, one chunk of chunksize rows at a time.
+        The cache is written to a temporary directory first and renamed once complete, so that
+        a cache is either complete or missing, even with several processes building it at once.
+        """
+        digest = digest or file_digest(dataset_path)
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(temporary_path)
+        dtypes = {}
+        kinds = {}
+        codes = {}
+        files = {}
+        rows = 0
+        try:
+            for chunk in read_observations(dataset_path, chunksize):
+                if not kinds:
+                    dtypes = {column: str(chunk[column].dtype) for column in chunk.columns}
+                    kinds = {column: column_kind(dtype) for column, dtype in dtypes.items()}
+                    for column, kind in kinds.items():
+                        files[column] = open(os.path.join(temporary_path, column + ".bin"), "wb")
+                        if kind == "integer":
+                            files[column + ".mask"] = open(os.path.join(temporary_path, column + ".mask.bin"), "wb")
+                        elif kind == "string":
+                            codes[column] = {}
+                for column, kind in kinds.items():
+                    values = chunk[column]
+                    if kind == "integer":
+                        files[column].write(values.to_numpy("int64", na_value=0).tobytes())
+                        files[column + ".mask"].write(values.isna().to_numpy().tobytes())
+                    elif kind == "float":
+                        files[column].write(values.to_numpy("float64", na_value=np.nan).tobytes())
+                    elif kind == "time":
+                        files[column].write(values.to_numpy("datetime64[ns]").view("int64").tobytes())
+                    else:
+                        # Codes of the chunk, then of the column (the categories keep the order of their first row)
+                        chunk_codes, uniques = pd.factorize(values.astype("string"))
+                        column_codes = codes[column]
+                        mapping = np.array([column_codes.setdefault(value, len(column_codes)) for value in uniques] + [-1], dtype="int32")
+                        files[column].write(mapping[chunk_codes].tobytes())
+                rows += len(chunk)
+        finally:
+            for f in files.values():
+                f.close()
+
+        metadata = {
+            "dataset_path": os.path.abspath(dataset_path),
+            "digest": digest,
+            "rows": rows,
+            "dtypes": dtypes,
+            "kinds": kinds,
+            "categories": {column: list(column_codes) for column, column_codes in codes.items()},
+        }
+        with open(os.path.join(temporary_path, METADATA_FILE), "w") as f:
+            json.dump(metadata, f, indent=2)
+        try:
+            os.rename(temporary_path, path)
+        except OSError:
+            # Built in the meantime by another process
+            shutil.rmtree(temporary_path)
+            if not os.path.exists(os.path.join(path, METADATA_FILE)):
+                raise
+        return cls(path)
+
+
+    @classmethod
+    def load_or_build(cls, dataset_path, logger, cache_dir=None, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        Opens the cache of the current content of a dataset, or builds it if there is none.
+        Args:
+            dataset_path (str): The path to the dataset file.
+            logger (Logger): The logger of the parser.
+            cache_dir (str): The directory of the caches, defaults to default_cache_dir.
+            chunksize (int): The number of rows converted at once when building the cache.
+        """
+        cache_dir = cache_dir or default_cache_dir(dataset_path)
+        digest = file_digest(dataset_path)
+        path = os.path.join(cache_dir, digest)
+        if os.path.exists(os.path.join(path, METADATA_FILE)):
+            return cls(path)
+        logger.info(f"Converting {dataset_path} into a binary cache in {path}.")
+        os.makedirs(cache_dir, exist_ok=True)
+        return cls.build(dataset_path, path, chunksize, digest)
+
+
+    def frame(self, start, stop):
+        """
+        Returns the rows start to stop (excluded) as a DataFrame typed like the chunks of read_observations,
+        indexed by row number. The numerical columns are views of the memory-mapped files, not copies.
+        """
+        columns = {}
+        for column, kind in self.kinds.items():
+            columns[column] = self.column(column, kind, slice(start, stop))
+        return pd.DataFrame(columns, index=pd.RangeIndex(start, stop), copy=False)
+
+
+    def take(self, indexes):
+        """
+        Returns the rows with the given indexes (in increasing order) as a DataFrame, like frame.
+        """
+        indexes = np.asarray(indexes, dtype="int64")
+        if len(indexes) and indexes[-1] - indexes[0] + 1 == len(indexes):
+            return self.frame(int(indexes[0]), int(indexes[-1]) + 1)
+        columns = {column: self.column(column, kind, indexes) for column, kind in self.kinds.items()}
+        return pd.DataFrame(columns, index=pd.Index(indexes), copy=False)
+
+
+    def column(self, column, kind, rows):
+        """
+        Returns the values of a column at rows (a slice or an array of row numbers) with the dtype of the dataset.
+        """
+        values = np.asarray(self.values[column][rows])
+        dtype = self.dtypes[column]
+        if kind == "integer":
+            if dtype != "Int64":
+                return values.astype(dtype, copy=False)
+            return pd.arrays.IntegerArray(values, np.asarray(self.masks[column][rows]))
+        if kind == "float":
+            return values.astype(dtype, copy=False)
+        if kind == "time":
+            return values.view("datetime64[ns]")
+        strings = self.categories[column].take(values, allow_fill=True)
+        return strings if dtype == "string" else strings.astype(dtype)
+
+
+    def chunks(self, chunksize=DEFAULT_CHUNKSIZE, max_rows=None):
+        """
+        Yields the rows of the cache in chunks of chunksize rows, like read_observations.
+        Args:
+            chunksize (int): The number of rows of every chunk.
+            max_rows (int): If given, only the first max_rows rows are read.
+        """
+        rows = self.rows if max_rows is None else min(max_rows, self.rows)
+        for start in range(0, rows, chunksize):
+            yield self.frame(start, min(start + chunksize, rows))
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    arg_parser = argparse.ArgumentParser(description="Convert an observation log into a memory-mapped binary cache.")
+    arg_parser.add_argument("dataset_path", help="The observation log, e.g. data/test_set_ontology.csv")
+    arg_parser.add_argument("--cache-dir", default=None, help="The directory of the caches, by default data/.observation_cache")
+    arg_parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    args = arg_parser.parse_args()
+    cache = BinaryObservationCache.load_or_build(args.dataset_path, logging.getLogger(__name__), args.cache_dir, args.chunksize)
+    print(f"{len(cache)} rows cached in {cache.path}.")
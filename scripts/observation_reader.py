@@ -0,0 +1,56 @@
+import pandas as pd
+
+
+# Declared schema of the observation logs (e.g. test_set_ontology.csv): column -> pandas dtype.
+# The nullable dtypes keep the integers as integers when a value is missing.
+OBSERVATION_SCHEMA = {
+    "TIME": "datetime64[ns]",
+    "HR": "Int64",
+    "RR": "Int64",
+    "HRV": "Int64",
+    "SPO2": "Int64",
+    "DROWSY": "Int64",
+    "Demographic": "string",
+    "Age": "Int64",
+    "Sex": "string",
+    "Accessories": "string",
+    "Characteristics": "string",
+}
+
+# Number of rows read at once from the observation logs.
+DEFAULT_CHUNKSIZE = 10000
+
+
+def apply_schema(observations):
+    """
+    Types the columns of a DataFrame of observations with OBSERVATION_SCHEMA, adding the missing ones as empty columns.
+    """
+    for column, dtype in OBSERVATION_SCHEMA.items():
+        if column not in observations.columns:
+            observations[column] = pd.Series(pd.NA if dtype != "datetime64[ns]" else pd.NaT, index=observations.index, dtype=dtype)
+        elif observations[column].dtype != dtype:
+            observations[column] = pd.to_datetime(observations[column]) if dtype == "datetime64[ns]" else observations[column].astype(dtype)
+    return observations
+
+
+def read_observations(dataset_path, chunksize=DEFAULT_CHUNKSIZE, max_rows=None):
+    """
+    Reads the observation log in chunks of chunksize rows, so that only one chunk is held in memory.
+    Every chunk is typed with OBSERVATION_SCHEMA, and the schema columns missing from the file are
+    added as empty columns. The index of the chunks keeps counting the rows of the whole file.
+
+    Args:
+      - dataset_path: The path to the dataset file.
+      - chunksize: The number of rows of every chunk.
+      - max_rows: If given, only the first max_rows rows are read.
+    Yields:
+      - DataFrame chunks of the dataset.
+    """
+
+    header = pd.read_csv(dataset_path, nrows=0).columns
+    dtypes = {column: dtype for column, dtype in OBSERVATION_SCHEMA.items() if column in header and column != "TIME"}
+    parse_dates = ["TIME"] if "TIME" in header else False
+
+    with pd.read_csv(dataset_path, dtype=dtypes, parse_dates=parse_dates, chunksize=chunksize, nrows=max_rows) as reader:
+        for chunk in reader:
+            yield apply_schema(chunk)
@@ -0,0 +1,148 @@
+from owlready2 import *
+from scripts.observation_reader import OBSERVATION_SCHEMA
+from scripts.rule_creator import KSS_LEVELS
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+
+# Valid values of the numerical columns: column -> (minimum, maximum), both inclusive.
+# 0 is a valid reading of the vital signs (a sensor that lost contact), DROWSY must have a KSS level.
+VALUE_RANGES = {
+    "HR": (0, 300),
+    "RR": (0, 100),
+    "HRV": (0, 1000),
+    "SPO2": (0, 100),
+    "DROWSY": (KSS_LEVELS[0][1] + 1, KSS_LEVELS[-1][2]),
+    "Age": (0, 130),
+}
+
+# String columns -> class of the ontology whose subclasses are the valid values of the column.
+DOMAIN_CLASSES = {
+    "Demographic": "Demographic",
+    "Sex": "Sex",
+    "Accessories": "Accessories",
+    "Characteristics": "FaceCharacteristics",
+}
+
+# Values of the datasets naming a subclass of DOMAIN_CLASSES differently: column -> {value: subclass}.
+# The values are compared without case and surrounding spaces (e.g. "Short_hair" is Short_Hair).
+DOMAIN_ALIASES = {
+    "Sex": {"Man": "Male", "Woman": "Female"},
+}
+
+
+def normalize(values):
+    """
+    Returns the strings of values without case and surrounding spaces, to be compared with a domain.
+    """
+    return values.str.strip().str.casefold()
+
+
+def validation_schema(ontology):
+    """
+    Returns the schema of the observations: column -> (dtype, (minimum, maximum) or None, domain or None),
+    with the dtypes of OBSERVATION_SCHEMA, the ranges of VALUE_RANGES and, for the columns of DOMAIN_CLASSES,
+    the normalized names of the subclasses of their class and of their aliases.
+    """
+    schema = {}
+    for column, dtype in OBSERVATION_SCHEMA.items():
+        domain = None
+        if column in DOMAIN_CLASSES:
+            cls = getattr(ontology, DOMAIN_CLASSES[column])
+            if cls is None:
+                raise ValueError(f"Class {DOMAIN_CLASSES[column]} not found in the ontology.")
+            names = [subclass.name for subclass in cls.descendants() if subclass is not cls]
+            names += [alias for alias, name in DOMAIN_ALIASES.get(column, {}).items() if name in names]
+            domain = set(normalize(pd.Series(names, dtype="string")))
+        schema[column] = (dtype, VALUE_RANGES.get(column), domain)
+    return schema
+
+
+class ObservationValidator:
+    """
+    ObservationValidator checks and types the observations once per chunk, over whole columns, before they
+    reach the parser, so that the stages after it get the dtypes of OBSERVATION_SCHEMA and no invalid value.
+
+    Every column of the schema (see validation_schema) is coerced to its dtype: numbers given as strings or
+    floats become integers, TIME strings become timestamps. A present value is invalid if it cannot be coerced,
+    is not a whole number, is out of the range of its column or, for the string columns, names no subclass
+    of the class of its column. A row with an invalid value is rejected; missing values are not invalid,
+    the parser leaves them out as before.
+
+    The rejected rows are counted by column in rejections (a row may count for several columns).
+    """
+
+    def __init__(self, ontology):
+        """
+        Args:
+            ontology (Ontology): The ontology holding the classes of DOMAIN_CLASSES.
+        """
+        self.schema = validation_schema(ontology)
+        self.rows_checked = 0
+        self.rows_rejected = 0
+        self.rejections = Counter()
+
+
+    def coerce(self, values, dtype):
+        """
+        Coerces a column to dtype. Returns the coerced column and the mask of the present values
+        that could not be coerced.
+        """
+        if dtype == "datetime64[ns]":
+            coerced = values if pd.api.types.is_datetime64_dtype(values.dtype) else pd.to_datetime(values, errors="coerce")
+            return coerced, (values.notna() & coerced.isna()).to_numpy()
+        if dtype == "Int64":
+            numbers = values if pd.api.types.is_integer_dtype(values.dtype) else pd.to_numeric(values, errors="coerce")
+            invalid = values.notna() & numbers.isna()
+            if not pd.api.types.is_integer_dtype(numbers.dtype):
+                numbers = numbers.astype("Float64")
+                fractional = (numbers.round() != numbers).fillna(False)
+                invalid |= fractional
+                numbers = numbers.mask(fractional).round()
+            return numbers.astype("Int64"), invalid.to_numpy()
+        coerced = values.astype(dtype)
+        return coerced, np.zeros(len(values), dtype=bool)
+
+
+    def validate(self, chunk):
+        """
+        Validates a chunk of observations.
+        Args:
+            chunk (DataFrame): The observations, with any of the columns of the schema (the missing ones are
+                added as empty columns) and their values typed or not (e.g. parsed from JSON).
+        Returns:
+            (DataFrame typed with OBSERVATION_SCHEMA, validity mask of its rows, {index: error message} of the rejected rows)
+        """
+        columns = {}
+        invalid = {}
+        for column, (dtype, bounds, domain) in self.schema.items():
+            if column not in chunk.columns:
+                empty = pd.NaT if dtype == "datetime64[ns]" else pd.NA
+                columns[column] = pd.Series(empty, index=chunk.index, dtype=dtype)
+                continue
+            values, bad = self.coerce(chunk[column], dtype)
+            if bounds is not None:
+                bad |= ((values < bounds[0]) | (values > bounds[1])).fillna(False).to_numpy(dtype=bool)
+            if domain is not None:
+                # Few distinct strings per column: only they are normalized
+                uniques = pd.Series(values.dropna().unique(), dtype="string")
+                bad |= values.isin(uniques[~normalize(uniques).isin(domain)]).to_numpy(dtype=bool)
+            columns[column] = values
+            if bad.any():
+                invalid[column] = bad
+
+        frame = chunk.assign(**columns)
+        valid = np.ones(len(chunk), dtype=bool)
+        for bad in invalid.values():
+            valid &= ~bad
+        errors = {}
+        if not valid.all():
+            for position in np.flatnonzero(~valid):
+                values = ", ".join(f"{column}={chunk[column].iloc[position]!r}" for column, bad in invalid.items() if bad[position])
+                errors[chunk.index[position]] = f"Invalid values: {values}"
+            for column, bad in invalid.items():
+                self.rejections[column] += int(bad.sum())
+        self.rows_checked += len(chunk)
+        self.rows_rejected += len(errors)
+        return frame, valid, errors
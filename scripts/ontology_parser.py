@@ -1,7 +1,28 @@
 from owlready2 import *
 from rdflib import Graph, URIRef, Literal
 from scripts.rule_creator import RuleCreator
+from scripts.reasoner_session import PelletSession
+from scripts.band_classifier import BandClassifier
+from scripts.fatigue_table import FatigueTable
+from scripts.batch_rule_creator import BatchRuleCreator, OBSERVATION_PROPERTIES, record_value
+from scripts.observation_reader import read_observations, DEFAULT_CHUNKSIZE
+from scripts.snapshot import open_snapshot
+from scripts.entity_index import EntityIndex
+from scripts.savepoint import WorldSavepoint
+from scripts.metrics import MetricsRegistry, COUNT_BUCKETS
+from scripts.label_sink import JsonFileLabelSink
+from scripts.inference_cache import PersistentInferenceCache
+from scripts.checkpoint import ProgressJournal
+from scripts.recycler import WorldRecycler
+from scripts.observation_cache import BinaryObservationCache
+from scripts.observation_validator import ObservationValidator
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import numpy as np
 import pandas as pd
+import logging
+import multiprocessing.util
+import time
 
 
 
@@ -11,16 +32,46 @@ class OntologyParser:
     including loading, parsing rules, and saving the results.
     """
 
-    def __init__(self, ontology_path, logger):
+    def __init__(self, ontology_path, logger, reasoner="pellet", world=None, snapshot_path=None, metrics=None):
         """
         The constructor for the OntologyParser class.
+        Args:
+          - ontology_path: The path to the ontology file.
+          - logger: The logger used by the parser and the rule creator.
+          - reasoner: "pellet" starts a new Pellet process for every synchronization, 
+            "pellet_session" keeps a single Pellet process alive for the whole run, 
+            "native" evaluates the SWRL rules in process without Java, 
+            "sql" evaluates them as SQL statements over the quadstore, for all the loaded observations at once.
+          - world: The owlready2 World holding the ontology, defaults to owlready2's default world.
+          - snapshot_path: If given, the ontology is opened from this snapshot (see scripts/snapshot.py), 
+            with the rules and instances already created, instead of being loaded from ontology_path.
+          - metrics: The MetricsRegistry (and its sinks) receiving the metrics of the parser, 
+            defaults to a registry without sinks, available in self.metrics.
         """
 
         self.ontology_path = ontology_path
-        self.ontology = self.load_ontology()
+        self.snapshot_path = snapshot_path
+        self.snapshot_copy = None
+        self.world = world if world is not None else default_world
         self.logger = logger  
         self.graph = None 
-        self.rule_parser = RuleCreator(self)
+        self.reasoner = reasoner
+        self.reasoner_session = PelletSession(logger) if reasoner == "pellet_session" else None
+        self.batch_rule_parser = None
+        self.fatigue_table = None
+        self.validator = None
+        self.labels = {}
+        self.row_errors = {}
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.parse_start = time.perf_counter()
+        self.rows_parsed = 0
+
+        if snapshot_path is None: 
+            self.ontology = self.load_ontology()
+            self.entity_index = EntityIndex(self.ontology)
+            self.rule_parser = RuleCreator(self)
+        else: 
+            self.set_up_snapshot()
 
 
     def load_ontology(self): 
@@ -28,9 +79,64 @@ class OntologyParser:
         This method loads the ontology from the specified path.
         --only_local is used to manually load the ontology without processing owl:versionIRI
         """
-        ontology = get_ontology("file://"+self.ontology_path).load(only_local=True) 
+        ontology = self.world.get_ontology("file://"+self.ontology_path).load(only_local=True) 
         #Validate that ontology was correctly loaded:         
         return ontology
+
+
+    def load_snapshot(self): 
+        """
+        This method opens a private copy of the snapshot of the ontology, which already holds the rules
+        and instances of one of the parsing modes (see scripts/snapshot.py). 
+        The snapshot must have been built from the current version of the ontology file.
+        """
+        self.world, ontology, metadata, self.snapshot_copy = open_snapshot(self.snapshot_path, self.ontology_path)
+        self.snapshot_mode = metadata["mode"]
+        self.logger.info(f"Ontology opened from the {self.snapshot_mode} snapshot {self.snapshot_path}.")
+        return ontology
+    
+
+    def set_up_snapshot(self): 
+        """
+        This method opens the snapshot of self.snapshot_path and creates the rule creators of its mode, 
+        with the rules already in place.
+        """
+        self.ontology = self.load_snapshot()
+        self.entity_index = EntityIndex(self.ontology)
+        self.rule_parser = RuleCreator(self)
+        self.rule_parser.rules_ready = self.snapshot_mode == "serial"
+        self.batch_rule_parser = None
+        if self.snapshot_mode == "batch": 
+            self.batch_rule_parser = BatchRuleCreator(self)
+            self.batch_rule_parser.batch_rules_ready = True
+
+
+    def recycle_world(self, snapshot_path): 
+        """
+        This method closes the World of the parser, with everything the parsed rows left in it, 
+        and opens a new private copy of the snapshot in its place (see WorldRecycler). 
+        The Pellet session, the metrics and the labels of the parser are kept.
+        """
+        if self.snapshot_copy is not None: 
+            self.world.close()
+            os.remove(self.snapshot_copy)
+            self.snapshot_copy = None
+        elif self.world is not default_world: 
+            self.world.close()
+        self.snapshot_path = snapshot_path
+        self.set_up_snapshot()
+
+
+    def close(self): 
+        """
+        Releases the resources held by the parser (e.g. the running Pellet session).
+        """
+        if self.reasoner_session is not None: 
+            self.reasoner_session.close()
+        if self.snapshot_copy is not None: 
+            self.world.close()
+            os.remove(self.snapshot_copy)
+            self.snapshot_copy = None
     
 
     def search_class_ontology(self, target_class_name):
@@ -38,110 +144,609 @@ class OntologyParser:
         Search if the Target class ("Target" in ths case) exists in the ontology
         NOTE: only used for debugging purposes
         """
-        target_class = None
-        for cls in self.ontology.classes():
-            if cls.name == target_class_name :
-                target_class = cls 
-                break 
-        
+        target_class = self.entity_index.get_class(target_class_name)
         if target_class is None:
             raise ValueError(f"Target class '{target_class_name}' not found in the ontology.")
         return target_class
     
     
-    def parse_observations(self, dataset_path):
+    def classify_observations(self, dataset_path, output_path=None, chunksize=DEFAULT_CHUNKSIZE, infer=False):
         """
-        This method parses the observations from the given dataset and creates instances of the Observation class.
-        Then translates the rules established in the ontology with the reasoner and saves the results.
-        
+        This method classifies the whole dataset into the HR/HRV/RR/SpO2/KSS bands and age groups 
+        in one vectorized pass per chunk, using the thresholds of the ontology instead of the reasoner.
+
         Args:
           - dataset_path: The path to the dataset file.
+          - output_path: If given, the bands are also saved there in CSV format.
+          - chunksize: The number of rows read at once from the dataset.
+          - infer: If True, the fatigue and eye state of every row are looked up in the FatigueTable 
+            (see load_fatigue_table) and added as the Fatigue and EyeState columns.
+        Returns:
+          - DataFrame with one categorical column per vital sign.
         """
 
-        dataset = pd.read_csv(dataset_path)
-        dataset = dataset[:5]
-        filepath = os.getcwd() + "/labels"
-        
+        classifier = BandClassifier(self.ontology)
+        table = self.load_fatigue_table() if infer else None
+        frames = []
+        for chunk in read_observations(dataset_path, chunksize):
+            bands = classifier.classify(chunk)
+            if table is not None: 
+                bands = bands.join(table.classify(bands))
+            frames.append(bands)
+        bands = pd.concat(frames)
+        if output_path is not None: 
+            bands.to_csv(output_path, index=False)
+        self.logger.info(f"Classified {len(bands)} observations.")
+        return bands
+
+
+    def load_fatigue_table(self, path=None):
+        """
+        This method returns the FatigueTable of the ontology, loaded from path (by default next to the ontology file)
+        or compiled with the rules if it is missing or out of date. The table is kept for the next calls.
+        """
+        if self.fatigue_table is None: 
+            reasoner = self.reasoner if self.reasoner in ("native", "sql") else "pellet"
+            self.fatigue_table = FatigueTable.load_or_compile(self.ontology_path, self.logger, path, reasoner)
+        return self.fatigue_table
+
+
+    def label_cached_rows(self, chunk, sink, persistent_cache, labels):
+        """
+        This method labels the rows of a chunk found in the PersistentInferenceCache, without the reasoner, 
+        and returns the other rows of the chunk. The labels are built from the cached reasoning results.
+        """
+        records = chunk.to_dict("records")
+        found = persistent_cache.get_many(records)
+        for position, (_, facts) in found.items(): 
+            index = chunk.index[position]
+            labels[index] = self.rule_parser.create_cached_label(sink, index, records[position], facts)
+        if found: 
+            self.metrics.increment("rows_disk_cached_total", len(found))
+            self.record_rows(len(found))
+        return chunk.iloc[[position for position in range(len(chunk)) if position not in found]]
+
+
+    def reason_batch(self, batch, sink, persistent_cache=None):
+        """
+        This method labels the rows of a batch with a single reasoner run (see parse_rows_batch). 
+        The individuals of the batch are removed afterwards, also when reasoning fails.
+        Returns:
+          - The label payloads keyed by row index.
+        """
+
+        if self.batch_rule_parser is None: 
+            self.batch_rule_parser = BatchRuleCreator(self)
+        batch_parser = self.batch_rule_parser
+
         try: 
-            # Create instances for the Label and the Sensor
-            with self.ontology: 
-                self.rule_parser.create_instances("Label")
-                self.rule_parser.create_instances("MonitoringSensor")
-
-            # Check if the Observations class exists in the ontology
-            for cls in self.ontology.classes():
-                if cls.name == "Observations":
-                    self.logger.info(f"Class {cls.name} found.")
-                    break
-            else:
-                self.logger.error(f"Class Observation not found in the ontology.")
-                return
-            
-            # Create the main instance of the Observations class
-            obs = self.ontology.Observations(f"observation_{0}")
-            for index, row in dataset.iterrows():
-                
-                # Connect the sensor to the observations 
-                # self.rule_parser.connect_sensor_to_observations(obs)
-
-                #Pass health factors 
-                obs.hasHR.append(row['HR'] if "HR" in dataset.columns and isinstance(row['HR'],int) else [-1])
-                obs.hasHRV.append(row['HRV'] if "HRV" in dataset.columns and isinstance(row['HRV'],int) else [-1])
-                obs.hasRR.append(row['RR'] if "RR" in dataset.columns and isinstance(row['RR'],int) else [-1])
-                obs.hasSpO2.append(row["SPO2"] if "SPO2" in dataset.columns and isinstance(row['SPO2'],int) else [-1])
-                obs.hasDROWSY.append(row['DROWSY'] if "DROWSY" in dataset.columns and isinstance(row['DROWSY'],int) else [-1])
+            batch_parser.create_batch(batch)
+            batch_parser.synchronize_ontology()
+            batch_labels = batch_parser.create_batch_labels(sink)
+            if persistent_cache is not None: 
+                results = batch_parser.batch_results()
+                for index, record in zip(batch.index, batch.to_dict("records")): 
+                    if index in batch_labels: 
+                        persistent_cache.put(record, batch_labels[index], results[index])
+
+            # Save the parsed ontology to a file for vizualization of the rules' results. 
+            if 0 in batch.index: 
+                ontology_save_path =  os.getcwd() + "/ontologies/updated_ontology.owl"
+                self.ontology.save(file=ontology_save_path) 
+        finally: 
+            batch_parser.remove_batch()
+        return batch_labels
+
+
+    def validate_rows(self, chunk): 
+        """
+        This method validates a chunk of observations over whole columns with the ObservationValidator 
+        of the parser (built on first use from the classes of the ontology).
+        Returns:
+          - The chunk typed with OBSERVATION_SCHEMA, the validity mask of its rows and the errors of the rejected rows.
+        """
+        if self.validator is None: 
+            self.validator = ObservationValidator(self.ontology)
+        return self.validator.validate(chunk)
+
+
+    def validate_chunks(self, chunks, sink, record_errors=True): 
+        """
+        This method yields the valid rows of the chunks of observations (see validate_rows). The rejected rows 
+        are counted and logged once per chunk and, with record_errors, kept in self.row_errors and written 
+        to the sink if it is a ProgressJournal.
+        """
+        for chunk in chunks: 
+            frame, valid, errors = self.validate_rows(chunk)
+            if errors: 
+                self.metrics.increment("rows_rejected_total", len(errors))
+                self.logger.warning(f"{len(errors)} observations of rows {chunk.index[0]}-{chunk.index[-1]} rejected by the validation.")
+                if record_errors: 
+                    self.row_errors.update(errors)
+                    if isinstance(sink, ProgressJournal): 
+                        for index, message in errors.items(): 
+                            sink.write_error(index, message)
+            if valid.all(): 
+                yield frame
+            elif valid.any(): 
+                yield frame[valid]
+
+
+    def record_row_error(self, sink, index, error): 
+        """
+        This method records a row that could not be labelled, so that the parse goes on with the next rows: 
+        the error is logged, counted, kept in self.row_errors and written to the sink if it is a ProgressJournal.
+        """
+        self.metrics.increment("row_errors_total")
+        self.logger.error(f"Error parsing observation {index}: {error}")
+        self.row_errors[index] = str(error)
+        if isinstance(sink, ProgressJournal): 
+            sink.write_error(index, str(error))
+
+
+    def parse_rows_batch(self, chunks, sink, batch_size, persistent_cache=None):
+        """
+        This method reasons over the dataset in chunks of batch_size rows: every row of a chunk 
+        gets its own Actor/Observation/PhysiologicalState individuals, so a single reasoner run 
+        labels the whole chunk. Larger chunks give more throughput, smaller ones less latency per label.
+
+        Args:
+          - chunks: The observations, as an iterable of DataFrames (see read_observations).
+          - sink: The label sink (see scripts/label_sink.py), None to only return the labels.
+          - batch_size: The number of rows reasoned together. If a batch fails, its rows are reasoned 
+            over one by one, and the rows failing on their own are left out (see record_row_error).
+          - persistent_cache: An optional PersistentInferenceCache: the rows it holds are labelled from it, 
+            the labels of the other rows are added to it.
+        Returns:
+          - The label payloads keyed by row index.
+        """
+
+        labels = {}
+        if persistent_cache is not None: 
+            persistent_cache.use_reasoner(self.reasoner)
+        for chunk in chunks: 
+            if persistent_cache is not None: 
+                chunk = self.label_cached_rows(chunk, sink, persistent_cache, labels)
+            for start in range(0, len(chunk), batch_size): 
+                batch = chunk.iloc[start:start + batch_size]
+                batch_start = time.perf_counter()
+                try: 
+                    labels.update(self.reason_batch(batch, sink, persistent_cache))
+                except Exception as e: 
+                    # Isolate the failing rows: every row of the batch is reasoned over on its own
+                    if len(batch) == 1: 
+                        self.record_row_error(sink, batch.index[0], e)
+                    else: 
+                        self.logger.warning(f"Error reasoning over observations {batch.index[0]} to {batch.index[-1]}: {e}, retrying row by row.")
+                        for position in range(len(batch)): 
+                            try: 
+                                labels.update(self.reason_batch(batch.iloc[position:position + 1], sink, persistent_cache))
+                            except Exception as e: 
+                                self.record_row_error(sink, batch.index[position], e)
+                self.metrics.observe("batch_seconds", time.perf_counter() - batch_start)
+                self.record_rows(len(batch))
+                self.logger.info(f"Observations {batch.index[0]} to {batch.index[-1]} processed.")
+
+        if persistent_cache is not None: 
+            persistent_cache.flush()
+            self.logger.info(f"Persistent inference cache: {persistent_cache.hits} hits, {persistent_cache.misses} misses.")
+        return labels
+
+
+    def parse_rows(self, chunks, sink, cache=None, persistent_cache=None):
+        """
+        This method reasons over the dataset one row at a time, reusing the single Observation/Actor
+        individuals of the ontology for every row.
+        Every row starting with the rules and instances already in place is undone with a savepoint of the 
+        world (see WorldSavepoint); the first row of a new world, which creates them, is undone by remove_prev_values.
+        A failing row is rolled back (with the rules and instances if it was creating them) and left out 
+        of the labels (see record_row_error), the next rows go on.
+        With a cache, the rows whose discretized state (see BandClassifier.state_keys) has already been 
+        reasoned over are labelled with the cached fatigue and eye state, without running the reasoner.
+
+        Args:
+          - chunks: The observations, as an iterable of DataFrames (see read_observations).
+          - sink: The label sink (see scripts/label_sink.py), None to only return the labels.
+          - cache: An optional InferenceCache.
+          - persistent_cache: An optional PersistentInferenceCache: the rows it holds are labelled from it, 
+            the labels of the other rows are added to it.
+        Returns:
+          - The label payloads keyed by row index, None if the ontology has no Observations class.
+        """
+
+        # Create instances for the Label and the Sensor
+        with self.ontology: 
+            self.rule_parser.create_instances("Label")
+            self.rule_parser.create_instances("MonitoringSensor")
+
+        # Check if the Observations class exists in the ontology
+        if self.entity_index.get_class("Observations") is None: 
+            self.logger.error(f"Class Observation not found in the ontology.")
+            return
+        self.logger.info(f"Class Observations found.")
+        
+        labels = {}
+        # Create the main instance of the Observations class
+        obs = self.ontology.Observations(f"observation_{0}")
+        classifier = BandClassifier(self.ontology) if cache is not None else None
+        savepoint = WorldSavepoint(self.ontology.world, "row", self.entity_index)
+        if self.reasoner_session is not None: 
+            self.reasoner_session.track(self.ontology.world)
+        if persistent_cache is not None: 
+            persistent_cache.use_reasoner(self.reasoner)
+        for chunk in chunks: 
+            if persistent_cache is not None: 
+                chunk = self.label_cached_rows(chunk, sink, persistent_cache, labels)
+            keys = classifier.state_keys(chunk) if cache is not None else [None] * len(chunk)
+            for index, record, key in zip(chunk.index, chunk.to_dict("records"), keys):
+
+                # Reuse the reasoning result of an already seen state 
+                result = cache.get(key) if key is not None else None
+                if result is not None: 
+                    labels[index] = self.rule_parser.create_cached_label(sink, index, record, result)
+                    self.metrics.increment("rows_cached_total")
+                    self.record_rows(1)
+                    continue
+
+                row_start = time.perf_counter()
+                changes = self.ontology.world.graph.db.total_changes
+                inferred = self.metrics.counters.get("triples_inferred_total", 0)
+                rollback = self.rule_parser.rules_ready
+                savepoint.begin()
                 
-                # Pass Actor's Characteristics
-                obs.hasAccessories.append(row['Accessories'] if "Accessories" in dataset.columns and isinstance(row['Accessories'],str)  else [-1])
-                obs.hasAge.append(row['Age'] if "Age" in dataset.columns and isinstance(row['Age'],int) else [-1])
-                obs.hasSex.append(row['Sex'] if "Sex" in dataset.columns and isinstance(row['Sex'],str) else [-1])
-                obs.hasFaceCharacteristics.append(row["Characteristics"] if "Characteristics" in dataset.columns and isinstance(row['Characteristics'],str) else [-1])
-                obs.hasDemographic.append(row["Demographic"] if "Demographic" in dataset.columns and isinstance(row['Demographic'],str)  else [-1])
-
-                # Connect the observation to the corresponding subclasses inside the ontology, based on the super class they belong to. 
-                self.rule_parser.observations_to_classes(obs, "PhysiologicalState", "ObsIsDividedIntoPhS")
-                self.rule_parser.observations_to_classes(obs, "Actor", "ObsIsDividedIntoActor")
+                try: 
+                    # Connect the sensor to the observations 
+                    # self.rule_parser.connect_sensor_to_observations(obs)
+
+                    # Pass health factors and Actor's Characteristics, -1 marks a missing value
+                    self.rule_parser.loader.add_data([(obs.storid, prop, record_value(record, column)) for column, prop in OBSERVATION_PROPERTIES.items()])
+
+                    # Connect the observation to the corresponding subclasses inside the ontology, based on the super class they belong to. 
+                    self.rule_parser.observations_to_classes(obs, "PhysiologicalState", "ObsIsDividedIntoPhS")
+                    self.rule_parser.observations_to_classes(obs, "Actor", "ObsIsDividedIntoActor")
                 
-                # Run the reasoner for each updated observation
-                self.rule_parser.synchronize_ontology()
+                    # Run the reasoner for each updated observation
+                    self.rule_parser.synchronize_ontology()
 
-                # Assign values to the subclasses instances based on the observations
-                for obs in self.ontology.Observations.instances(): 
-                    self.rule_parser.assign_values(obs,"ObsIsDividedIntoPhS","hasNumericalValue")
-                    self.rule_parser.assign_values(obs,"ObsIsDividedIntoActor","hasStringValue")
+                    # Assign values to the subclasses instances based on the observations
+                    for obs in self.ontology.Observations.instances(): 
+                        self.rule_parser.assign_values(obs,"ObsIsDividedIntoPhS","hasNumericalValue")
+                        self.rule_parser.assign_values(obs,"ObsIsDividedIntoActor","hasStringValue")
                 
-                # Create the rules (once) for numerical comparison and health assessment
-                self.rule_parser.set_up_rules(index)
+                    # Create the rules (once) for numerical comparison and health assessment
+                    self.rule_parser.set_up_rules()
             
-                # Run the reasoner to update the ontology with the new values
-                self.rule_parser.synchronize_ontology()
+                    # Run the reasoner to update the ontology with the new values
+                    self.rule_parser.synchronize_ontology()
 
-                # Create the description of the actor and save it in JSON format
-                self.rule_parser.create_label(filepath, index)
+                    # Create the description of the actor and write it to the label sink
+                    labels[index] = self.rule_parser.create_label(sink, index)
+                    if labels[index] is None: 
+                        raise RuntimeError("No label created.")
+                    if key is not None: 
+                        cache.put(key, self.rule_parser.reasoning_result())
+                    if persistent_cache is not None: 
+                        persistent_cache.put(record, labels[index], self.rule_parser.reasoning_result())
                 
-                # Save the parsed ontology to a file for vizualization of the rules' results. 
-                if index ==0: 
-                    ontology_save_path =  os.getcwd() + "/ontologies/updated_ontology.owl"
-                    self.ontology.save(file=ontology_save_path) 
+                    # Save the parsed ontology to a file for vizualization of the rules' results. 
+                    if index ==0: 
+                        ontology_save_path =  os.getcwd() + "/ontologies/updated_ontology.owl"
+                        self.ontology.save(file=ontology_save_path) 
 
-                # Remove the previous values from the ontology to avoid conflicts
-                self.rule_parser.remove_prev_values(obs)
-                
+                    # Triples asserted or inferred by the row
+                    inferred = self.metrics.counters.get("triples_inferred_total", 0) - inferred
+                    asserted = self.ontology.world.graph.db.total_changes - changes - inferred
+                    self.metrics.observe("triples_inferred_per_row", inferred, COUNT_BUCKETS)
+                    self.metrics.observe("triples_asserted_per_row", asserted, COUNT_BUCKETS)
+                    self.metrics.observe("row_seconds", time.perf_counter() - row_start)
+                    self.record_rows(1)
+                except Exception as e: 
+                    labels.pop(index, None)
+                    self.record_row_error(sink, index, e)
+                    # Undo the row, with the rules and instances if it was creating them
+                    savepoint.rollback()
+                    self.rule_parser.rules_ready = rollback
+                    if not rollback:
+                        # The rules created again by the next row get the same storids, compile them again
+                        self.rule_parser.rule_engine.reset()
+                else:
+                    # Remove the values of the row from the ontology to avoid conflicts
+                    if rollback: 
+                        savepoint.rollback()
+                    else: 
+                        savepoint.release()
+                        self.rule_parser.remove_prev_values(obs)
+
+        savepoint.close()
+        if cache is not None: 
+            self.logger.info(f"Inference cache: {cache.hits} hits, {cache.misses} misses.")
+        if persistent_cache is not None: 
+            persistent_cache.flush()
+            self.logger.info(f"Persistent inference cache: {persistent_cache.hits} hits, {persistent_cache.misses} misses.")
+        return labels
+
+
+    def parse_segments(self, chunks, recycler, segment_rows, parse): 
+        """
+        This method parses the observations in segments of segment_rows rows with parse (parse_rows or 
+        parse_rows_batch), and lets the WorldRecycler recycle the World between two segments.
+        Returns:
+          - The label payloads keyed by row index (none if the recycler does not keep them), 
+            None if the ontology has no Observations class.
+        """
+
+        labels = {}
+        for segment in recycler.segments(chunks, segment_rows): 
+            if recycler.due: 
+                recycler.recycle(self)
+            segment_labels = parse([segment])
+            if segment_labels is None: 
+                return None
+            if recycler.keep_labels: 
+                labels.update(segment_labels)
+            recycler.check(self, len(segment))
+        return labels
+
+
+    def parse_rows_sharded(self, chunks, sink, workers, batch_size=None, persistent_cache=None, recycler=None, observations=None):
+        """
+        This method spreads the dataset over a pool of worker processes. Every worker loads the ontology 
+        into its own World, with its own rules and reasoner, and parses the shards it receives like the 
+        serial path; the labels of the shards are merged by row index and written to the sink by this process.
+        Every chunk is split into one shard per worker, and at most two shards per worker are pending 
+        at a time, so that the reader does not run ahead of the workers.
+
+        Args:
+          - chunks: The observations, as an iterable of DataFrames (see read_observations).
+          - sink: The label sink (see scripts/label_sink.py), None to only return the labels.
+          - workers: The number of worker processes.
+          - batch_size: Passed to the workers, see parse_rows_batch.
+          - persistent_cache: An optional PersistentInferenceCache: the rows it holds are labelled from it, 
+            the other rows are sent to the workers, which add their labels to the same database.
+          - recycler: An optional WorldRecycler (prepared by parse_observations): every worker opens its snapshot 
+            and recycles its World with the same budgets, checked after every shard it parses.
+          - observations: An optional BinaryObservationCache holding the rows of the chunks: every worker maps it, 
+            and only the indexes of the rows of a shard are sent to the workers instead of the rows.
+        Returns:
+          - The label payloads keyed by row index.
+        """
 
+        labels = {}
+        pending = deque()
+
+        def collect(future): 
+            shard_labels, shard_errors, shard_metrics = future.result()
+            if shard_labels is None: 
+                raise RuntimeError("Class Observation not found in the ontology.")
+            if recycler is None or recycler.keep_labels: 
+                labels.update(shard_labels)
+            if sink is not None: 
+                for index, label in shard_labels.items(): 
+                    sink.write(index, label)
+            # The errors were logged and counted by the worker
+            self.row_errors.update(shard_errors)
+            if isinstance(sink, ProgressJournal): 
+                for index, message in shard_errors.items(): 
+                    sink.write_error(index, message)
+            self.metrics.merge(shard_metrics)
+            self.rows_parsed += len(shard_labels)
+            self.metrics.set_gauge("rows_per_second", self.rows_parsed / (time.perf_counter() - self.parse_start))
+            self.metrics.maybe_flush()
+
+        if persistent_cache is not None: 
+            persistent_cache.use_reasoner(self.reasoner)
+        cache_args = None if persistent_cache is None else (persistent_cache.path, persistent_cache.max_entries)
+        snapshot_path = self.snapshot_path if recycler is None else recycler.snapshot_path
+        recycle_args = None if recycler is None else (recycler.max_rows, recycler.max_rss_mb, recycler.check_every)
+        observations_path = None if observations is None else observations.path
+        initargs = (self.ontology_path, self.logger.name, self.reasoner, snapshot_path, cache_args, recycle_args, observations_path)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_shard_worker, initargs=initargs) as executor: 
+            for chunk in chunks: 
+                if persistent_cache is not None: 
+                    chunk = self.label_cached_rows(chunk, sink, persistent_cache, labels)
+                for rows in np.array_split(np.arange(len(chunk)), workers): 
+                    if len(rows): 
+                        shard = chunk.iloc[rows] if observations is None else chunk.index[rows].to_numpy()
+                        pending.append(executor.submit(parse_shard, shard, batch_size))
+                    while len(pending) >= 2 * workers: 
+                        collect(pending.popleft())
+            while pending: 
+                collect(pending.popleft())
+        return labels
+
+
+    def parse_observations(self, dataset_path, batch_size=None, workers=1, chunksize=DEFAULT_CHUNKSIZE, max_rows=None, cache=None, label_sink=None, window=None, persistent_cache=None, journal=None, recycler=None, binary_cache_dir=None, validate=False):
+        """
+        This method parses the observations from the given dataset and creates instances of the Observation class.
+        Then translates the rules established in the ontology with the reasoner and saves the results.
+        The dataset is streamed in chunks of chunksize rows (see read_observations).
+        The label payloads are kept in self.labels, keyed by row index.
+        
+        Args:
+          - dataset_path: The path to the dataset file.
+          - batch_size: If given, batch_size rows are reasoned together in a single reasoner run 
+            (see parse_rows_batch), instead of one row per run. 
+          - workers: The number of processes sharing the dataset (see parse_rows_sharded). 
+            With a single worker the dataset is parsed in the current process.
+          - chunksize: The number of rows read at once from the dataset.
+          - max_rows: If given, only the first max_rows rows of the dataset are parsed.
+          - cache: An optional InferenceCache used by the serial path (see parse_rows). It can be 
+            saved with cache.save(path) and reused by a later run with InferenceCache.load(path).
+          - label_sink: The sink receiving the labels (see scripts/label_sink.py), flushed at the end of the parse 
+            and left open. By default every label is written to labels/label_{index}.json.
+          - window: An optional WindowAggregator: the samples are aggregated into windows of their TIME column, 
+            and every window is parsed (and labelled, keyed by window number) as a single row.
+          - persistent_cache: An optional PersistentInferenceCache (see scripts/inference_cache.py): the rows 
+            labelled by an earlier run with the same ontology and rules are not reasoned over again.
+          - journal: An optional ProgressJournal (see scripts/checkpoint.py) recording the labelled rows: the rows 
+            it already labelled are skipped, so an interrupted parse resumes where it stopped, and all the labels 
+            of the journal are returned (unless the recycler does not keep them). The rows that fail are left out 
+            and kept in self.row_errors, a single row failing does not stop the parse; they are tried again on resume.
+          - recycler: An optional WorldRecycler (see scripts/recycler.py): the dataset is parsed in segments, 
+            the RSS of the process is reported after every segment in the rss_mb gauge, and the World is replaced 
+            by a fresh copy of a snapshot once the row or memory budget of the recycler is exceeded.
+          - binary_cache_dir: If given, the dataset is converted once into a binary cache in this directory, keyed 
+            on the digest of the dataset file (see scripts/observation_cache.py), and the rows are read from 
+            its memory-mapped columns instead of the text of the dataset. Sharded workers map the same cache.
+          - validate: If True, every chunk is validated over whole columns (see scripts/observation_validator.py): 
+            the rows with a value out of the range or the domain of its column are left out and kept in self.row_errors 
+            (without a window, whose samples are left out of their windows only). Off by default: every row is 
+            parsed as read, as before the validation existed.
+        """
+
+        observations = None
+        if binary_cache_dir is not None: 
+            observations = BinaryObservationCache.load_or_build(dataset_path, self.logger, binary_cache_dir, chunksize)
+            chunks = observations.chunks(chunksize, max_rows)
+        else: 
+            chunks = read_observations(dataset_path, chunksize, max_rows)
+        sink = label_sink if label_sink is not None else JsonFileLabelSink(os.getcwd() + "/labels")
+        if journal is not None: 
+            sink = journal.attach(sink)
+        if validate: 
+            # The samples of the windows are not rows of the labels
+            chunks = self.validate_chunks(chunks, sink, record_errors=window is None)
+        if window is not None: 
+            chunks = window.aggregate(chunks)
+        if journal is not None: 
+            if journal.completed: 
+                self.logger.info(f"Resuming after {len(journal.completed)} journaled rows (last row {journal.last_index}).")
+                chunks = skip_rows(chunks, set(journal.completed))
+        self.parse_start = time.perf_counter()
+        self.rows_parsed = 0
+        self.row_errors = {}
+
+        try: 
+            segment_rows = recycler.prepare(self, batch_size) if recycler is not None else None
+            if workers > 1: 
+                # The windows are not rows of the cache
+                shared = observations if window is None else None
+                labels = self.parse_rows_sharded(chunks, sink, workers, batch_size, persistent_cache, recycler, shared)
+            else: 
+                if batch_size is not None: 
+                    parse = lambda rows: self.parse_rows_batch(rows, sink, batch_size, persistent_cache)
+                else: 
+                    parse = lambda rows: self.parse_rows(rows, sink, cache, persistent_cache)
+                labels = parse(chunks) if recycler is None else self.parse_segments(chunks, recycler, segment_rows, parse)
+                if labels is None: 
+                    return
+
+            sink.flush()
+            if journal is not None: 
+                labels = dict(journal.labels()) if recycler is None or recycler.keep_labels else {}
+                self.row_errors = journal.errors()
+            if self.row_errors: 
+                self.logger.warning(f"{len(self.row_errors)} observations could not be labelled.")
+            if self.validator is not None and self.validator.rows_rejected: 
+                self.logger.info(f"{self.validator.rows_rejected} of {self.validator.rows_checked} observations rejected by the validation, by column: {dict(self.validator.rejections)}.")
+            if window is not None: 
+                self.logger.info(f"{window.samples_total} samples aggregated into {window.windows_total} windows.")
+            if recycler is not None: 
+                self.logger.info(f"World recycled {recycler.recycles} times, RSS {self.metrics.gauges.get('rss_mb', 0):.0f} MB.")
+            self.labels = labels
+            self.metrics.set_gauge("rows_per_second", self.rows_parsed / (time.perf_counter() - self.parse_start))
             self.logger.info("Ontology saved.")
             return f"Ontology finished processing dataset observations."
         except Exception as e:
+                self.metrics.increment("errors_total")
                 self.logger.error(f"Error parsing the ontology: {e}")
+                if journal is not None: 
+                    # Keep the progress made so far for the next run
+                    try: 
+                        journal.flush()
+                    except Exception as flush_error: 
+                        self.logger.error(f"Error committing the journal: {flush_error}")
                 return f"Error parsing the ontology: {e}"
+        finally: 
+            self.metrics.flush()
 
 
+    def record_rows(self, rows): 
+        """
+        This method counts the parsed rows, updates the throughput of the current parse 
+        and flushes the metrics when their flush interval has passed.
+        """
+        self.rows_parsed += rows
+        self.metrics.increment("rows_total", rows)
+        self.metrics.set_gauge("rows_per_second", self.rows_parsed / (time.perf_counter() - self.parse_start))
+        self.metrics.maybe_flush()
 
 
 
+def skip_rows(chunks, indexes):
+    """
+    Leaves the rows with the given indexes out of the chunks of observations, dropping the emptied chunks.
+    """
+    for chunk in chunks: 
+        chunk = chunk[~chunk.index.isin(indexes)]
+        if len(chunk): 
+            yield chunk
 
 
+# Parser, PersistentInferenceCache, WorldRecycler and BinaryObservationCache of the current worker process 
+# of OntologyParser.parse_rows_sharded.
+_shard_parser = None
+_shard_cache = None
+_shard_recycler = None
+_shard_observations = None
 
 
-    
+def init_shard_worker(ontology_path, logger_name, reasoner, snapshot_path=None, cache_args=None, recycle_args=None, observations_path=None):
+    """
+    Creates the parser of a worker process of OntologyParser.parse_rows_sharded, 
+    holding the ontology in a World of its own. The parser lives as long as the process 
+    (a Pellet session stops by itself when the process exits and closes its pipe).
+
+    Args:
+      - ontology_path: The path to the ontology file.
+      - logger_name: The name of the logger of the parent parser.
+      - reasoner: The reasoner of the parent parser.
+      - snapshot_path: The snapshot of the parent parser, opened by every worker in a private copy.
+      - cache_args: The path and max_entries of the PersistentInferenceCache of the parent, opened by every worker.
+      - recycle_args: The max_rows, max_rss_mb and check_every of the WorldRecycler of the parent.
+      - observations_path: The BinaryObservationCache of the parent, mapped by every worker.
+    """
+
+    global _shard_parser, _shard_cache, _shard_recycler, _shard_observations
+    world = World() if snapshot_path is None else None
+    _shard_parser = OntologyParser(ontology_path, logging.getLogger(logger_name), reasoner=reasoner, world=world, snapshot_path=snapshot_path)
+    # Worker processes exit without running atexit handlers, multiprocessing finalizers are run instead.
+    multiprocessing.util.Finalize(_shard_parser, _shard_parser.close, exitpriority=10)
+    if cache_args is not None: 
+        _shard_cache = PersistentInferenceCache(cache_args[0], ontology_path, cache_args[1], reasoner)
+        multiprocessing.util.Finalize(_shard_cache, _shard_cache.close, exitpriority=10)
+    if recycle_args is not None: 
+        _shard_recycler = WorldRecycler(*recycle_args, snapshot_path=snapshot_path)
+    if observations_path is not None: 
+        _shard_observations = BinaryObservationCache(observations_path)
+
+
+def parse_shard(shard, batch_size=None):
+    """
+    Parses a shard of the dataset with the parser of the current worker process.
+    The labels are only returned, to be written by the parent process.
+
+    Args:
+      - shard: The rows of the shard, indexed by their position in the dataset, 
+        or the indexes of the rows in the BinaryObservationCache of the worker.
+      - batch_size: See OntologyParser.parse_rows_batch.
+    Returns:
+      - The label payloads keyed by row index, the errors of the rows left out keyed by row index, 
+        and the metrics of the shard.
+    """
 
-    
\ No newline at end of file
+    if _shard_observations is not None: 
+        shard = _shard_observations.take(shard)
+    if _shard_recycler is not None and _shard_recycler.due: 
+        _shard_recycler.recycle(_shard_parser)
+    if batch_size is not None: 
+        labels = _shard_parser.parse_rows_batch([shard], None, batch_size, _shard_cache)
+    else: 
+        labels = _shard_parser.parse_rows([shard], None, persistent_cache=_shard_cache)
+    if _shard_recycler is not None: 
+        _shard_recycler.check(_shard_parser, len(shard))
+    errors = _shard_parser.row_errors
+    _shard_parser.row_errors = {}
+    metrics = _shard_parser.metrics.snapshot()
+    _shard_parser.metrics.reset()
+    return labels, errors, metrics
@@ -0,0 +1,44 @@
+from owlready2.base import _universal_datatype_2_abbrev
+from owlready2.reasoning import _PELLET_CLASSPATH, _apply_reasoning_results, _apply_inferred_obj_relations, _apply_inferred_data_relations
+
+
+# The private owlready2 helpers used by the reasoners of the repository, wrapped here so that an upgrade of
+# owlready2 only breaks this module. They match owlready2 0.46.
+
+# Classpath of the Pellet jars shipped with owlready2.
+PELLET_CLASSPATH = _PELLET_CLASSPATH
+
+
+def datatype_abbrev(value_type):
+    """
+    Returns the storid of the RDF datatype owlready2 stores the Python values of value_type with (e.g. int -> xsd:integer).
+    """
+    return _universal_datatype_2_abbrev[value_type]
+
+
+def apply_inferred_types(world, ontology, new_parents, entity_2_type):
+    """
+    Writes inferred class memberships into the ontology, as owlready2 does with the results of Pellet.
+    Args:
+        new_parents (dict): storid of an individual -> storids of its classes, which replace its current ones.
+        entity_2_type (dict): storid -> "individual" or "class".
+    """
+    _apply_reasoning_results(world, ontology, False, new_parents, {}, entity_2_type)
+
+
+def apply_inferred_obj_relations(world, ontology, relations):
+    """
+    Writes inferred object property values into the ontology.
+    Args:
+        relations (list): (subject storid, property, object storid) triples.
+    """
+    _apply_inferred_obj_relations(world, ontology, False, relations)
+
+
+def apply_inferred_data_relations(world, ontology, relations):
+    """
+    Writes inferred data property values into the ontology.
+    Args:
+        relations (list): (subject storid, property, value, datatype storid) quadruples.
+    """
+    _apply_inferred_data_relations(world, ontology, False, relations)
@@ -0,0 +1,305 @@
+from owlready2 import *
+from scripts.owlready_compat import PELLET_CLASSPATH, apply_inferred_types, apply_inferred_obj_relations
+from scripts.savepoint import TouchedStorids
+from scripts.bulk_loader import chunked, MAX_VARIABLES
+from collections import defaultdict
+from functools import lru_cache
+import owlready2
+import os
+import subprocess
+import tempfile
+
+
+JAVA_SOURCE = os.path.join(os.path.dirname(__file__), "java", "PelletSession.java")
+JAVA_BUILD_DIR = os.path.join(os.path.dirname(__file__), "java", "build")
+
+# Number of bytes of the stderr of the JVM included in the errors of the session.
+STDERR_TAIL = 4000
+
+
+class PelletSession:
+    """
+    PelletSession keeps a single Pellet JVM alive for the whole run instead of
+    starting a new one for every synchronization of the ontology.
+
+    On each synchronization only the triples of the entities touched since the previous one
+    (recorded by a TouchedStorids) are read from the quadstore as N-Triples, and their difference
+    with the triples sent for them is forwarded to the JVM, which keeps the model loaded in memory.
+    The whole world is only sent (RESET) on the first synchronization of a world, or when the
+    changes can not be tracked (see synchronize). The inferred types and object property values are applied to
+    the world in the same way as owlready2's sync_reasoner_pellet does. An inconsistent
+    ontology raises OwlReadyInconsistentOntologyError, any other failure of the JVM an
+    OwlReadyJavaError holding the end of its stderr.
+
+    NOTE: Unlike sync_reasoner_pellet, the classes are not reclassified: only the types and
+    object property values of the individuals are inferred (see scripts/java/PelletSession.java).
+
+    NOTE: Blank nodes can not be matched between two separate messages (Jena relabels them),
+    so any change involving a blank node (e.g. the creation of new SWRL rules) triggers a
+    full reload of the model inside the running JVM.
+    """
+
+    def __init__(self, logger, java_memory=2000):
+        """
+        Initializes the session without starting the JVM.
+        The JVM is started lazily on the first synchronization.
+        Args:
+            logger (Logger): The logger of the OntologyParser.
+            java_memory (int): The maximum heap size of the JVM in MB.
+        """
+        self.logger = logger
+        self.java_memory = java_memory
+        self.process = None
+        self.stderr = None
+        self.stderr_read = 0
+        # N-Triples lines sent to the JVM, by subject storid, and the tracker of the world they were read from
+        self.sent_triples = None
+        self.touched = None
+        self.python_name_iri = "http://www.lesfleursdunormal.fr/static/_downloads/owlready_ontology.owl#python_name"
+
+
+    def compile_session(self):
+        """
+        Compiles the Java side of the session against the Pellet jars shipped with owlready2.
+        Compilation only happens when the class file is missing or older than the source.
+        """
+        class_file = os.path.join(JAVA_BUILD_DIR, "PelletSession.class")
+        if os.path.exists(class_file) and os.path.getmtime(class_file) >= os.path.getmtime(JAVA_SOURCE):
+            return
+
+        os.makedirs(JAVA_BUILD_DIR, exist_ok=True)
+        javac = os.path.join(os.path.dirname(owlready2.JAVA_EXE), "javac") if os.path.dirname(owlready2.JAVA_EXE) else "javac"
+        result = subprocess.run([javac, "-cp", PELLET_CLASSPATH, "-d", JAVA_BUILD_DIR, JAVA_SOURCE], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise OwlReadyJavaError(f"Pellet session compilation failed:\n{result.stderr}")
+        self.logger.info("Pellet session compiled.")
+
+
+    def start(self):
+        """
+        Starts the JVM running the Pellet session, if not already running.
+        """
+        if self.process is not None and self.process.poll() is None:
+            return
+
+        self.compile_session()
+        classpath = os.pathsep.join([JAVA_BUILD_DIR, PELLET_CLASSPATH])
+        command = [owlready2.JAVA_EXE, f"-Xmx{self.java_memory}M", "-cp", classpath, "PelletSession"]
+        # A file rather than a pipe, which would block the JVM once full
+        if self.stderr is None:
+            self.stderr = tempfile.TemporaryFile()
+            self.stderr_read = 0
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            text=True,
+            encoding="utf-8",
+        )
+        self.sent_triples = None
+        self.logger.info("Pellet session started.")
+
+
+    def close(self):
+        """
+        Stops the JVM of the session.
+        """
+        if self.process is None:
+            return
+
+        try:
+            self.process.stdin.write("QUIT\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+        self.process = None
+        self.stderr.close()
+        self.stderr = None
+        self.sent_triples = None
+        if self.touched is not None:
+            self.touched.close()
+            self.touched = None
+        self.logger.info("Pellet session closed.")
+
+
+    def stderr_tail(self):
+        """
+        Returns the end of what the JVM wrote to stderr since the last error, for the error messages.
+        """
+        if self.stderr is None:
+            return ""
+        size = self.stderr.seek(0, os.SEEK_END)
+        self.stderr.seek(max(self.stderr_read, size - STDERR_TAIL))
+        tail = self.stderr.read().decode("utf-8", errors="replace").strip()
+        self.stderr_read = size
+        return f"\nJava error output:\n{tail}" if tail else ""
+
+
+    def send(self, command, triples=()):
+        """
+        Sends a command (and the triples it carries) to the JVM and returns the response lines.
+        Args:
+            command (str): One of RESET, ADD, REMOVE or REALIZE.
+            triples (iterable): N-Triples lines sent along with the command.
+        """
+        triples = list(triples)
+        message = f"{command} {len(triples)}\n" if command != "REALIZE" else "REALIZE\n"
+        self.process.stdin.write(message + "".join(triple + "\n" for triple in triples))
+        self.process.stdin.flush()
+
+        lines = []
+        for line in self.process.stdout:
+            line = line.rstrip("\n")
+            if line.startswith("INCONSISTENT") or "InconsistentOntologyException" in line:
+                raise OwlReadyInconsistentOntologyError(f"Pellet session error: {line.partition(' ')[2]}")
+            if line.startswith("ERROR"):
+                raise OwlReadyJavaError(f"Pellet session error: {line[6:]}{self.stderr_tail()}")
+            if line in ("OK", "END"):
+                return lines
+            lines.append(line)
+        self.process.wait()
+        raise OwlReadyJavaError(f"Pellet session terminated unexpectedly (exit code {self.process.returncode}).{self.stderr_tail()}")
+
+
+    def track(self, world):
+        """
+        Starts recording the entities of world touched between two synchronizations, if not already recording.
+        Called by the parser outside of any savepoint, whose rollback would drop the triggers of the tracker.
+        """
+        if self.touched is not None and self.touched.world is world and self.touched.active():
+            return
+        if self.touched is not None and self.touched.world is world:
+            self.touched.close()
+        # The tracker of another (closed) world went with its connection
+        self.touched = TouchedStorids(world, "pellet_session")
+        self.sent_triples = None
+
+
+    def export_triples(self, world, subjects=None):
+        """
+        Exports triples of the world as N-Triples lines, grouped by subject storid, skipping owlready2's
+        python_name annotations. The lines are written as owlready2 writes them with world.save(format="ntriples").
+        Args:
+            world (World): The owlready2 world to export.
+            subjects (iterable): The storids of the subjects to export, None for the whole world.
+        Returns:
+            {subject storid: set of N-Triples lines}, without the subjects having no triple.
+        """
+        python_name_storid = world._abbreviate(self.python_name_iri)
+        # Storids are given again after a rollback, the IRIs are only cached for this export
+        unabbreviate = lru_cache(None)(world._unabbreviate)
+        node = lambda storid: f"_:{-storid}" if storid < 0 else f"<{unabbreviate(storid)}>"
+
+        query = "SELECT s, p, o, NULL FROM objs{} UNION ALL SELECT s, p, o, d FROM datas{}"
+        if subjects is None:
+            rows = world.graph.execute(query.format("", ""))
+        else:
+            # Two IN clauses per statement
+            rows = (row for part in chunked(subjects, MAX_VARIABLES // 2) for row in world.graph.execute(
+                query.format(*[f" WHERE s IN ({','.join('?' * len(part))})"] * 2), part + part))
+
+        triples = defaultdict(set)
+        for s, p, o, d in rows:
+            if p == python_name_storid:
+                continue
+            if d is None:
+                o = node(o)
+            else:
+                if isinstance(o, str):
+                    o = o.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                if isinstance(d, str) and d.startswith("@"):
+                    o = f'"{o}"{d}'
+                elif d == 0:
+                    o = f'"{o}"'
+                else:
+                    o = f'"{o}"^^<{unabbreviate(d)}>'
+            triples[s].add(f"{node(s)} <{unabbreviate(p)}> {o} .")
+        return triples
+
+
+    def synchronize(self, ontology):
+        """
+        Sends the changes of the world to the running JVM, realizes the model and applies
+        the inferred facts into the given ontology.
+        The whole world is sent again (RESET) when nothing was sent to the running JVM yet, when the world changed
+        (e.g. recycled), when the triggers of the tracker were dropped (created inside a savepoint that was rolled back)
+        or when a changed triple involves a blank node.
+        Args:
+            ontology (Ontology): The ontology receiving the inferred facts.
+        """
+        self.start()
+        world = ontology.world
+        tracked = (self.sent_triples is not None and self.touched is not None
+                   and self.touched.world is world and self.touched.active())
+        if tracked:
+            subjects = self.touched.take()
+            triples = self.export_triples(world, subjects)
+            added = set()
+            removed = set()
+            for subject in subjects:
+                sent = self.sent_triples.get(subject, set())
+                current = triples.get(subject, set())
+                added |= current - sent
+                removed |= sent - current
+            if any("_:" in triple for triple in added | removed):
+                tracked = False
+            else:
+                for subject in subjects:
+                    if subject in triples:
+                        self.sent_triples[subject] = triples[subject]
+                    else:
+                        self.sent_triples.pop(subject, None)
+
+        if tracked:
+            if removed:
+                self.send("REMOVE", removed)
+            if added:
+                self.send("ADD", added)
+        else:
+            self.track(world)
+            self.touched.clear()
+            self.sent_triples = self.export_triples(world)
+            self.send("RESET", sorted(line for lines in self.sent_triples.values() for line in lines))
+
+        output = self.send("REALIZE")
+        self.apply_results(world, ontology, output)
+
+
+    def apply_results(self, world, ontology, output):
+        """
+        Applies the output of the REALIZE command to the world.
+        Args:
+            world (World): The owlready2 world.
+            ontology (Ontology): The ontology receiving the inferred facts.
+            output (list): The TYPE and PROPINST lines returned by the JVM.
+        """
+        new_parents = defaultdict(list)
+        entity_2_type = {}
+        inferred_obj_relations = []
+
+        for line in output:
+            kind, _, fact = line.partition(": ")
+            if kind == "TYPE":
+                ind_iri, class_iri = fact.split(" ")
+                ind_storid = ontology._abbreviate(ind_iri)
+                class_storid = ontology._abbreviate(class_iri)
+                entity_2_type[ind_storid] = "individual"
+                entity_2_type[class_storid] = "class"
+                new_parents[ind_storid].append(class_storid)
+
+            elif kind == "PROPINST":
+                a_iri, prop_iri, b_iri = fact.split(" ")
+                prop = world[prop_iri]
+                if prop is None:
+                    continue
+                a_storid = ontology._abbreviate(a_iri, False)
+                b_storid = ontology._abbreviate(b_iri, False)
+                if ((a_storid is not None) and (b_storid is not None) and
+                    (not world._has_obj_triple_spo(a_storid, prop.storid, b_storid)) and
+                    ((not prop._inverse_property) or (not world._has_obj_triple_spo(b_storid, prop._inverse_storid, a_storid)))):
+                    inferred_obj_relations.append((a_storid, prop, b_storid))
+
+        apply_inferred_types(world, ontology, new_parents, entity_2_type)
+        apply_inferred_obj_relations(world, ontology, inferred_obj_relations)
@@ -0,0 +1,141 @@
+from scripts.snapshot import build_snapshot
+import gc
+import os
+import resource
+import tempfile
+import time
+
+
+def current_rss_mb():
+    """
+    Returns the resident set size of the process in MB (Linux), or its peak where /proc is not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class WorldRecycler:
+    """
+    WorldRecycler keeps the memory of a long parse bounded by periodically replacing the World of the parser
+    with a fresh private copy of a snapshot (see scripts/snapshot.py), holding the rules and instances but none
+    of the facts, labels, identifiers and reasoner leftovers accumulated by the parsed rows.
+
+    The dataset is parsed in segments of check_every rows (rounded up to a multiple of the batch size):
+    after every segment the RSS of the process is reported in the rss_mb gauge of the parser metrics,
+    and the World is recycled before the next segment once max_rows rows have been parsed since the last
+    recycling, or once the RSS reaches max_rss_mb. The position of the parse is kept by the chunk stream,
+    the sinks, caches and journal, which live outside the World, so recycling never loses or repeats a row.
+
+    If the parser was not opened from a snapshot, one is built at the start of the parse (in snapshot_path,
+    or in a temporary file removed by close()) for the parsing mode of the run.
+    """
+
+    def __init__(self, max_rows=None, max_rss_mb=None, check_every=100, snapshot_path=None, keep_labels=True):
+        """
+        Args:
+            max_rows (int): The number of rows parsed in a World before it is recycled, None for no row budget.
+            max_rss_mb (float): The RSS of the process in MB above which the World is recycled, None for no memory budget.
+            check_every (int): The number of rows parsed between two checks of the budgets.
+            snapshot_path (str): Where the snapshot is built when the parser was not opened from one,
+                by default in a temporary file.
+            keep_labels (bool): Whether the labels are also returned by the parse (and kept in parser.labels),
+                False to only write them to the label sink, so that they do not grow with the rows either.
+        """
+        if max_rows is None and max_rss_mb is None:
+            raise ValueError("A row or memory budget is required to recycle the World.")
+        if check_every < 1:
+            raise ValueError("check_every must be positive.")
+        self.max_rows = max_rows
+        self.max_rss_mb = max_rss_mb
+        self.check_every = check_every
+        self.snapshot_path = snapshot_path
+        self.keep_labels = keep_labels
+        self.temporary_snapshot = None
+        self.built_mode = None
+        self.rows_since_recycle = 0
+        self.due = None
+        self.recycles = 0
+
+
+    def prepare(self, parser, batch_size=None):
+        """
+        Sets the snapshot the World of parser is recycled from, building it if needed,
+        and returns the number of rows of a segment.
+        """
+        mode = "batch" if batch_size is not None else "serial"
+        if parser.snapshot_path is not None:
+            self.snapshot_path = parser.snapshot_path
+        elif self.built_mode != mode:
+            if self.snapshot_path is None:
+                handle, self.temporary_snapshot = tempfile.mkstemp(suffix=".sqlite3")
+                os.close(handle)
+                self.snapshot_path = self.temporary_snapshot
+            build_snapshot(parser.ontology_path, self.snapshot_path, parser.logger, mode, parser.reasoner)
+            self.built_mode = mode
+        self.rows_since_recycle = 0
+        self.due = None
+        if batch_size is None:
+            return self.check_every
+        return -(-self.check_every // batch_size) * batch_size
+
+
+    def segments(self, chunks, rows):
+        """
+        Splits the chunks of observations into segments of at most rows rows.
+        """
+        for chunk in chunks:
+            for start in range(0, len(chunk), rows):
+                yield chunk.iloc[start:start + rows]
+
+
+    def check(self, parser, rows):
+        """
+        Reports the RSS of the process once rows more rows have been parsed, and returns whether a budget
+        is exceeded, in which case the World must be recycled before the next rows (see recycle).
+        """
+        self.rows_since_recycle += rows
+        rss = current_rss_mb()
+        parser.metrics.set_gauge("rss_mb", rss)
+        over_rows = self.max_rows is not None and self.rows_since_recycle >= self.max_rows
+        over_rss = self.max_rss_mb is not None and rss >= self.max_rss_mb
+        self.due = "row" if over_rows else "memory" if over_rss else None
+        return self.due is not None
+
+
+    def recycle(self, parser):
+        """
+        Replaces the World of parser with a fresh copy of the snapshot.
+        """
+        start = time.perf_counter()
+        before = current_rss_mb()
+        parser.recycle_world(self.snapshot_path)
+        gc.collect()
+        after = current_rss_mb()
+        parser.metrics.set_gauge("rss_mb", after)
+        parser.metrics.increment("world_recycles_total")
+        parser.metrics.observe("world_recycle_seconds", time.perf_counter() - start)
+        parser.logger.info(f"World recycled ({self.due} budget): RSS {before:.0f} MB -> {after:.0f} MB.")
+        if self.max_rss_mb is not None and after >= self.max_rss_mb:
+            parser.logger.warning(f"RSS still at {after:.0f} MB after recycling the World, above the budget of {self.max_rss_mb:.0f} MB.")
+        self.recycles += 1
+        self.rows_since_recycle = 0
+        self.due = None
+
+
+    def close(self):
+        """
+        Removes the temporary snapshot, if one was built.
+        """
+        if self.temporary_snapshot is not None:
+            for path in (self.temporary_snapshot, self.temporary_snapshot + ".json"):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.temporary_snapshot = None
+            self.snapshot_path = None
+            self.built_mode = None
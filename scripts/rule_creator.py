@@ -5,6 +5,79 @@ import uuid
 import json 
 import random
 import pdb
+import pandas as pd
+import time
+from scripts.rule_engine import ForwardChainingEngine
+from scripts.sql_rule_engine import SQLRuleEngine
+from scripts.bulk_loader import BulkTripleLoader
+from scripts.metrics import COUNT_BUCKETS
+
+
+# Age groups of the actor: (group, builtin, value[, builtin, value]).
+AGE_RULES = [
+    ("Young", "lessThanOrEqual", 18),
+    ("Adult", "greaterThanOrEqual", 18, "lessThanOrEqual", 65),
+    ("Old", "greaterThan", 65)
+]
+
+# Karolinska Sleep Scale levels for the DROWSY values: (level, lower bound (exclusive), upper bound (inclusive)).
+KSS_LEVELS = [
+    ("Level_3_KSS", 0, 1),
+    ("Level_5_KSS", 1, 2),
+    ("Level_7_KSS", 2, 3),
+    ("Level_9_KSS", 3, 4),
+]
+
+# Label fields filled from the characteristics of the actor, keyed by the prefix of the individual's name.
+LABEL_FIELDS = {
+    "age": "age",
+    "facecharacteristics": "face",
+    "sex": "sex",
+    "demographic": "demographic",
+    "accessories": "accessories",
+}
+
+# Label fields filled directly from the dataset columns, when the reasoning step is skipped.
+LABEL_COLUMNS = {
+    "Age": "age",
+    "Characteristics": "face",
+    "Sex": "sex",
+    "Demographic": "demographic",
+    "Accessories": "accessories",
+}
+
+# Observations data property passed to every instance by assign_values, keyed by the prefix of the instance's name:
+# (property, whether the value is passed as an integer).
+ASSIGNED_VALUES = {
+    "spo2": ("hasSpO2", True), "hr": ("hasHR", True), "rr": ("hasRR", True), "hrv": ("hasHRV", True),
+    "drowsiness": ("hasDROWSY", True), "age": ("hasAge", True), "sex": ("hasSex", False),
+    "facecharacteristics": ("hasFaceCharacteristics", False), "demographic": ("hasDemographic", False),
+    "accessories": ("hasAccessories", False),
+}
+
+# Fatigue states estimated from the physiological bands: (HR, HRV, RR, SpO2, KSS, fatigue).
+FATIGUE_RULES = [
+    # HR is Low and RR is Low with high KSS
+    ("Low_HR", "Low_HRV", "Low_RR", "Low_SpO2", "Level_7_KSS", "Sleep"),
+    # HR is High and RR is High with high KSS
+    ("High_HR", "Low_HRV", "High_RR", "Low_SpO2", "Level_7_KSS", "Sleep"),
+    # HR is High and RR is Low with high KSS
+    ("High_HR", "Low_HRV", "Low_RR", "Low_SpO2", "Level_7_KSS", "Sleep"),
+    # HR is Low and RR is High with high KSS
+    ("Low_HR", "Low_HRV", "High_RR", "Low_SpO2", "Level_7_KSS", "Sleep"),
+    ("Moderate_HR", "Moderate_HRV", "Moderate_RR", "Normal_SpO2", "Level_3_KSS", "Awake"),
+    ("Moderate_HR", "High_HRV", "Moderate_RR", "Normal_SpO2", "Level_3_KSS", "Drowsiness_Suspected"),
+    ("High_HR", "Low_HRV", "High_RR", "Normal_SpO2", "Level_3_KSS", "Awake"),
+    ("Moderate_HR", "Low_HRV", "High_RR", "Normal_SpO2", "Level_3_KSS", "Awake"),
+]
+
+# Eye state of the actor for every fatigue state: (fatigue, eye state).
+EYE_STATES = [
+    ("Awake", "Blinking"),
+    ("Sleep", "Sleeping"),
+    ("Microsleep", "MicroSleeping"),
+    ("Drowsiness_Suspected", "Slow_Closure"),
+]
 
 
 class RuleCreator: 
@@ -50,6 +123,16 @@ class RuleCreator:
         self.ontology = ontology_parser.ontology 
         self.ontology_path = ontology_parser.ontology_path
         self.logger = ontology_parser.logger
+        self.reasoner = ontology_parser.reasoner
+        self.reasoner_session = ontology_parser.reasoner_session
+        if self.reasoner == "sql": 
+            self.rule_engine = SQLRuleEngine(self.ontology, self.logger)
+        else: 
+            self.rule_engine = ForwardChainingEngine(self.ontology, self.logger)
+        self.entity_index = ontology_parser.entity_index
+        self.metrics = ontology_parser.metrics
+        self.loader = BulkTripleLoader(self.ontology)
+        self.rules_ready = False
         self.age_groups = None 
 
 
@@ -70,14 +153,38 @@ class RuleCreator:
         return destination 
     
     
-    def synchronize_ontology(self): 
+    def synchronize_ontology(self, backend=None): 
         """
         Synchronizes the ontology with the reasoner.
         Uses the PELLET reasoner to infer property values and synchronize the ontology, 
         as only PELLET supports numerical conditions for SWRL rules. 
+        If a Pellet session is available, the already running JVM is used instead 
+        of starting a new one.
+        Args:
+            backend (str): "pellet", "pellet_session", "native" (the in-process rule engine) 
+                or "sql" (the rules evaluated as SQL over the quadstore). 
+                Defaults to the reasoner selected in the OntologyParser.
         """
-        with self.ontology: 
-            sync_reasoner_pellet(infer_property_values=True)
+        backend = backend or self.reasoner
+        changes = self.ontology.world.graph.db.total_changes
+        with self.metrics.timer("reasoner_seconds"): 
+            if backend in ("native", "sql"): 
+                self.rule_engine.run()
+            elif backend == "pellet_session" and self.reasoner_session is not None: 
+                self.reasoner_session.synchronize(self.ontology)
+            else: 
+                with self.ontology: 
+                    sync_reasoner_pellet(self.ontology.world, infer_property_values=True)
+
+        # Triples written by the reasoner (added, updated or removed).
+        inferred = self.ontology.world.graph.db.total_changes - changes
+        self.metrics.increment("reasoner_invocations_total")
+        self.metrics.increment("triples_inferred_total", inferred)
+        self.metrics.observe("triples_inferred_per_run", inferred, COUNT_BUCKETS)
+
+        # Pellet may have reclassified the ontology.
+        if backend not in ("native", "sql"): 
+            self.entity_index.refresh()
 
 
     def create_instances(self, ind_class): 
@@ -124,7 +231,8 @@ class RuleCreator:
             return None 
         
         # Get the subclasses for the desired class. 
-        phs_class = next(cls for cls in self.ontology.classes() if cls.name.strip() == cls_name)
+        phs_class = self.entity_index.get_class(cls_name)
+        subclass_names = set(cls.name for cls in self.entity_index.subclasses(phs_class))
 
         # Check the property and connect the observation to the class.
         for prop in obs.get_properties():
@@ -136,10 +244,8 @@ class RuleCreator:
 
             name_prop = "Drowsiness" if name_prop == "DROWSY" else name_prop
 
-            # Flag is raised when Physiological State class iterates through subclasses not in the dataset.
-            flag = [True for cls in phs_class.subclasses() if cls.name == name_prop]
-    
-            if not flag:
+            # Skip the properties whose class is not a subclass of the desired class.
+            if name_prop not in subclass_names:
                 continue
 
             # Connect Observation to each subclass 
@@ -179,49 +285,43 @@ class RuleCreator:
             property_name (str): The name of the data property to pass the values. 
         """
 
-        with self.ontology: 
-            # Check if the observation has the object property.
-            if not hasattr(obs, cls_property):
-                return None 
-            
-            ind_property = getattr(obs, cls_property)
-            
-            if len(ind_property)==0:
-                return None 
+        # Check if the observation has the object property.
+        if not hasattr(obs, cls_property):
+            return None 
+        
+        ind_property = getattr(obs, cls_property)
+        
+        if len(ind_property)==0:
+            return None 
+        
+        # Iterate through the instances of the object property, taking the values of the observation in order.
+        remaining = {}
+        values = []
+        for instance in ind_property:
             
-            # Iterate through the instances of the object property.
-            for instance in ind_property:
-                
-                if not hasattr(instance,property_name): 
+            if not hasattr(instance,property_name): 
+                continue
+
+            name_of_ind = instance.name.split('_')[0]
+            if name_of_ind not in ASSIGNED_VALUES: 
+                continue
+            obs_property, integer = ASSIGNED_VALUES[name_of_ind]
+
+            # Because Age is a subclass of actor with numerical value, explicitly use a distinct property name. 
+            target_property = property_name
+            if name_of_ind == 'age': 
+                if not hasattr(instance, 'hasAgeValue'):
                     continue
+                target_property = 'hasAgeValue'
 
-                name_of_ind = instance.name.split('_')[0]
-                instance_property = getattr(instance, property_name)
-
-                # Pass the value of the observation to the instance.
-                if name_of_ind == 'spo2': 
-                    instance_property.append(int(obs.hasSpO2.pop(0)))
-                elif name_of_ind == 'hr':
-                    instance_property.append(int(obs.hasHR.pop(0)))
-                elif name_of_ind == 'rr':
-                    instance_property.append(int(obs.hasRR.pop(0)))
-                elif name_of_ind == 'hrv':
-                    instance_property.append(int(obs.hasHRV.pop(0)))
-                elif name_of_ind == 'sex':
-                    instance_property.append(obs.hasSex.pop(0))
-                elif name_of_ind == 'age':
-                    # Because Age is a subclass of actor with numerical value, explicitly use a distinct property name. 
-                    if hasattr(instance, 'hasAgeValue'):
-                        instance_property = getattr(instance, 'hasAgeValue')
-                        instance_property.append(int(obs.hasAge.pop(0)))
-                elif name_of_ind == 'facecharacteristics':
-                    instance_property.append(obs.hasFaceCharacteristics.pop(0))
-                elif name_of_ind == 'demographic':
-                    instance_property.append(obs.hasDemographic.pop(0))
-                elif name_of_ind == 'accessories':
-                    instance_property.append(obs.hasAccessories.pop(0))
-                elif name_of_ind == 'drowsiness':
-                    instance_property.append(int(obs.hasDROWSY.pop(0)))
+            if obs_property not in remaining: 
+                remaining[obs_property] = list(getattr(obs, obs_property))
+            value = remaining[obs_property].pop(0)
+            values.append((obs_property, value, instance.storid, target_property, int(value) if integer else value))
+
+        # Pass the values of the observation to the instances, all at once.
+        self.loader.remove_data([(obs.storid, obs_property, value) for obs_property, value, _, _, _ in values])
+        self.loader.add_data([(storid, target_property, value) for _, _, storid, target_property, value in values])
 
 
     def determine_age(self): 
@@ -236,13 +336,7 @@ class RuleCreator:
         with self.ontology: 
 
             if self.ontology.Age is not None: 
-                age_rules = [
-                    ("Young", "lessThanOrEqual", 18),
-                    ("Adult", "greaterThanOrEqual", 18, "lessThanOrEqual", 65),
-                    ("Old", "greaterThan", 65)
-                ]
-                
-                for rule in age_rules:
+                for rule in AGE_RULES:
                     self.create_instances(rule[0])
                     age_rule = Imp()
                     age_rule.set_as_rule(
@@ -255,8 +349,8 @@ class RuleCreator:
                         """
                     )
             # Keep the age groups in a list to get the corresponding threshold instance later. 
-            self.age_groups = [age.name.lower() for age in self.ontology.Age.subclasses()]        
-            self.age_group_names = [age.name for age in self.ontology.Age.subclasses() ]
+            self.age_groups = [age.name.lower() for age in self.entity_index.subclasses(self.ontology.Age)]        
+            self.age_group_names = [age.name for age in self.entity_index.subclasses(self.ontology.Age)]
 
 
     def determine_HR(self):
@@ -637,53 +731,18 @@ class RuleCreator:
         """
 
         with self.ontology:
-            drowsiness_state_with_value_1 = Imp() 
-            self.create_instances("Level_3_KSS")
-            drowsiness_state_with_value_1.set_as_rule(
-                """
-                Drowsiness(?ds),
-                hasNumericalValue(?ds, ?ds_value),
-                lessThanOrEqual(?ds_value, 1), 
-                greaterThan(?ds_value, 0),
-                Level_3_KSS(?level_3_kss)  ->  DrowsinessIs(?ds, ?level_3_kss)
-                """
-            )
-
-            drowsiness_state_with_value_2 = Imp() 
-            self.create_instances("Level_5_KSS")
-            drowsiness_state_with_value_2.set_as_rule(
-                """
-                Drowsiness(?ds),
-                hasNumericalValue(?ds, ?ds_value),
-                lessThanOrEqual(?ds_value, 2),
-                greaterThan(?ds_value, 1),
-                Level_5_KSS(?level_5_kss) -> DrowsinessIs(?ds, ?level_5_kss)
-                """ 
-            )
-
-            drowsiness_state_with_value_3 = Imp() 
-            self.create_instances("Level_7_KSS")
-            drowsiness_state_with_value_3.set_as_rule(
-                """
-                Drowsiness(?ds),
-                hasNumericalValue(?ds, ?ds_value),
-                lessThanOrEqual(?ds_value, 3),
-                greaterThan(?ds_value, 2),
-                Level_7_KSS(?level_7_kss) -> DrowsinessIs(?ds, ?level_7_kss)
-                """
-            )
-
-            drowsiness_state_with_value_4 = Imp() 
-            self.create_instances("Level_9_KSS")
-            drowsiness_state_with_value_4.set_as_rule(
-                """
-                Drowsiness(?ds),
-                hasNumericalValue(?ds, ?ds_value),
-                lessThanOrEqual(?ds_value, 4),
-                greaterThan(?ds_value, 3),
-                Level_9_KSS(?level_9_kss) -> DrowsinessIs(?ds, ?level_9_kss)
-                """
-            )
+            for level, lower, upper in KSS_LEVELS: 
+                drowsiness_state = Imp() 
+                self.create_instances(level)
+                drowsiness_state.set_as_rule(
+                    f"""
+                    Drowsiness(?ds),
+                    hasNumericalValue(?ds, ?ds_value),
+                    lessThanOrEqual(?ds_value, {upper}), 
+                    greaterThan(?ds_value, {lower}),
+                    {level}(?{level.lower()}) ->  DrowsinessIs(?ds, ?{level.lower()})
+                    """
+                )
 
 
     def connect_actor_to_values(self): 
@@ -748,193 +807,27 @@ class RuleCreator:
         with self.ontology:
             self.ontology.Fatigue("fatigue_instance")
 
-            # First Option where HR is Low and RR is High with corresponding KSS
-            fatigue_sleep_state_1 = Imp()
-            self.create_instances("Sleep")
-            fatigue_sleep_state_1.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?low_hr), Low_HR(?low_hr),
-                HRVis(?hrv, ?low_hrv), Low_HRV(?low_hrv),
-                RRis(?rr, ?low_rr), Low_RR(?low_rr),
-                SpO2is(?spo2, ?low_spo2), Low_SpO2(?low_spo2),
-                DrowsinessIs(?ds, ?low_ds), Level_7_KSS(?low_ds),
-                Fatigue(fatigue_instance),
-                Sleep(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance),
-                    FatigueIs(fatigue_instance, ?fatigue),
-                """)
-            
-            
-            
-            # Third Option for sleeping where HR is High and RR is High with High KSS
-            fatigue_sleep_state_2 = Imp()
-            fatigue_sleep_state_2.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?low_hr), High_HR(?low_hr),
-                HRVis(?hrv, ?low_hrv), Low_HRV(?low_hrv),
-                RRis(?rr, ?low_rr), High_RR(?low_rr),
-                SpO2is(?spo2, ?low_spo2), Low_SpO2(?low_spo2),
-                DrowsinessIs(?ds, ?low_ds), Level_7_KSS(?low_ds),
-                Fatigue(fatigue_instance),
-                Sleep(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance),FatigueIs(fatigue_instance, ?fatigue),
-                """)
-            
-
-            # Third Option wher HR is High and RR is Low
-            fatigue_sleep_state_3 = Imp()
-            fatigue_sleep_state_3.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?low_hr), High_HR(?low_hr),
-                HRVis(?hrv, ?low_hrv), Low_HRV(?low_hrv),
-                RRis(?rr, ?low_rr), Low_RR(?low_rr),
-                SpO2is(?spo2, ?low_spo2), Low_SpO2(?low_spo2),
-                DrowsinessIs(?ds, ?low_ds), Level_7_KSS(?low_ds),
-                Fatigue(fatigue_instance),
-                Sleep(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance), FatigueIs(fatigue_instance, ?fatigue),
-                """)
-            
-            # Fourth Option where HR is Low and RR is Low
-            fatigue_sleep_state_4 = Imp()
-            fatigue_sleep_state_4.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?low_hr), Low_HR(?low_hr),
-                HRVis(?hrv, ?low_hrv), Low_HRV(?low_hrv),
-                RRis(?rr, ?low_rr), High_RR(?low_rr),
-                SpO2is(?spo2, ?low_spo2), Low_SpO2(?low_spo2),
-                DrowsinessIs(?ds, ?low_ds), Level_7_KSS(?low_ds),
-                Fatigue(fatigue_instance),
-                Sleep(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance),FatigueIs(fatigue_instance, ?fatigue)
-                """)
-            
-            fatigue_awake_state_1 = Imp()
-            self.create_instances("Awake")
-            fatigue_awake_state_1.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?hr_val), Moderate_HR(?hr_val),
-                HRVis(?hrv, ?hrv_val), Moderate_HRV(?hrv_val),
-                RRis(?rr, ?rr_val), Moderate_RR(?rr_val),
-                SpO2is(?spo2, ?spo2_val), Normal_SpO2(?spo2_val),
-                DrowsinessIs(?ds, ?ds_val), Level_3_KSS(?ds_val),
-                Fatigue(fatigue_instance),
-                Awake(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance),
-                    FatigueIs(fatigue_instance, ?fatigue),
-                """)
-            
-            fatigue_awake_state_1 = Imp() 
-            fatigue_awake_state_1.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?hr_val), Moderate_HR(?hr_val),
-                HRVis(?hrv, ?hrv_val), Moderate_HRV(?hrv_val),
-                RRis(?rr, ?rr_val), Moderate_RR(?rr_val),
-                SpO2is(?spo2, ?spo2_val), Normal_SpO2(?spo2_val),
-                DrowsinessIs(?ds, ?ds_val), Level_3_KSS(?ds_val),
-                Fatigue(fatigue_instance),
-                Awake(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance),
-                    FatigueIs(fatigue_instance, ?fatigue),
-                """)
-
-            # Second Option for sleeping where HR is High and RR is High with Low KSS              
-            fatigue_awake_state_2 = Imp()
-            self.create_instances("Drowsiness_Suspected")
-            fatigue_awake_state_2.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?low_hr), Moderate_HR(?low_hr),
-                HRVis(?hrv, ?low_hrv), High_HRV(?low_hrv),
-                RRis(?rr, ?low_rr), Moderate_RR(?low_rr),
-                SpO2is(?spo2, ?low_spo2), Normal_SpO2(?low_spo2),
-                DrowsinessIs(?ds, ?low_ds), Level_3_KSS(?low_ds),
-                Fatigue(fatigue_instance),
-                Drowsiness_Suspected(?fatigue) 
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance),
-                    FatigueIs(fatigue_instance, ?fatigue), 
-                """)
-            
-            fatigue_awake_state_3 = Imp()
-            fatigue_awake_state_3.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?low_hr), High_HR(?low_hr),
-                HRVis(?hrv, ?low_hrv), Low_HRV(?low_hrv),
-                RRis(?rr, ?low_rr), High_RR(?low_rr),
-                SpO2is(?spo2, ?low_spo2), Normal_SpO2(?low_spo2),
-                DrowsinessIs(?ds, ?low_ds), Level_3_KSS(?low_ds),
-                Fatigue(fatigue_instance),
-                Awake(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance), 
-                FatigueIs(fatigue_instance, ?fatigue),
-                """)    
-
-            fatigue_awake_state_3 = Imp()
-            fatigue_awake_state_3.set_as_rule(
-                """
-                Actor(?actor), 
-                ActorHasPhysiologicalState(?actor, ?hr),
-                ActorHasPhysiologicalState(?actor, ?hrv),
-                ActorHasPhysiologicalState(?actor, ?rr),
-                ActorHasPhysiologicalState(?actor, ?spo2),
-                ActorHasPhysiologicalState(?actor, ?ds),
-                HRis(?hr, ?low_hr), Moderate_HR(?low_hr),
-                HRVis(?hrv, ?low_hrv), Low_HRV(?low_hrv),
-                RRis(?rr, ?low_rr), High_RR(?low_rr),
-                SpO2is(?spo2, ?low_spo2), Normal_SpO2(?low_spo2),
-                DrowsinessIs(?ds, ?low_ds), Level_3_KSS(?low_ds),
-                Fatigue(fatigue_instance),
-                Awake(?fatigue)
-                ->  ActorHasPhysiologicalState(?actor, fatigue_instance),
-                    FatigueIs(fatigue_instance, ?fatigue),
-                """)       
+            for hr, hrv, rr, spo2, kss, fatigue in FATIGUE_RULES: 
+                fatigue_state = Imp()
+                self.create_instances(fatigue)
+                fatigue_state.set_as_rule(
+                    f"""
+                    Actor(?actor), 
+                    ActorHasPhysiologicalState(?actor, ?hr),
+                    ActorHasPhysiologicalState(?actor, ?hrv),
+                    ActorHasPhysiologicalState(?actor, ?rr),
+                    ActorHasPhysiologicalState(?actor, ?spo2),
+                    ActorHasPhysiologicalState(?actor, ?ds),
+                    HRis(?hr, ?hr_val), {hr}(?hr_val),
+                    HRVis(?hrv, ?hrv_val), {hrv}(?hrv_val),
+                    RRis(?rr, ?rr_val), {rr}(?rr_val),
+                    SpO2is(?spo2, ?spo2_val), {spo2}(?spo2_val),
+                    DrowsinessIs(?ds, ?ds_val), {kss}(?ds_val),
+                    Fatigue(fatigue_instance),
+                    {fatigue}(?fatigue)
+                    ->  ActorHasPhysiologicalState(?actor, fatigue_instance),
+                        FatigueIs(fatigue_instance, ?fatigue)
+                    """)
             
 
     def determine_eye_state(self): 
@@ -951,65 +844,29 @@ class RuleCreator:
         """
 
         with self.ontology: 
-            rule = Imp() 
-            self.create_instances("Blinking")
-            rule.set_as_rule(
-                """
-                Actor(?actor),
-                ActorHasPhysiologicalState(?actor, fatigue_instance),
-                FatigueIs(fatigue_instance, ?fatigue),
-                Awake(?fatigue),
-                Blinking(?eye_state)-> EyeStateForActor(?eye_state, ?actor)
-                """
-            )
-
-            rule = Imp()
-            self.create_instances("Sleeping")
-            rule.set_as_rule(
-                """
-                Actor(?actor),
-                ActorHasPhysiologicalState(?actor, fatigue_instance),
-                FatigueIs(fatigue_instance, ?fatigue),
-                Sleep(?fatigue), 
-                Sleeping(?eye_state)-> EyeStateForActor(?eye_state, ?actor)
-                """
-            )
-        
-            rule = Imp()
-            self.create_instances("MicroSleeping")
-            rule.set_as_rule(
-                """
-                Actor(?actor),
-                ActorHasPhysiologicalState(?actor, fatigue_instance),
-                FatigueIs(fatigue_instance, ?fatigue),
-                Microsleep(?fatigue), 
-                MicroSleeping(?eye_state)-> EyeStateForActor(?eye_state, ?actor)
-                """
-            )
-        
-            rule = Imp()
-            self.create_instances("Slow_Closure")
-            rule.set_as_rule(
-                """
-                Actor(?actor),
-                ActorHasPhysiologicalState(?actor, fatigue_instance),
-                FatigueIs(fatigue_instance, ?fatigue),
-                Drowsiness_Suspected(?fatigue), 
-                Slow_Closure(?eye_state)-> EyeStateForActor(?eye_state, ?actor)
-                """
-            )
+            for fatigue, eye_state in EYE_STATES: 
+                rule = Imp() 
+                self.create_instances(eye_state)
+                rule.set_as_rule(
+                    f"""
+                    Actor(?actor),
+                    ActorHasPhysiologicalState(?actor, fatigue_instance),
+                    FatigueIs(fatigue_instance, ?fatigue),
+                    {fatigue}(?fatigue), 
+                    {eye_state}(?eye_state)-> EyeStateForActor(?eye_state, ?actor)
+                    """
+                )
 
 
-    def set_up_rules(self, index): 
+    def set_up_rules(self): 
         """
         This function is used tp set up the rules for the ontology.
-        The rules are created only on the first iteration of the loop.
-        Args: 
-            index: The index of the iteration.
+        The rules are created only once, on the first iteration of the loop.
         """
 
         try: 
-            if index == 0: 
+            if not self.rules_ready: 
+                self.rules_ready = True
                 self.connect_actor_to_values()
                 self.determine_age()
                 self.determine_HR()
@@ -1024,77 +881,164 @@ class RuleCreator:
                 
 
 
-    def create_label(self, filepath,  index): 
+    def actor_characteristics(self, driver): 
+        """
+        This function collects the characteristics connected to the actor (age, face characteristics, 
+        sex, demographic and accessories), keyed by the name of the corresponding label field.
+        Args:
+            driver (Actor): The actor described by the label.
+        """
+        data = {}
+        for val in driver.ActorHasCharacteristics:
+            name_of_ind = val.name.rsplit('_', 1)[0]
+            if name_of_ind not in LABEL_FIELDS: 
+                continue
+            values = val.hasAgeValue if name_of_ind == "age" else val.hasStringValue
+            if values: 
+                data[LABEL_FIELDS[name_of_ind]] = values[0]
+        return data
+
+
+    def record_characteristics(self, record): 
+        """
+        This function collects the characteristics of the actor from a dataset record, keyed like
+        actor_characteristics, -1 marking a missing value as in the Observations individual.
+        Args:
+            record (dict): A row of the dataset.
+        """
+        data = {}
+        for column, field in LABEL_COLUMNS.items(): 
+            value = record.get(column)
+            data[field] = -1 if value is None or pd.isna(value) else value
+        return data
+
+
+    def actor_fatigue(self, driver): 
+        """
+        This function returns the fatigue inferred for the actor, or "Undefined" if none was inferred.
+        Args:
+            driver (Actor): The actor described by the label.
+        """
+        for state in driver.ActorHasPhysiologicalState: 
+            if hasattr(state, "FatigueIs") and state.FatigueIs: 
+                return state.FatigueIs[0].is_a[0].name
+        return "Undefined"
+
+
+    def actor_eye_state(self, driver): 
+        """
+        This function returns the eye state inferred for the actor, or "Undefined" if none was inferred.
+        Args:
+            driver (Actor): The actor described by the label.
+        """
+        try: 
+            return driver.ActorHasEyeState[0].name.split("_")[0]
+        except: 
+            return "Undefined"
+
+
+    def build_label(self, actor_id, eye_state, characteristics): 
+        """
+        This function builds the label payload describing the actor.
+        Args:
+            actor_id (str): The unique identifier of the actor.
+            eye_state (str): The eye state of the actor.
+            characteristics (dict): The label fields returned by actor_characteristics, -1 for the missing ones.
+        """
+        return {
+            "prompt_details": {
+                "seed":random.randint(1,1000000), 
+                "steps": random.randint(1,100), 
+                "prompt":"Lorem ipsum...", 
+                "response":"Lorem ipsum...",
+                "view_point":"front", 
+                "object_name": "person", 
+                "time_of_day":"morning", 
+                "sky_condition":"clear", 
+                "weather_condition":"sunny",
+            },
+
+            "label":{
+                "actor_id": actor_id,
+                "eye_state": eye_state,
+                "age":characteristics.get("age", -1), 
+                "face":characteristics.get("face", -1), 
+                "sex":characteristics.get("sex", -1), 
+                "demographic": characteristics.get("demographic", -1), 
+                "accessories": characteristics.get("accessories", -1), 
+                "bounding_box":"...", 
+                "bounding_polygon":"...", 
+            }
+        } 
+
+
+    def create_label(self, sink,  index): 
         """
         This function creates a label, describing the actor based on the results 
         of the SWRL rules in the ontology. Requires reasoner to previously have 
         been synchronized, otherwise the last changes will not be reflected in the label.
         
         Args:
-            filepath (str): The filepath to the ontology file.
-            index (int): The index of the ontology file.
+            sink: The label sink writing the label (see scripts/label_sink.py), None to only return it.
+            index (int): The index of the row.
+        Returns:
+            dict: The label payload, None if the label could not be created.
         """
 
+        start = time.perf_counter()
         try: 
             driver = self.ontology.Actor.instances()[0]
-            driver_chars = driver.ActorHasCharacteristics
-            data = {}
-            for val in driver_chars:
-            
-                if val.name == "age_instance":
-                    data[val.name] = val.hasAgeValue[0]
-                    continue
-                data[val.name] = val.hasStringValue[0]
+            characteristics = self.actor_characteristics(driver)
             
             driver.hasUniqueIdentifier.append(str(uuid.uuid4()))
             self.logger.info("Preparing data for label")
-            try: 
-                eye_state =  driver.ActorHasEyeState[0].name.split("_")[0]
-            except: 
-                eye_state = "Undefined"
-            actor_data = {
-                "prompt_details": {
-                    "seed":random.randint(1,1000000), 
-                    "steps": random.randint(1,100), 
-                    "prompt":"Lorem ipsum...", 
-                    "response":"Lorem ipsum...",
-                    "view_point":"front", 
-                    "object_name": "person", 
-                    "time_of_day":"morning", 
-                    "sky_condition":"clear", 
-                    "weather_condition":"sunny",
-                },
-
-                "label":{
-                    "actor_id": driver.hasUniqueIdentifier[0],
-                    "eye_state": eye_state,
-                    "age":data["age_instance"], 
-                    "face":data["facecharacteristics_instance"], 
-                    "sex":data["sex_instance"], 
-                    "demographic": data["demographic_instance"], 
-                    "accessories": data["accessories_instance"], 
-                    "bounding_box":"...", 
-                    "bounding_polygon":"...", 
-                }
-            } 
-
-            json_file = filepath + f"/label_{index}.json"
+            actor_data = self.build_label(driver.hasUniqueIdentifier[0], self.actor_eye_state(driver), characteristics)
+
             with self.ontology: 
                 label = self.ontology.Label.instances()[0]
-                with open(json_file, "w") as f:
-                    json.dump(actor_data, f, indent=4)
+                if sink is not None: 
+                    sink.write(index, actor_data)
                 label.hasDescription.append(json.dumps(actor_data))
                 # label.hasUniqueIdentifier.append(str(uuid.uuid4()))
                 label.LabelTargetsActor = [driver]
                 self.logger.info(f"Label created successfully: {label.hasDescription[0]}")
-            self.logger.info("Label created successfully with name: label.json")
+            self.logger.info(f"Label {index} created successfully.")
+            self.metrics.observe("label_write_seconds", time.perf_counter() - start)
+            return actor_data
         
         except Exception as e:
-            print(e)
-            print("Error creating label")
+            self.metrics.increment("label_errors_total")
+            self.logger.error(f"Error creating label {index}: {e}")
             return
 
 
+    def reasoning_result(self): 
+        """
+        This function returns the fatigue and eye state inferred for the actor, to be kept in the InferenceCache.
+        Requires reasoner to previously have been synchronized.
+        """
+        driver = self.ontology.Actor.instances()[0]
+        return {"fatigue": self.actor_fatigue(driver), "eye_state": self.actor_eye_state(driver)}
+
+
+    def create_cached_label(self, sink, index, record, result): 
+        """
+        This function creates the label of a row whose reasoning result is already known (see InferenceCache), 
+        from the values of the row instead of the ontology, and writes it to the label sink.
+
+        Args:
+            sink: The label sink writing the label, None to only return it.
+            index (int): The index of the row.
+            record (dict): The row of the dataset.
+            result (dict): The cached reasoning result (see reasoning_result).
+        """
+        with self.metrics.timer("label_write_seconds"): 
+            actor_data = self.build_label(str(uuid.uuid4()), result["eye_state"], self.record_characteristics(record))
+            if sink is not None: 
+                sink.write(index, actor_data)
+        return actor_data
+
+
     def remove_prev_values(self, obs): 
         """
         This function deletes all previously established relationships between 
@@ -1105,6 +1049,9 @@ class RuleCreator:
         and to minimize the number of instances that have to be created in this 
         iterative way of operation. Otherwise the length of the dataset will 
         determine the number of instances that will be created for each class. 
+
+        NOTE: OntologyParser.parse_rows only uses it for the row creating the rules, 
+        the other rows are undone with a WorldSavepoint. 
         """
         with self.ontology: 
             obs.hasAge = [] 
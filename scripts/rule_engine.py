@@ -0,0 +1,375 @@
+from owlready2 import *
+from scripts.owlready_compat import datatype_abbrev, apply_inferred_types, apply_inferred_obj_relations, apply_inferred_data_relations
+from collections import defaultdict
+import operator
+
+
+# Built-ins comparing already bound values.
+COMPARISON_BUILTINS = {
+    "equal": operator.eq,
+    "notEqual": operator.ne,
+    "lessThan": operator.lt,
+    "lessThanOrEqual": operator.le,
+    "greaterThan": operator.gt,
+    "greaterThanOrEqual": operator.ge,
+}
+
+# Built-ins binding their first argument to the result of the operation on the others.
+ARITHMETIC_BUILTINS = {
+    "add": lambda *values: sum(values),
+    "subtract": operator.sub,
+    "multiply": operator.mul,
+    "divide": operator.truediv,
+    "abs": abs,
+}
+
+
+class Var:
+    """
+    Plain Python stand-in for a SWRL variable, cheap to hash and to test against.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"?{self.name}"
+
+
+
+class CompiledRule:
+    """
+    A SWRL rule translated into (kind, predicate, arguments) atoms over the fact memories 
+    of the engine. The join order is not fixed here: the engine picks the most constrained 
+    atom at every step of the match, using the sizes of the memories.
+    """
+
+    def __init__(self, imp):
+        """
+        Args:
+            imp (Imp): The owlready2 rule to compile.
+        """
+        self.imp = imp
+        self.variables = {}
+        self.head = [self.compile_atom(atom) for atom in imp.head]
+        self.body = [self.compile_atom(atom) for atom in imp.body]
+        self.predicates = set(atom[1] for atom in self.body if atom[0] != "builtin")
+        self.check_builtins()
+
+
+    def compile_atom(self, atom):
+        """
+        Translates an owlready2 SWRL atom into a (kind, predicate, arguments) tuple.
+        Args:
+            atom: ClassAtom, IndividualPropertyAtom, DatavaluedPropertyAtom or BuiltinAtom.
+        """
+        arguments = tuple(self.compile_argument(arg) for arg in atom.arguments)
+        if isinstance(atom, ClassAtom):
+            return ("class", atom.class_predicate, arguments)
+        if isinstance(atom, (IndividualPropertyAtom, DatavaluedPropertyAtom)):
+            return ("property", atom.property_predicate, arguments)
+        if isinstance(atom, BuiltinAtom):
+            name = atom.builtin if isinstance(atom.builtin, str) else atom.builtin.name
+            name = name[name.rfind("#") + 1:]
+            if name not in COMPARISON_BUILTINS and name not in ARITHMETIC_BUILTINS:
+                raise ValueError(f"Built-in '{name}' is not supported by the native engine.")
+            return ("builtin", name, arguments)
+        raise ValueError(f"Atom '{atom}' is not supported by the native engine.")
+
+
+    def compile_argument(self, argument):
+        """
+        Replaces the SWRL variables with Var objects shared by every atom of the rule.
+        """
+        if isinstance(argument, Variable):
+            if argument.name not in self.variables:
+                self.variables[argument.name] = Var(argument.name)
+            return self.variables[argument.name]
+        return argument
+
+
+    def check_builtins(self):
+        """
+        Checks that every built-in input is bound by a class or property atom (or an arithmetic built-in).
+        """
+        bound = set(arg for kind, _, arguments in self.body if kind != "builtin" for arg in arguments if isinstance(arg, Var))
+        bound.update(arguments[0] for kind, name, arguments in self.body if kind == "builtin" and name in ARITHMETIC_BUILTINS)
+        for kind, name, arguments in self.body:
+            if kind == "builtin" and not all(arg in bound for arg in arguments if isinstance(arg, Var)):
+                raise ValueError(f"Rule '{self.imp}' has built-ins with unbound variables.")
+
+
+
+class ForwardChainingEngine:
+    """
+    In-process, agenda-driven naive forward chaining engine for the SWRL rules of the ontology.
+
+    The engine keeps one memory of facts per class and property used by the rules,
+    loaded from the world, and fires the rules on an agenda: a rule is only evaluated
+    again when one of the memories it reads from received new facts, and it is then
+    joined over its whole body (there are no partial matches kept between two rounds,
+    nor a propagation of the new facts only). When no rule produces new facts, the inferred
+    class memberships and property values are written into the ontology, the same way
+    the Pellet reasoner results are applied by owlready2.
+
+    NOTE: Only the Horn clause subset used by the RuleCreator is supported (class and property
+    atoms, comparison and simple arithmetic built-ins). OWL axioms other than the class
+    hierarchy and inverse properties are not taken into account.
+    """
+
+    def __init__(self, ontology, logger):
+        """
+        Args:
+            ontology (Ontology): The ontology holding the rules and receiving the inferred facts.
+            logger (Logger): The logger of the OntologyParser.
+        """
+        self.ontology = ontology
+        self.logger = logger
+        self.rules = []
+        self.rule_ids = None
+
+
+    def compile_rules(self):
+        """
+        Compiles the rules of the ontology. Rules are only compiled again when the rule set changed.
+        """
+        rules = list(self.ontology.world.rules())
+        rule_ids = frozenset(rule.storid for rule in rules)
+        if rule_ids != self.rule_ids:
+            self.rules = [CompiledRule(rule) for rule in rules]
+            self.rule_ids = rule_ids
+            self.logger.info(f"Native engine compiled {len(self.rules)} rules.")
+        return self.rules
+
+
+    def reset(self):
+        """
+        Forgets the compiled rules, so that they are compiled again at the next run. To be called when the
+        rules were removed from the world and created again (e.g. by a rollback), since they get the same storids.
+        """
+        self.rules = []
+        self.rule_ids = None
+
+
+    def load_memories(self, rules):
+        """
+        Loads the fact memories of every class and property used in the rules.
+        Property memories are indexed by subject and by object.
+        Args:
+            rules (list): The compiled rules.
+        """
+        self.classes = defaultdict(set)
+        self.by_subject = defaultdict(lambda: defaultdict(set))
+        self.by_object = defaultdict(lambda: defaultdict(set))
+        self.sizes = defaultdict(int)
+
+        for rule in rules:
+            for kind, predicate, _ in rule.body + rule.head:
+                if kind == "class" and predicate not in self.classes:
+                    self.classes[predicate] = set(predicate.instances())
+                elif kind == "property" and predicate not in self.by_subject:
+                    self.load_property(predicate)
+
+        # Classes receiving new members must also feed the memories of their tracked ancestors.
+        self.ancestors = {cls: [tracked for tracked in self.classes if tracked in cls.ancestors()] for cls in list(self.classes)}
+
+
+    def load_property(self, prop):
+        """
+        Loads the relations of a property (and of its inverse) into the fact memories.
+        """
+        by_subject = self.by_subject[prop]
+        by_object = self.by_object[prop]
+        for subject, value in prop.get_relations():
+            by_subject[subject].add(value)
+            by_object[value].add(subject)
+        self.sizes[prop] = sum(len(values) for values in by_subject.values())
+
+
+    def has_fact(self, fact):
+        kind, predicate, arguments = fact
+        if kind == "class":
+            return arguments[0] in self.classes[predicate]
+        return arguments[1] in self.by_subject[predicate].get(arguments[0], ())
+
+
+    def add_fact(self, fact):
+        """
+        Adds a fact to the fact memories and returns the predicates that changed.
+        """
+        kind, predicate, arguments = fact
+        if kind == "class":
+            changed = set()
+            for cls in self.ancestors.get(predicate, [predicate]):
+                if arguments[0] not in self.classes[cls]:
+                    self.classes[cls].add(arguments[0])
+                    changed.add(cls)
+            return changed
+
+        subject, value = arguments
+        self.by_subject[predicate][subject].add(value)
+        self.by_object[predicate][value].add(subject)
+        self.sizes[predicate] += 1
+        changed = {predicate}
+        inverse = getattr(predicate, "inverse_property", None)
+        if inverse is not None and inverse in self.by_subject:
+            self.by_subject[inverse][value].add(subject)
+            self.by_object[inverse][subject].add(value)
+            self.sizes[inverse] += 1
+            changed.add(inverse)
+        return changed
+
+
+    def cost(self, atom, binding):
+        """
+        Estimates the number of candidates an atom yields under the current binding.
+        Atoms with every argument bound are filters and cost nothing.
+        """
+        kind, predicate, arguments = atom
+        values = [binding.get(arg, arg) if isinstance(arg, Var) else arg for arg in arguments]
+        unbound = [isinstance(value, Var) for value in values]
+        if not any(unbound):
+            return 0
+        if kind == "class":
+            return len(self.classes[predicate])
+        if not unbound[0]:
+            return len(self.by_subject[predicate].get(values[0], ()))
+        if not unbound[1]:
+            return len(self.by_object[predicate].get(values[1], ()))
+        return self.sizes[predicate]
+
+
+    def builtin_ready(self, atom, binding):
+        """
+        Checks if the inputs of a built-in are bound.
+        """
+        inputs = atom[2][1:] if atom[1] in ARITHMETIC_BUILTINS else atom[2]
+        return all(not isinstance(arg, Var) or arg in binding for arg in inputs)
+
+
+    def match(self, atoms, binding):
+        """
+        Joins the body atoms, yielding every complete variable binding. Ready built-ins are 
+        evaluated first, then the atom with the fewest candidates is matched.
+        Args:
+            atoms (list): The remaining body atoms.
+            binding (dict): The variables bound so far.
+        """
+        if not atoms:
+            yield binding
+            return
+
+        ready = [atom for atom in atoms if atom[0] == "builtin" and self.builtin_ready(atom, binding)]
+        if ready:
+            atom = ready[0]
+        else:
+            atom = min((atom for atom in atoms if atom[0] != "builtin"), key=lambda atom: self.cost(atom, binding))
+        rest = [other for other in atoms if other is not atom]
+
+        kind, predicate, arguments = atom
+        values = [binding.get(arg, arg) if isinstance(arg, Var) else arg for arg in arguments]
+        unbound = [isinstance(value, Var) for value in values]
+
+        if kind == "class":
+            if not unbound[0]:
+                if values[0] in self.classes[predicate]:
+                    yield from self.match(rest, binding)
+                return
+            for individual in list(self.classes[predicate]):
+                yield from self.match(rest, {**binding, values[0]: individual})
+
+        elif kind == "property":
+            subject, value = values
+            if not unbound[0] and not unbound[1]:
+                if value in self.by_subject[predicate].get(subject, ()):
+                    yield from self.match(rest, binding)
+            elif not unbound[0]:
+                for candidate in list(self.by_subject[predicate].get(subject, ())):
+                    yield from self.match(rest, {**binding, value: candidate})
+            elif not unbound[1]:
+                for candidate in list(self.by_object[predicate].get(value, ())):
+                    yield from self.match(rest, {**binding, subject: candidate})
+            else:
+                for candidate_subject, candidate_values in list(self.by_subject[predicate].items()):
+                    for candidate in list(candidate_values):
+                        if subject is value and candidate_subject != candidate:
+                            continue
+                        yield from self.match(rest, {**binding, subject: candidate_subject, value: candidate})
+
+        else:
+            try:
+                if predicate in COMPARISON_BUILTINS:
+                    if COMPARISON_BUILTINS[predicate](values[0], values[1]):
+                        yield from self.match(rest, binding)
+                    return
+                result = ARITHMETIC_BUILTINS[predicate](*values[1:])
+            except TypeError:
+                # Comparing a number with a string (or a missing value) never matches.
+                return
+            if unbound[0]:
+                yield from self.match(rest, {**binding, values[0]: result})
+            elif values[0] == result:
+                yield from self.match(rest, binding)
+
+
+    def run(self):
+        """
+        Runs the rules to a fixpoint and writes the inferred facts into the ontology.
+        Returns the number of inferred facts.
+        """
+        rules = self.compile_rules()
+        self.load_memories(rules)
+
+        inferred = []
+        agenda = list(rules)
+        while agenda:
+            changed = set()
+            for rule in agenda:
+                new_facts = []
+                for binding in self.match(rule.body, {}):
+                    for kind, predicate, arguments in rule.head:
+                        fact = (kind, predicate, tuple(binding.get(arg, arg) if isinstance(arg, Var) else arg for arg in arguments))
+                        if not self.has_fact(fact):
+                            new_facts.append(fact)
+                for fact in new_facts:
+                    if not self.has_fact(fact):
+                        changed.update(self.add_fact(fact))
+                        inferred.append(fact)
+            agenda = [rule for rule in rules if rule.predicates & changed]
+
+        self.apply_facts(inferred)
+        return len(inferred)
+
+
+    def apply_facts(self, facts):
+        """
+        Writes the inferred facts into the ontology.
+        Args:
+            facts (list): The inferred (kind, predicate, arguments) facts.
+        """
+        world = self.ontology.world
+        new_parents = defaultdict(list)
+        entity_2_type = {}
+        obj_relations = []
+        data_relations = []
+
+        for kind, predicate, arguments in facts:
+            if kind == "class":
+                new_parents[arguments[0].storid].append(predicate.storid)
+                entity_2_type[arguments[0].storid] = "individual"
+            elif isinstance(predicate, ObjectPropertyClass):
+                # The memories already hold the inverse relations, so the fact is new in both directions.
+                subject, value = arguments
+                obj_relations.append((subject.storid, predicate, value.storid))
+            else:
+                subject, value = arguments
+                data_relations.append((subject.storid, predicate, value, datatype_abbrev(type(value))))
+
+        if new_parents:
+            # Keep the already asserted parents, as the reasoner results replace the most specific ones.
+            for storid in new_parents:
+                new_parents[storid].extend(parent.storid for parent in world._get_by_storid(storid).is_a if hasattr(parent, "storid"))
+            apply_inferred_types(world, self.ontology, new_parents, entity_2_type)
+        apply_inferred_obj_relations(world, self.ontology, obj_relations)
+        apply_inferred_data_relations(world, self.ontology, data_relations)
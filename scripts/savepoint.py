@@ -0,0 +1,239 @@
+from owlready2 import *
+import weakref
+
+
+# Columns of the quadstore tables naming the entities a triple changes: the subject, and the object of the object properties
+# (whose inverse values are cached on it).
+TOUCHED_COLUMNS = {"objs": ("s", "o"), "datas": ("s",)}
+
+
+def invalidate_world_caches(world, storids=None):
+    """
+    Drops the cached property values of the loaded individuals of a world, and the individuals
+    whose types in the quadstore differ from the cached ones (they are loaded again on the next access).
+    Used once the quadstore has been changed behind owlready2.
+    Args:
+        world (World): The owlready2 world.
+        storids (iterable): The storids of the entities whose triples changed, None for every loaded entity.
+    """
+    if storids is None:
+        entities = list(world._entities.items())
+    else:
+        entities = [(storid, world._entities.get(storid)) for storid in storids]
+    for storid, entity in entities:
+        if not isinstance(entity, Thing):
+            continue
+        for name in [name for name in entity.__dict__ if name in world._props]:
+            del entity.__dict__[name]
+
+        types = set(world._get_obj_triples_sp_o(storid, rdf_type)) - {owl_named_individual}
+        cached = set(parent.storid for parent in entity.is_a if hasattr(parent, "storid"))
+        if types != cached:
+            world._entities.pop(storid, None)
+
+
+class TouchedStorids:
+    """
+    TouchedStorids records the storids of the entities whose triples are inserted, deleted or updated in
+    the quadstore of a world, whoever writes them (owlready2, the BulkTripleLoader or the rule engines).
+    Temporary triggers on the objs and datas tables call a Python function of the connection, so the
+    records are kept in Python: unlike the rows of a table, they are not undone by a rollback. A rollback
+    changes triples back without firing the triggers, so WorldSavepoint records the entities it restores
+    in every tracker of the world (see rolled_back).
+
+    NOTE: The triggers are part of the schema. Created inside a savepoint, they are dropped again when
+    it is rolled back; active() tells whether they are still in place.
+    """
+
+    # The trackers of all the worlds, for rolled_back.
+    trackers = weakref.WeakSet()
+
+    def __init__(self, world, name):
+        """
+        Creates the triggers.
+        Args:
+            world (World): The owlready2 world.
+            name (str): The prefix of the function and triggers, unique per tracker of a world.
+        """
+        self.world = world
+        self.name = name
+        self.storids = set()
+        self.function = f"{name}_touch"
+        self.triggers = []
+        db = world.graph.db
+        db.create_function(self.function, -1, self.touch)
+        for table, columns in TOUCHED_COLUMNS.items():
+            for event, rows in [("INSERT", ["new"]), ("DELETE", ["old"]), ("UPDATE", ["old", "new"])]:
+                trigger = f"{name}_{table}_{event.lower()}"
+                arguments = ", ".join(f"{row}.{column}" for row in rows for column in columns)
+                db.execute(f"""CREATE TEMP TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON main.{table}
+                               BEGIN SELECT {self.function}({arguments}); END""")
+                self.triggers.append(trigger)
+        TouchedStorids.trackers.add(self)
+
+
+    @classmethod
+    def rolled_back(cls, world, storids):
+        """
+        Records the storids whose triples a rollback of world restored in every tracker of the world.
+        """
+        for tracker in list(cls.trackers):
+            if tracker.world is world and tracker.triggers:
+                tracker.storids.update(storids)
+
+
+    def touch(self, *storids):
+        self.storids.update(storids)
+
+
+    def take(self):
+        """
+        Returns the storids recorded since the last take() or clear(), and forgets them.
+        """
+        storids, self.storids = self.storids, set()
+        return storids
+
+
+    def clear(self):
+        self.storids = set()
+
+
+    def active(self):
+        """
+        Whether all the triggers are in place (see the note of the class).
+        """
+        placeholders = ", ".join("?" * len(self.triggers))
+        count = self.world.graph.db.execute(
+            f"SELECT count(*) FROM sqlite_temp_master WHERE type = 'trigger' AND name IN ({placeholders})", self.triggers
+        ).fetchone()[0]
+        return count == len(self.triggers)
+
+
+    def close(self):
+        """
+        Drops the triggers and the function.
+        """
+        db = self.world.graph.db
+        for trigger in self.triggers:
+            db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        db.create_function(self.function, -1, None)
+        self.triggers = []
+        TouchedStorids.trackers.discard(self)
+
+
+class WorldSavepoint:
+    """
+    WorldSavepoint restores the quadstore of a world to an earlier state with an SQLite savepoint,
+    in one operation whose cost depends on the number of triples changed since the savepoint.
+
+    After a rollback the Python side of owlready2 is brought back in line with the quadstore:
+    the cached property values of the individuals whose triples changed since begin() are dropped
+    (to be read again on the next access), and those whose types changed (or that were created after
+    the savepoint) are dropped from the world's cache of entities. The changed entities are recorded
+    by a TouchedStorids, so the rollback costs no more than the triples of the row, however many
+    entities are loaded.
+
+    NOTE: A commit of the world (world.save()) releases the savepoint, so the world must not be
+    saved between begin() and rollback(). Entities created after the savepoint must not be kept
+    by the caller after a rollback. close() drops the triggers once the savepoint is no longer used.
+    """
+
+    def __init__(self, world, name="row", entity_index=None):
+        """
+        Args:
+            world (World): The owlready2 world.
+            name (str): The name of the SQLite savepoint.
+            entity_index (EntityIndex): An optional index refreshed after every rollback.
+        """
+        self.world = world
+        self.name = name
+        self.entity_index = entity_index
+        self.active = False
+        self.touched = None
+
+
+    def begin(self):
+        """
+        Marks the current state of the quadstore.
+        """
+        if self.active:
+            raise RuntimeError(f"Savepoint {self.name} already active.")
+        if self.touched is None:
+            # Outside of the savepoint, whose rollback would drop the triggers
+            self.touched = TouchedStorids(self.world, self.name)
+        self.touched.clear()
+        db = self.world.graph.db
+        db.execute(f"SAVEPOINT {self.name}")
+        self.current_resource, self.current_blank = self.world.graph.execute("SELECT current_resource, current_blank FROM store").fetchone()
+        self.active = True
+
+
+    def release(self):
+        """
+        Keeps the changes made since begin() and drops the savepoint.
+        """
+        if self.active:
+            self.world.graph.db.execute(f"RELEASE {self.name}")
+            self.active = False
+
+
+    def rollback(self):
+        """
+        Restores the quadstore to its state at begin(), drops the savepoint and
+        invalidates the Python caches of the world.
+        """
+        if not self.active:
+            raise RuntimeError(f"Savepoint {self.name} is not active.")
+        db = self.world.graph.db
+        touched = self.touched.take()
+        db.execute(f"ROLLBACK TO {self.name}")
+        db.execute(f"RELEASE {self.name}")
+        self.active = False
+        TouchedStorids.rolled_back(self.world, touched)
+        self.drop_created_entities(touched)
+        self.invalidate_caches(touched)
+
+
+    def drop_created_entities(self, touched):
+        """
+        Drops the entities and blank nodes created after begin(), whose storids are given again to the next ones
+        (e.g. rules created again with other atoms). A created entity has triples, so it is one of the touched storids.
+        """
+        created = [storid for storid in touched if storid > self.current_resource or storid < -self.current_blank]
+        for storid in created:
+            self.world._entities.pop(storid, None)
+        for ontology in self.world.ontologies.values():
+            for storid in created:
+                ontology._bnodes.pop(storid, None)
+
+
+    def invalidate_caches(self, touched):
+        """
+        Drops the cached property values of the touched individuals, and those
+        whose types in the quadstore differ from the cached ones.
+        """
+        invalidate_world_caches(self.world, touched)
+        if self.entity_index is not None:
+            self.entity_index.refresh()
+
+
+    def close(self):
+        """
+        Drops the triggers recording the touched storids.
+        """
+        if self.active:
+            raise RuntimeError(f"Savepoint {self.name} is still active.")
+        if self.touched is not None:
+            self.touched.close()
+            self.touched = None
+
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.active:
+            self.rollback()
+        return False
@@ -0,0 +1,125 @@
+from owlready2 import *
+from scripts.batch_rule_creator import BatchRuleCreator
+from scripts.fingerprint import file_digest
+import pandas as pd
+import json
+import shutil
+import tempfile
+
+
+# Record run through the parser while building a snapshot, so that every singleton instance
+# (hr_instance, age_instance, ...) and every rule depending on them is created.
+WARMUP_RECORD = {
+    "HR": 70, "RR": 15, "HRV": 60, "SPO2": 97, "DROWSY": 1,
+    "Demographic": "American", "Age": 30, "Sex": "Man", "Accessories": "Glasses", "Characteristics": "Short_hair",
+}
+
+
+def metadata_path(snapshot_path):
+    """
+    Returns the path of the JSON file describing a snapshot.
+    """
+    return snapshot_path + ".json"
+
+
+def build_snapshot(ontology_path, snapshot_path, logger, mode="serial", reasoner="native"):
+    """
+    Builds a snapshot of the ontology ready to be parsed: an owlready2 SQLite quadstore holding
+    the ontology together with the rules, band individuals and singleton instances created by the
+    parser, so that opening it skips the RDF/XML parsing and the creation of the rules.
+
+    In "serial" mode WARMUP_RECORD goes once through OntologyParser.parse_rows and the values it
+    leaves are removed, as between two rows of the serial path. In "batch" mode the rules of the
+    BatchRuleCreator are created.
+
+    NOTE: The snapshot is only valid for the mode it has been built for (see BatchRuleCreator).
+
+    Args:
+      - ontology_path: The path to the ontology file (in_cabin_domain.rdf).
+      - snapshot_path: The path of the SQLite quadstore to write.
+      - logger: The logger used while building the snapshot.
+      - mode: "serial" (OntologyParser.parse_rows) or "batch" (OntologyParser.parse_rows_batch).
+      - reasoner: The reasoner used by the warm-up record.
+    Returns:
+      - The path of the snapshot.
+    """
+    from scripts.ontology_parser import OntologyParser
+
+    if mode not in ("serial", "batch"):
+        raise ValueError(f"Unknown snapshot mode '{mode}'.")
+    for path in (snapshot_path, metadata_path(snapshot_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+    parser = OntologyParser(ontology_path, logger, reasoner=reasoner, world=World(filename=snapshot_path))
+    try:
+        if mode == "serial":
+            warmup = pd.DataFrame([WARMUP_RECORD], index=[-1])
+            parser.parse_rows([warmup], None)
+            # Drop the identifier and description left by the warm-up label.
+            with parser.ontology:
+                for individual in list(parser.ontology.Actor.instances()) + list(parser.ontology.Label.instances()):
+                    individual.hasUniqueIdentifier = []
+                    if isinstance(individual, parser.ontology.Label):
+                        individual.hasDescription = []
+                        individual.LabelTargetsActor = []
+        else:
+            parser.batch_rule_parser = BatchRuleCreator(parser)
+            parser.batch_rule_parser.set_up_batch_rules()
+
+        rules = len(list(parser.world.rules()))
+        base_iri = parser.ontology.base_iri
+        parser.world.save()
+    finally:
+        parser.close()
+        parser.world.close()
+
+    metadata = {
+        "mode": mode,
+        "base_iri": base_iri,
+        "source": os.path.abspath(ontology_path),
+        "source_digest": file_digest(ontology_path),
+        "rules": rules,
+    }
+    with open(metadata_path(snapshot_path), "w") as f:
+        json.dump(metadata, f, indent=4)
+    logger.info(f"Snapshot with {rules} rules saved in {snapshot_path}.")
+    return snapshot_path
+
+
+def open_snapshot(snapshot_path, ontology_path=None):
+    """
+    Opens a private copy of a snapshot, so that the snapshot itself is never modified and can be
+    shared by many parsers and processes.
+
+    Args:
+      - snapshot_path: The path of the snapshot built by build_snapshot.
+      - ontology_path: If given, the snapshot must have been built from this file, in its current version.
+    Returns:
+      - (world, ontology, metadata, path of the private copy)
+    """
+    with open(metadata_path(snapshot_path)) as f:
+        metadata = json.load(f)
+    if ontology_path is not None and file_digest(ontology_path) != metadata["source_digest"]:
+        raise ValueError(f"Snapshot {snapshot_path} is out of date with {ontology_path}, rebuild it with build_snapshot.")
+
+    handle, copy_path = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(handle)
+    shutil.copyfile(snapshot_path, copy_path)
+    world = World(filename=copy_path)
+    ontology = world.get_ontology(metadata["base_iri"])
+    return world, ontology, metadata, copy_path
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    arg_parser = argparse.ArgumentParser(description="Build a snapshot of the ontology with the rules already created.")
+    arg_parser.add_argument("ontology_path", help="The ontology file, e.g. ontologies/in_cabin_domain.rdf")
+    arg_parser.add_argument("snapshot_path", help="The SQLite quadstore to write, e.g. ontologies/in_cabin_domain.sqlite3")
+    arg_parser.add_argument("--mode", choices=["serial", "batch"], default="serial")
+    arg_parser.add_argument("--reasoner", choices=["pellet", "pellet_session", "native", "sql"], default="native")
+    args = arg_parser.parse_args()
+    build_snapshot(os.path.abspath(args.ontology_path), args.snapshot_path, logging.getLogger(__name__), args.mode, args.reasoner)
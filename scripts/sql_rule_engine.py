@@ -0,0 +1,323 @@
+from owlready2 import *
+from scripts.rule_engine import CompiledRule, Var
+from scripts.owlready_compat import datatype_abbrev
+from scripts.savepoint import invalidate_world_caches
+
+
+# SQL operators of the comparison built-ins.
+SQL_COMPARISONS = {
+    "equal": "=",
+    "notEqual": "!=",
+    "lessThan": "<",
+    "lessThanOrEqual": "<=",
+    "greaterThan": ">",
+    "greaterThanOrEqual": ">=",
+}
+
+# SQL expressions of the arithmetic built-ins, given the expressions of their inputs.
+SQL_ARITHMETIC = {
+    "add": lambda *inputs: "(" + " + ".join(inputs) + ")",
+    "subtract": lambda a, b: f"({a} - {b})",
+    "multiply": lambda a, b: f"({a} * {b})",
+    "divide": lambda a, b: f"(CAST({a} AS REAL) / {b})",
+    "abs": lambda a: f"abs({a})",
+}
+
+
+# Temporary table holding both directions of the inverse properties used by the rules:
+# (p, s, o) for a triple (s, p, o) and (inverse of p, o, s), indexed on p so that the rules join it.
+INVERSE_TABLE = "rule_inverse_objs"
+
+
+def is_number(expression):
+    return f"typeof({expression}) IN ('integer', 'real')"
+
+
+def sql_literal(value):
+    """
+    Returns a constant argument of a rule (individual, class or literal) as an SQL literal.
+    """
+    if hasattr(value, "storid"):
+        return str(value.storid)
+    if isinstance(value, (bool, int, float)):
+        return repr(int(value) if isinstance(value, bool) else value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sql_list(values):
+    return "(" + ", ".join(str(value) for value in values) + ")"
+
+
+class SQLRule:
+    """
+    A SWRL rule translated into one INSERT ... SELECT statement per head atom, over the objs (relations and
+    class memberships) and datas (values) tables of the quadstore. Every body atom is a table of the join,
+    every variable is the column of its first atom, and its other occurrences and the built-ins are conditions.
+    The constants of the rule are written in the statements, so that SQLite prepares them only once.
+    """
+
+    def __init__(self, imp, ontology):
+        """
+        Args:
+            imp (Imp): The owlready2 rule to translate.
+            ontology (Ontology): The ontology receiving the inferred triples.
+        """
+        self.compiled = CompiledRule(imp)
+        self.ontology = ontology
+        self.predicates = self.compiled.predicates
+        self.inverse_properties = set()
+        self.tables = []
+        self.conditions = []
+        self.columns = {}
+        self.datatypes = {}
+        for atom in self.compiled.body:
+            if atom[0] != "builtin":
+                self.join(atom)
+        self.add_builtins([atom for atom in self.compiled.body if atom[0] == "builtin"])
+        self.statements = [(atom[1], self.insert(atom)) for atom in self.compiled.head]
+
+
+    def expression(self, argument):
+        """
+        Returns the SQL expression of an argument: the column (or built-in result) of a variable, or a literal.
+        """
+        return self.columns[argument] if isinstance(argument, Var) else sql_literal(argument)
+
+
+    def bind(self, argument, column, datatype=None):
+        """
+        Binds a variable to a column on its first occurrence, or adds an equality condition.
+        """
+        if isinstance(argument, Var) and argument not in self.columns:
+            self.columns[argument] = column
+            if datatype is not None:
+                self.datatypes[argument] = datatype
+        else:
+            self.conditions.append(f"{column} = {self.expression(argument)}")
+
+
+    @staticmethod
+    def class_storids(cls):
+        return [cls.storid] + [descendant.storid for descendant in cls.descendants(include_self=False)]
+
+
+    def join(self, atom):
+        """
+        Adds the table of a class or property atom to the join.
+        """
+        kind, predicate, arguments = atom
+        alias = f"t{len(self.tables)}"
+        if kind == "class":
+            self.tables.append(f"objs {alias}")
+            self.conditions.append(f"{alias}.p = {rdf_type} AND {alias}.o IN {sql_list(self.class_storids(predicate))}")
+            self.bind(arguments[0], f"{alias}.s")
+        elif isinstance(predicate, ObjectPropertyClass):
+            if getattr(predicate, "inverse_property", None) is not None:
+                self.inverse_properties.add(predicate)
+                self.tables.append(f"{INVERSE_TABLE} {alias}")
+            else:
+                self.tables.append(f"objs {alias}")
+            self.conditions.append(f"{alias}.p = {predicate.storid}")
+            self.bind(arguments[0], f"{alias}.s")
+            self.bind(arguments[1], f"{alias}.o")
+        else:
+            self.tables.append(f"datas {alias}")
+            self.conditions.append(f"{alias}.p = {predicate.storid}")
+            self.bind(arguments[0], f"{alias}.s")
+            self.bind(arguments[1], f"{alias}.o", f"{alias}.d")
+
+
+    def add_builtins(self, builtins):
+        """
+        Turns the built-ins into conditions, in the order their inputs get bound (arithmetic built-ins
+        bind their first argument). Comparing a number with a string never matches, as in Python.
+        """
+        while builtins:
+            ready = [atom for atom in builtins if all(
+                not isinstance(arg, Var) or arg in self.columns for arg in (atom[2][1:] if atom[1] in SQL_ARITHMETIC else atom[2])
+            )]
+            if not ready:
+                raise ValueError(f"Rule '{self.compiled.imp}' has built-ins with unbound variables.")
+            for _, name, arguments in ready:
+                if name in SQL_COMPARISONS:
+                    a, b = (self.expression(arg) for arg in arguments)
+                    self.conditions.append(f"{a} {SQL_COMPARISONS[name]} {b} AND ({is_number(a)}) = ({is_number(b)})")
+                    continue
+                inputs = [self.expression(arg) for arg in arguments[1:]]
+                self.conditions.append(" AND ".join(is_number(expression) for expression in inputs))
+                result = SQL_ARITHMETIC[name](*inputs)
+                if isinstance(arguments[0], Var) and arguments[0] not in self.columns:
+                    self.columns[arguments[0]] = result
+                else:
+                    self.conditions.append(f"{self.expression(arguments[0])} = {result}")
+            builtins = [atom for atom in builtins if atom not in ready]
+
+
+    def insert(self, atom):
+        """
+        Returns the INSERT statement adding the new triples of a head atom.
+        """
+        kind, predicate, arguments = atom
+        values = [self.expression(arg) for arg in arguments]
+        c = self.ontology.graph.c
+        if kind == "class":
+            table, select = "objs (c, s, p, o)", f"{c}, {values[0]}, {rdf_type}, {predicate.storid}"
+            known = f"SELECT 1 FROM objs e WHERE e.s = {values[0]} AND e.p = {rdf_type} AND e.o IN {sql_list(self.class_storids(predicate))}"
+        elif isinstance(predicate, ObjectPropertyClass):
+            subject, value = values
+            table, select = "objs (c, s, p, o)", f"{c}, {subject}, {predicate.storid}, {value}"
+            if getattr(predicate, "inverse_property", None) is not None:
+                self.inverse_properties.add(predicate)
+                known = f"SELECT 1 FROM {INVERSE_TABLE} e WHERE e.p = {predicate.storid} AND e.s = {subject} AND e.o = {value}"
+            else:
+                known = f"SELECT 1 FROM objs e WHERE e.s = {subject} AND e.p = {predicate.storid} AND e.o = {value}"
+        else:
+            subject, value = values
+            if not isinstance(arguments[1], Var):
+                datatype = datatype_abbrev(type(arguments[1]))
+            elif arguments[1] in self.datatypes:
+                datatype = self.datatypes[arguments[1]]
+            else:
+                datatype = f"CASE typeof({value}) WHEN 'integer' THEN {datatype_abbrev(int)} ELSE {datatype_abbrev(float)} END"
+            table, select = "datas (c, s, p, o, d)", f"{c}, {subject}, {predicate.storid}, {value}, {datatype}"
+            known = f"SELECT 1 FROM datas e WHERE e.s = {subject} AND e.p = {predicate.storid} AND e.o = {value}"
+
+        conditions = " AND ".join([f"({condition})" for condition in self.conditions] + [f"NOT EXISTS ({known})"])
+        return f"INSERT INTO {table} SELECT DISTINCT {select} FROM {', '.join(self.tables)} WHERE {conditions}"
+
+
+class SQLRuleEngine:
+    """
+    Rule engine evaluating the SWRL rules of the ontology as SQL statements over the owlready2 quadstore.
+
+    Every rule is an INSERT ... SELECT joining the tables of its body atoms: one statement infers the head
+    facts for every observation loaded in the world at once, with the indexes of the quadstore carrying the
+    joins. The object properties with an inverse are read from a temporary table holding both of their
+    directions, filled at the start of every run and kept up to date with the facts inferred for them
+    (the quadstore has no index to look them up by property). The rules run on the agenda of the
+    ForwardChainingEngine (a rule runs again only when a predicate of its body received new facts),
+    until no statement inserts anything.
+
+    The Python caches of owlready2 are then brought in line with the quadstore: the cached values of the
+    properties that received facts are dropped, and the individuals that gained classes are reloaded.
+
+    NOTE: The same subset of SWRL as the ForwardChainingEngine is supported. The subclasses of a class
+    atom are read when the rules are compiled, the rules are compiled again when the rule set changes.
+    """
+
+    def __init__(self, ontology, logger):
+        """
+        Args:
+            ontology (Ontology): The ontology holding the rules and receiving the inferred facts.
+            logger (Logger): The logger of the OntologyParser.
+        """
+        self.ontology = ontology
+        self.logger = logger
+        self.rules = []
+        self.rule_ids = None
+        self.inverses = {}
+
+
+    def compile_rules(self):
+        """
+        Translates the rules of the ontology. Rules are only translated again when the rule set changed.
+        """
+        rules = list(self.ontology.world.rules())
+        rule_ids = frozenset(rule.storid for rule in rules)
+        if rule_ids != self.rule_ids:
+            self.rules = [SQLRule(rule, self.ontology) for rule in rules]
+            self.rule_ids = rule_ids
+            self.inverses = {}
+            for predicate in set().union(*(rule.inverse_properties for rule in self.rules)):
+                self.inverses[predicate.storid] = predicate.inverse_property.storid
+                self.inverses[predicate.inverse_property.storid] = predicate.storid
+            self.logger.info(f"SQL engine compiled {len(self.rules)} rules.")
+        return self.rules
+
+
+    def reset(self):
+        """
+        Forgets the compiled rules, so that they are compiled again at the next run. To be called when the
+        rules were removed from the world and created again (e.g. by a rollback), since they get the same storids.
+        """
+        self.rules = []
+        self.rule_ids = None
+        self.inverses = {}
+
+
+    def changed_predicates(self, predicate):
+        """
+        Returns the predicates whose facts change when the predicate receives a fact.
+        """
+        if isinstance(predicate, ThingClass):
+            return set(predicate.ancestors())
+        inverse = getattr(predicate, "inverse_property", None)
+        return {predicate} if inverse is None else {predicate, inverse}
+
+
+    def copy_inverses(self, db, after=0):
+        """
+        Copies the triples of the inverse properties with a rowid above after into the INVERSE_TABLE, in both directions.
+        """
+        if not self.inverses:
+            return
+        properties = sql_list(self.inverses)
+        inverse = "CASE p " + " ".join(f"WHEN {p} THEN {i}" for p, i in self.inverses.items()) + " END"
+        db.execute(f"INSERT OR IGNORE INTO {INVERSE_TABLE} SELECT p, s, o FROM objs WHERE p IN {properties} AND rowid > {after}")
+        db.execute(f"INSERT OR IGNORE INTO {INVERSE_TABLE} SELECT {inverse}, o, s FROM objs WHERE p IN {properties} AND rowid > {after}")
+
+
+    def create_inverse_table(self, db):
+        """
+        Creates (or empties) the INVERSE_TABLE of the connection and fills it from the quadstore.
+        """
+        db.execute(f"CREATE TEMP TABLE IF NOT EXISTS {INVERSE_TABLE} (p INTEGER, s INTEGER, o INTEGER, PRIMARY KEY (p, s, o)) WITHOUT ROWID")
+        db.execute(f"CREATE INDEX IF NOT EXISTS temp.{INVERSE_TABLE}_pos ON {INVERSE_TABLE}(p, o, s)")
+        db.execute(f"DELETE FROM {INVERSE_TABLE}")
+        self.copy_inverses(db)
+
+
+    def run(self):
+        """
+        Runs the rules to a fixpoint. Returns the number of inferred facts.
+        """
+        rules = self.compile_rules()
+        db = self.ontology.world.graph.db
+        self.create_inverse_table(db)
+        inferred = 0
+        all_changed = set()
+        agenda = list(rules)
+        while agenda:
+            changed = set()
+            for rule in agenda:
+                for predicate, statement in rule.statements:
+                    inverse = getattr(predicate, "storid", None) in self.inverses
+                    if inverse:
+                        last = db.execute("SELECT max(rowid) FROM objs").fetchone()[0] or 0
+                    count = db.execute(statement).rowcount
+                    if count > 0:
+                        if inverse:
+                            self.copy_inverses(db, last)
+                        inferred += count
+                        changed.update(self.changed_predicates(predicate))
+            all_changed.update(changed)
+            agenda = [rule for rule in rules if rule.predicates & changed]
+
+        if all_changed:
+            self.invalidate(all_changed)
+        return inferred
+
+
+    def invalidate(self, changed):
+        """
+        Drops the Python caches of owlready2 made stale by the inserted facts.
+        """
+        world = self.ontology.world
+        if any(isinstance(predicate, ThingClass) for predicate in changed):
+            invalidate_world_caches(world)
+            return
+        names = [predicate.python_name for predicate in changed]
+        for entity in list(world._entities.values()):
+            if isinstance(entity, Thing):
+                for name in names:
+                    entity.__dict__.pop(name, None)
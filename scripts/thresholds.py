@@ -0,0 +1,163 @@
+from owlready2 import *
+from scripts.rule_creator import AGE_RULES
+import bisect
+import numpy as np
+import pandas as pd
+
+
+# Threshold ranges of the determine_HR/HRV/RR/spo2 rules, for every vital sign:
+# (band, lower bound, lower inclusive, upper bound, upper inclusive).
+# Bounds are either the level of a threshold individual (e.g. "low" for low_hr_adult), a number or None.
+VITAL_BANDS = {
+    "HR": [
+        ("Low_HR", 0, False, "low", False),
+        ("Slightly_Low_HR", "low", True, "moderate", False),
+        ("Moderate_HR", "moderate", True, "high", False),
+        ("High_HR", "high", True, None, False),
+    ],
+    "HRV": [
+        ("Very_Low_HRV", 0, False, "low", False),
+        ("Low_HRV", "low", True, "moderate", False),
+        ("Moderate_HRV", "moderate", True, "high", False),
+        ("High_HRV", "high", True, None, False),
+    ],
+    "RR": [
+        ("Very_Low_RR", 0, False, "low", False),
+        ("Low_RR", "low", True, "moderate", False),
+        ("Moderate_RR", "moderate", True, "high", False),
+        ("High_RR", "high", True, None, False),
+    ],
+    "SpO2": [
+        ("Critical_SpO2", None, False, "low", False),
+        ("Low_SpO2", "low", True, "moderate", False),
+        ("Normal_SpO2", "moderate", True, "high", True),
+    ],
+}
+
+# Dataset column holding the values of every vital sign.
+VITAL_COLUMNS = {"HR": "HR", "HRV": "HRV", "RR": "RR", "SpO2": "SPO2"}
+
+
+class ThresholdRegistry:
+    """
+    ThresholdRegistry reads the threshold individuals of the ontology (low_hr_adult, moderate_hrv_old, ...)
+    once, and turns the bands of VITAL_BANDS into one sorted array of cut points per vital sign and age group,
+    so that the band of a value is found by bisection instead of going through the reasoner.
+
+    The bands of a vital sign must be contiguous, every band starting (inclusive) where the previous one
+    ends (exclusive), as in the determine_HR/HRV/RR/spo2 rules. The cut points of an age group must not
+    decrease, equal cut points give an empty band (e.g. Slightly_Low_HR for Old).
+    """
+
+    def __init__(self, ontology):
+        """
+        Args:
+            ontology (Ontology): The ontology holding the *_THR individuals.
+        """
+        self.ontology = ontology
+        self.age_groups = [rule[0] for rule in AGE_RULES]
+        self.band_names = {vital: [band[0] for band in bands] for vital, bands in VITAL_BANDS.items()}
+        self.thresholds = self.load_thresholds()
+        self.intervals = {vital: self.build_intervals(vital) for vital in VITAL_BANDS}
+
+
+    def load_thresholds(self):
+        """
+        Reads the threshold individuals (e.g. low_hr_adult) into a
+        {vital: {age group: {level: value}}} dictionary.
+        """
+        thresholds = {vital: {group: {} for group in self.age_groups} for vital in VITAL_BANDS}
+        groups = {group.lower(): group for group in self.age_groups}
+        for vital in VITAL_BANDS:
+            thr_class = getattr(self.ontology, f"{vital}_THR")
+            for individual in thr_class.instances():
+                level, _, group = individual.name.split("_")
+                if group in groups and individual.hasThrValue:
+                    thresholds[vital][groups[group]][level] = float(individual.hasThrValue[0])
+        return thresholds
+
+
+    def build_intervals(self, vital):
+        """
+        Returns the cut points and outer bounds of a vital sign for every age group with all its thresholds:
+        {age group: (cut points, lower bound, lower inclusive, upper bound, upper inclusive)}.
+        """
+        bands = VITAL_BANDS[vital]
+        for (name, _, _, upper, upper_inclusive), (next_name, lower, lower_inclusive, _, _) in zip(bands, bands[1:]):
+            if upper != lower or upper_inclusive or not lower_inclusive:
+                raise ValueError(f"Bands {name} and {next_name} of {vital} are not contiguous.")
+
+        levels_used = set(bound for band in bands for bound in (band[1], band[3]) if isinstance(bound, str))
+        intervals = {}
+        for group in self.age_groups:
+            levels = self.thresholds[vital][group]
+            if not levels_used <= set(levels):
+                continue
+            bounds = [levels.get(band[3], band[3]) for band in bands[:-1]]
+            lower, upper = levels.get(bands[0][1], bands[0][1]), levels.get(bands[-1][3], bands[-1][3])
+            cuts = np.array(bounds, dtype=float)
+            if np.any(np.diff(cuts) < 0):
+                raise ValueError(f"Thresholds of {vital} for {group} are not sorted: {bounds}.")
+            intervals[group] = (cuts, lower, bands[0][2], upper, bands[-1][4])
+        return intervals
+
+
+    @staticmethod
+    def in_bounds(values, lower, lower_inclusive, upper, upper_inclusive):
+        """
+        Whether the values (scalar or array) lie between the outer bounds of the bands, a None bound always matches.
+        """
+        inside = values == values
+        if lower is not None:
+            inside &= values >= lower if lower_inclusive else values > lower
+        if upper is not None:
+            inside &= values <= upper if upper_inclusive else values < upper
+        return inside
+
+
+    def code(self, vital, age_group, value):
+        """
+        Returns the position of the band of a single value in VITAL_BANDS[vital], -1 if it has none.
+        """
+        interval = self.intervals[vital].get(age_group)
+        if interval is None or value is None or not self.in_bounds(float(value), *interval[1:]):
+            return -1
+        return bisect.bisect_right(interval[0], value)
+
+
+    def codes(self, vital, age_groups, values):
+        """
+        Returns the positions of the bands of the values in VITAL_BANDS[vital], -1 where there is none.
+        Args:
+            vital (str): HR, HRV, RR or SpO2.
+            age_groups (str or array-like): The age group of all the values, or of every value (None when missing).
+            values (array-like): The values, NaN when missing.
+        """
+        values = np.asarray(values, dtype=float)
+        codes = np.full(values.shape, -1)
+        if isinstance(age_groups, str):
+            group_codes = np.full(values.shape, self.age_groups.index(age_groups) if age_groups in self.age_groups else -1)
+        else:
+            group_codes = np.asarray(pd.Categorical(age_groups, categories=self.age_groups).codes)
+        for group, (cuts, *bounds) in self.intervals[vital].items():
+            rows = (group_codes == self.age_groups.index(group)) & self.in_bounds(values, *bounds)
+            codes[rows] = np.searchsorted(cuts, values[rows], side="right")
+        return codes
+
+
+    def band(self, vital, age_group, values):
+        """
+        Returns the band of the values of a vital sign.
+        Args:
+            vital (str): HR, HRV, RR or SpO2.
+            age_group (str or array-like): The age group of all the values, or of every value.
+            values (number or array-like): A single value or an array of values.
+        Returns:
+            The name of the band (None if it has none) for a single value,
+            a Categorical of the band names (missing if none) for an array.
+        """
+        names = self.band_names[vital]
+        if np.ndim(values) == 0:
+            code = self.code(vital, age_group, values)
+            return names[code] if code >= 0 else None
+        return pd.Categorical.from_codes(self.codes(vital, age_group, values), categories=names)
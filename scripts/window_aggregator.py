@@ -0,0 +1,185 @@
+from scripts.observation_reader import OBSERVATION_SCHEMA
+from collections import Counter, deque
+import pandas as pd
+
+
+# Numerical columns averaged over a window, with their minimum and maximum.
+WINDOW_VITALS = ["HR", "RR", "HRV", "SPO2"]
+
+# Column whose most frequent value over a window is kept.
+WINDOW_MODE_COLUMN = "DROWSY"
+
+# Columns taken from the last sample of a window.
+WINDOW_LAST_COLUMNS = ["Demographic", "Age", "Sex", "Accessories", "Characteristics"]
+
+
+class WindowAggregator:
+    """
+    WindowAggregator turns the samples of an observation log into windows of its TIME column, so that the
+    reasoner runs once per window instead of once per sample. Windows of size seconds start every step
+    seconds: tumbling windows when step equals size (the default), sliding windows when step is smaller.
+
+    Every window is a row with the columns of OBSERVATION_SCHEMA, so it goes through the parser like a sample:
+    HR, RR, HRV and SPO2 hold the mean of the window (rounded, as the ontology stores integers), DROWSY its
+    most frequent value (the highest on a tie), and the characteristics (Age, Sex, ...) are the ones of the last
+    sample. The columns {vital}_MEAN, {vital}_MIN, {vital}_MAX and SAMPLES are added, TIME is the start of the window.
+
+    The sums, counts and mode are updated when a sample enters or leaves the window, and the minimum and maximum
+    are kept in monotonic queues, so every sample costs O(1) (amortized) whatever the size of the window.
+    Samples without TIME are skipped, and the samples must come in time order.
+    """
+
+    def __init__(self, size, step=None):
+        """
+        Args:
+            size (float): The length of a window in seconds.
+            step (float): The time in seconds between the starts of two windows, at most size (the default).
+        """
+        step = size if step is None else step
+        if size <= 0 or step <= 0 or step > size:
+            raise ValueError("Window size and step must be positive, with a step not larger than the size.")
+        self.size = int(size * 1e9)
+        self.step = int(step * 1e9)
+        self.start = None
+        self.sequence = 0
+        self.samples = deque()
+        self.sums = {vital: 0 for vital in WINDOW_VITALS}
+        self.counts = {vital: 0 for vital in WINDOW_VITALS}
+        self.minimums = {vital: deque() for vital in WINDOW_VITALS}
+        self.maximums = {vital: deque() for vital in WINDOW_VITALS}
+        self.modes = Counter()
+        self.windows_total = 0
+        self.samples_total = 0
+        self.skipped_total = 0
+
+
+    def push(self, time, record):
+        """
+        Adds a sample to the current window.
+        """
+        self.sequence += 1
+        self.samples.append((self.sequence, time, record))
+        for vital in WINDOW_VITALS:
+            value = record.get(vital)
+            if value is None or pd.isna(value):
+                continue
+            self.sums[vital] += value
+            self.counts[vital] += 1
+            minimums, maximums = self.minimums[vital], self.maximums[vital]
+            while minimums and minimums[-1][1] >= value:
+                minimums.pop()
+            minimums.append((self.sequence, value))
+            while maximums and maximums[-1][1] <= value:
+                maximums.pop()
+            maximums.append((self.sequence, value))
+        mode = record.get(WINDOW_MODE_COLUMN)
+        if mode is not None and not pd.isna(mode):
+            self.modes[mode] += 1
+
+
+    def evict(self):
+        """
+        Removes the samples older than the start of the current window.
+        """
+        while self.samples and self.samples[0][1] < self.start:
+            sequence, _, record = self.samples.popleft()
+            for vital in WINDOW_VITALS:
+                value = record.get(vital)
+                if value is None or pd.isna(value):
+                    continue
+                self.sums[vital] -= value
+                self.counts[vital] -= 1
+                for extremes in (self.minimums[vital], self.maximums[vital]):
+                    if extremes and extremes[0][0] == sequence:
+                        extremes.popleft()
+            mode = record.get(WINDOW_MODE_COLUMN)
+            if mode is not None and not pd.isna(mode):
+                self.modes[mode] -= 1
+                if not self.modes[mode]:
+                    del self.modes[mode]
+
+
+    def emit(self):
+        """
+        Returns the row describing the current window.
+        """
+        last = self.samples[-1][2]
+        window = {"TIME": pd.Timestamp(self.start), "SAMPLES": len(self.samples)}
+        for vital in WINDOW_VITALS:
+            if self.counts[vital]:
+                mean = self.sums[vital] / self.counts[vital]
+                window.update({vital: round(mean), f"{vital}_MEAN": mean, f"{vital}_MIN": self.minimums[vital][0][1], f"{vital}_MAX": self.maximums[vital][0][1]})
+            else:
+                window.update({vital: pd.NA, f"{vital}_MEAN": float("nan"), f"{vital}_MIN": pd.NA, f"{vital}_MAX": pd.NA})
+        window[WINDOW_MODE_COLUMN] = max(self.modes.items(), key=lambda item: (item[1], item[0]))[0] if self.modes else pd.NA
+        for column in WINDOW_LAST_COLUMNS:
+            window[column] = last.get(column)
+        self.windows_total += 1
+        return window
+
+
+    def advance(self, time=None):
+        """
+        Closes the windows ending before time (all the windows holding samples if time is None),
+        and returns their rows.
+        """
+        windows = []
+        while self.samples and (time is None or time >= self.start + self.size):
+            windows.append(self.emit())
+            self.start += self.step
+            self.evict()
+        if time is not None and time >= self.start + self.size:
+            # Skip the empty windows of a gap in the log.
+            self.start += ((time - self.start - self.size) // self.step + 1) * self.step
+        return windows
+
+
+    def add(self, time, record):
+        """
+        Adds a sample and returns the rows of the windows it closes.
+        Args:
+            time (int): The TIME of the sample, in nanoseconds.
+            record (dict): The values of the sample.
+        """
+        if self.start is None:
+            self.start = time
+        windows = self.advance(time)
+        self.push(time, record)
+        self.samples_total += 1
+        return windows
+
+
+    def to_frame(self, windows):
+        """
+        Returns the rows of windows as a DataFrame typed with OBSERVATION_SCHEMA, indexed by window number.
+        """
+        frame = pd.DataFrame(windows, index=pd.RangeIndex(self.windows_total - len(windows), self.windows_total))
+        for column, dtype in OBSERVATION_SCHEMA.items():
+            frame[column] = frame[column].astype(dtype) if column in frame else pd.Series(index=frame.index, dtype=dtype)
+        for vital in WINDOW_VITALS:
+            frame[[f"{vital}_MIN", f"{vital}_MAX"]] = frame[[f"{vital}_MIN", f"{vital}_MAX"]].astype("Int64")
+        return frame
+
+
+    def aggregate(self, chunks):
+        """
+        Turns chunks of samples (see read_observations) into chunks of windows.
+        The last windows are closed once the chunks are exhausted.
+        Args:
+            chunks: The observations, as an iterable of DataFrames.
+        Yields:
+            DataFrame chunks of windows, indexed by window number.
+        """
+        for chunk in chunks:
+            missing = chunk["TIME"].isna().to_numpy()
+            self.skipped_total += int(missing.sum())
+            times = chunk["TIME"].to_numpy("datetime64[ns]").astype("int64")
+            windows = []
+            for time, record, skip in zip(times, chunk.to_dict("records"), missing):
+                if not skip:
+                    windows.extend(self.add(int(time), record))
+            if windows:
+                yield self.to_frame(windows)
+        windows = self.advance()
+        if windows:
+            yield self.to_frame(windows)
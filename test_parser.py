@@ -1,5 +1,7 @@
 from owlready2 import * 
 from scripts.ontology_parser import OntologyParser
+from scripts.inference_cache import PersistentInferenceCache
+import argparse
 import logging 
 
 logger = logging.getLogger("owlready2").setLevel(logging.ERROR)
@@ -7,6 +9,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def main():
+    arg_parser = argparse.ArgumentParser(description="Label the first rows of the test set.")
+    arg_parser.add_argument("--persistent-cache", nargs="?", const="ontologies/inference_cache.sqlite3", default=None, 
+                            help="Read the rows labelled by an earlier run from this cache, by default ontologies/inference_cache.sqlite3")
+    args = arg_parser.parse_args()
     logger.info(os.getcwd())
     parent_dir = os.getcwd()
 
@@ -15,7 +21,12 @@ def main():
     dataset_path = os.path.join(parent_dir, "data")
     dataset_file = os.path.join(dataset_path, "test_set_ontology.csv")
     parser = OntologyParser(file, logger)
-    message = parser.parse_observations(dataset_path=dataset_file)
+    # Rows labelled by an earlier run are read from the cache, until the ontology or the rules change.
+    cache = PersistentInferenceCache(args.persistent_cache, file) if args.persistent_cache else None
+    message = parser.parse_observations(dataset_path=dataset_file, max_rows=5, persistent_cache=cache)
+    if cache is not None: 
+        cache.close()
+    parser.close()
     print(message)
 
 if __name__ == "__main__":